@@ -3,7 +3,7 @@
 __author__ = 'Michael Meisinger'
 __license__ = 'Apache 2.0'
 
-import collections, traceback, datetime, time, yaml
+import collections, traceback, datetime, time, yaml, urllib
 import flask, ast, pprint
 from flask import Flask, request, abort
 from gevent.wsgi import WSGIServer
@@ -11,8 +11,10 @@ from gevent.wsgi import WSGIServer
 from pyon.core.exception import NotFound, Inconsistent, BadRequest
 from pyon.core.object import IonObjectBase
 from pyon.core.registry import getextends, model_classes
+from pyon.event.event import EventSubscriber
 from pyon.public import Container, StandaloneProcess, log, PRED, RT, IonObject
 from pyon.util.containers import named_any
+from ion.services.dm.utility.event_history import find_events_page
 
 from interface import objects
 
@@ -31,6 +33,12 @@ EDIT_IGNORE_TYPES = ['list','dict','bool']
 standard_eventattrs = ['origin', 'ts_created', 'description']
 date_fieldnames = ['ts_created', 'ts_updated']
 
+# Number of resources shown per list page by default and at most
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Seconds after which the cached resource lists and the association index are rebuilt even without change events
+CACHE_MAX_AGE = 300
+
 
 class ContainerUI(StandaloneProcess):
     """
@@ -48,13 +56,22 @@ class ContainerUI(StandaloneProcess):
         global containerui_instance
         containerui_instance = self
 
+        #Drop the cached resource lists and association index when resources change
+        self.event_subscriber = EventSubscriber(event_type="ResourceModifiedEvent",
+                                                callback=self._receive_resource_modified_event)
+        self.event_subscriber.activate()
+
         #Start the gevent web server unless disabled
         if self.web_server_enabled:
             self.start_service(self.server_hostname, self.server_port)
 
     def on_quit(self):
+        self.event_subscriber.deactivate()
         self.stop_service()
 
+    def _receive_resource_modified_event(self, event_msg, headers):
+        resource_cache.invalidate(getattr(event_msg, 'origin_type', None))
+
     def start_service(self, hostname=DEFAULT_WEB_SERVER_HOSTNAME, port=DEFAULT_WEB_SERVER_PORT):
         """Responsible for starting the gevent based web server."""
         if self.http_server is not None:
@@ -161,8 +178,13 @@ def process_list_resource_types():
 def process_list_resources(resource_type):
     try:
         restype = str(resource_type)
-        res_list,_ = Container.instance.resource_registry.find_resources(restype=restype)
+        sort = get_arg('sort', 'name')
+        descending = get_arg('descending', 'False') == 'True'
+        limit = min(max(int(get_arg('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        skip = max(int(get_arg('skip', 0)), 0)
 
+        res_list = resource_cache.get_resources(restype, sort, descending)
+        page = res_list[skip:skip + limit]
 
         fragments = [
             build_standard_menu(),
@@ -174,11 +196,11 @@ def process_list_resources(resource_type):
             "<tr>"
         ]
 
-        fragments.extend(build_table_header(restype))
+        fragments.extend(build_table_header(restype, sort, descending))
         #fragments.append("<th>Associations</th>")
         fragments.append("</tr>")
 
-        for res in res_list:
+        for res in page:
             fragments.append("<tr>")
             fragments.extend(build_table_row(res))
             #fragments.append("<td>")
@@ -187,7 +209,8 @@ def process_list_resources(resource_type):
             fragments.append("</tr>")
 
         fragments.append("</table></p>")
-        fragments.append("<p>Number of resources: %s</p>" % len(res_list))
+        fragments.append("<p>Resources %s to %s of %s</p>" % (min(skip + 1, len(res_list)), skip + len(page), len(res_list)))
+        fragments.append(build_page_links("/list/%s" % restype, len(res_list), skip, limit, sort=sort, descending=descending))
 
         content = "\n".join(fragments)
         return build_page(content)
@@ -217,18 +240,33 @@ def build_res_extends(restype):
 
     return "".join(fragments)
 
-def build_table_header(objtype):
+def build_table_header(objtype, sort=None, descending=False):
     schema = _get_object_class(objtype)._schema
     fragments = []
     fragments.append("<th>ID</th>")
-    for field in standard_resattrs:
-        if field in schema:
-            fragments.append("<th>%s</th>" % (field))
-    for field in sorted(schema.keys()):
-        if field not in standard_resattrs:
+    fields = [field for field in standard_resattrs if field in schema]
+    fields.extend(field for field in sorted(schema.keys()) if field not in standard_resattrs)
+    for field in fields:
+        if field in standard_resattrs or schema[field]["type"] in standard_types:
+            # clicking the sorted column again reverses the order
+            args = dict(sort=field, descending=not descending if field == sort else False)
+            fragments.append("<th>%s</th>" % build_link(field, "/list/%s?%s" % (objtype, urllib.urlencode(args))))
+        else:
             fragments.append("<th>%s</th>" % (field))
     return fragments
 
+def build_page_links(link, total, skip, limit, **kwargs):
+    fragments = ["<p>"]
+    if skip > 0:
+        args = dict(kwargs, skip=max(skip - limit, 0), limit=limit)
+        fragments.append(build_link("Previous page", "%s?%s" % (link, urllib.urlencode(args))))
+        fragments.append(" ")
+    if skip + limit < total:
+        args = dict(kwargs, skip=skip + limit, limit=limit)
+        fragments.append(build_link("Next page", "%s?%s" % (link, urllib.urlencode(args))))
+    fragments.append("</p>")
+    return "".join(fragments)
+
 def build_table_row(obj):
     schema = obj._schema
     fragments = []
@@ -458,6 +496,8 @@ def process_command(cmd):
             raise Exception("Command %s unknown" % (cmd))
 
         result = cmd_func(resource_id, res_obj)
+        # do not wait for the change events to show the result of the command
+        resource_cache.invalidate()
 
         fragments = [
             build_standard_menu(),
@@ -740,24 +780,30 @@ def process_nested(rid):
         return build_error_page(traceback.format_exc())
 
 
-def find_subordinate_entity(self, parent_resource_id='', child_resource_type_list=None):
+def find_subordinate_entity(parent_resource_id='', child_resource_type_list=None):
     if not child_resource_type_list:
         child_resource_type_list = set(["LogicalInstrument", "LogicalPlatform", "Site"])
+    parents, children = resource_cache.get_hierarchy()
+
+    # walk down from the parent instead of up from every resource, the visited set guards against cycles
     matchlist = []
-    parents = _get_all_parents()
-    for rid in parents:
-        rt,pid = parents[rid]
-        if rt not in child_resource_type_list:
-            continue
-        while pid:
-            if pid == parent_resource_id:
-                matchlist.append(rid)
+    visited = set([parent_resource_id])
+    queue = collections.deque([parent_resource_id])
+    while queue:
+        for rid in children.get(queue.popleft(), ()):
+            if rid in visited:
                 continue
-            _,pid = parents.get(pid, (None,None))
+            visited.add(rid)
+            queue.append(rid)
+            if parents[rid][0] in child_resource_type_list:
+                matchlist.append(rid)
 
     return matchlist
 
 def _get_all_parents():
+    return resource_cache.get_hierarchy()[0]
+
+def _build_hierarchy():
     parents = {}
     assocs1 = Container.instance.resource_registry.find_associations(predicate=PRED.hasSite, id_only=False)
     for assoc in assocs1:
@@ -771,7 +817,61 @@ def _get_all_parents():
     for assoc in assocs3:
         if assoc.st == "LogicalPlatform":
             parents[assoc.o] = ("LogicalInstrument", assoc.s)
-    return parents
+
+    children = {}
+    for rid, (rt, pid) in parents.iteritems():
+        children.setdefault(pid, []).append(rid)
+    return parents, children
+
+
+class ResourceCache(object):
+    """
+    Resource lists and site hierarchy shown by the UI, kept between requests. Entries are dropped when a
+    ResourceModifiedEvent is received for their resource type and are rebuilt at the latest after max_age seconds.
+    """
+    def __init__(self, max_age=CACHE_MAX_AGE):
+        self.max_age = max_age
+        # restype -> (timestamp, list of resources)
+        self.resources = {}
+        # (restype, sort, descending) -> list of resources
+        self.sorted_resources = {}
+        # (timestamp, parents, children)
+        self.hierarchy = None
+
+    def get_resources(self, restype, sort='name', descending=False):
+        entry = self.resources.get(restype)
+        if entry is None or time.time() - entry[0] > self.max_age:
+            res_list,_ = Container.instance.resource_registry.find_resources(restype=restype)
+            self.resources[restype] = (time.time(), res_list)
+            self._drop_sorted(restype)
+        res_list = self.resources[restype][1]
+
+        key = (restype, sort, descending)
+        if key not in self.sorted_resources:
+            self.sorted_resources[key] = sorted(res_list, key=lambda res: getattr(res, sort, None), reverse=descending)
+        return self.sorted_resources[key]
+
+    def get_hierarchy(self):
+        if self.hierarchy is None or time.time() - self.hierarchy[0] > self.max_age:
+            parents, children = _build_hierarchy()
+            self.hierarchy = (time.time(), parents, children)
+        return self.hierarchy[1], self.hierarchy[2]
+
+    def invalidate(self, restype=None):
+        if restype and restype in self.resources:
+            del self.resources[restype]
+            self._drop_sorted(restype)
+        elif not restype:
+            self.resources.clear()
+            self.sorted_resources.clear()
+        # the event may be about one of the resources of the hierarchy or about its associations
+        self.hierarchy = None
+
+    def _drop_sorted(self, restype):
+        for key in [key for key in self.sorted_resources if key[0] == restype]:
+            del self.sorted_resources[key]
+
+resource_cache = ResourceCache()
 
 # ----------------------------------------------------------------------------------------
 
@@ -842,21 +942,26 @@ def process_events():
         origin = request.args.get('origin', None)
         limit = int(request.args.get('limit', 100))
         descending = request.args.get('descending', True)
-        skip = int(request.args.get('skip', 0))
+        resume_token = request.args.get('resume', None)
 
-        events_list = Container.instance.event_repository.find_events(event_type=event_type, origin=origin,
-                                     descending=descending, limit=limit, skip=skip)
+        events_list, next_token = find_events_page(Container.instance.event_repository, event_type=event_type,
+                                     origin=origin, descending=descending, page_size=limit, resume_token=resume_token)
 
         fragments = [
             build_standard_menu(),
             "<h1>List of Events</h1>",
-            "Restrictions: event_type=%s, origin=%s, limit=%s, descending=%s, skip=%s" % (event_type, origin, limit, descending, skip),
+            "Restrictions: event_type=%s, origin=%s, limit=%s, descending=%s" % (event_type, origin, limit, descending),
         ]
 
         fragments.extend(build_events_table(events_list))
 
-        if len(events_list) >= limit:
-            fragments.append("<p>%s</p>" % build_link("Next page", "/events?skip=%s" % (skip + limit)))
+        if next_token:
+            args = dict(limit=limit, resume=next_token)
+            if event_type:
+                args['event_type'] = event_type
+            if origin:
+                args['origin'] = origin
+            fragments.append("<p>%s</p>" % build_link("Next page", "/events?%s" % urllib.urlencode(args)))
 
         content = "\n".join(fragments)
         return build_page(content)
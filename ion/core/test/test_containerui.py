@@ -0,0 +1,124 @@
+'''
+@file ion/core/test/test_containerui.py
+@description Unit tests for the paging, sorting and caching of the container UI
+'''
+import urlparse
+
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.core import containerui
+from ion.core.containerui import ResourceCache, build_page_links, find_subordinate_entity
+
+
+class FakeResource(object):
+    def __init__(self, _id, name):
+        self._id = _id
+        self.name = name
+
+
+def link_args(fragment):
+    ''' The arguments of the one link in an html fragment '''
+    href = fragment.split("href='", 1)[1].split("'", 1)[0]
+    return dict(urlparse.parse_qsl(urlparse.urlparse(href).query))
+
+
+@attr('UNIT', group='coi')
+class ContainerUITest(PyonTestCase):
+
+    def setUp(self):
+        self.registry = Mock()
+        self.registry.find_resources.return_value = ([FakeResource('id_b', 'b'), FakeResource('id_c', 'c'),
+                                                      FakeResource('id_a', 'a')], None)
+        container = patch('ion.core.containerui.Container')
+        self.addCleanup(container.stop)
+        container.start().instance.resource_registry = self.registry
+
+    def test_build_page_links(self):
+        # first page: only a link to the next one, keeping the sort arguments
+        links = build_page_links('/list/Site', 250, 0, 100, sort='name', descending=False)
+        self.assertNotIn('Previous page', links)
+        self.assertEquals(link_args(links), {'skip':'100', 'limit':'100', 'sort':'name', 'descending':'False'})
+
+        # middle page: both links
+        links = build_page_links('/list/Site', 250, 100, 100)
+        previous, next = links.split('Previous page', 1)
+        self.assertEquals(link_args(previous)['skip'], '0')
+        self.assertEquals(link_args(next)['skip'], '200')
+
+        # last page, not aligned on the page size: the previous page does not start before the first resource
+        links = build_page_links('/list/Site', 250, 50, 200)
+        self.assertNotIn('Next page', links)
+        self.assertEquals(link_args(links)['skip'], '0')
+
+        # everything on one page
+        self.assertEquals(build_page_links('/list/Site', 10, 0, 100), '<p></p>')
+
+    def test_sort_order(self):
+        cache = ResourceCache()
+
+        self.assertEquals([res.name for res in cache.get_resources('Site')], ['a', 'b', 'c'])
+        self.assertEquals([res.name for res in cache.get_resources('Site', 'name', True)], ['c', 'b', 'a'])
+        self.assertEquals([res._id for res in cache.get_resources('Site', '_id')], ['id_a', 'id_b', 'id_c'])
+        # the orderings are sorted from a single read of the resources
+        self.assertEquals(self.registry.find_resources.call_count, 1)
+
+    def test_cache_invalidation(self):
+        cache = ResourceCache()
+        cache.get_resources('Site')
+        cache.get_resources('Site', 'name', True)
+        cache.get_resources('Platform')
+
+        # a change to another type leaves the list alone
+        cache.invalidate('Platform')
+        self.assertEquals(cache.get_resources('Site')[0].name, 'a')
+        self.assertEquals(self.registry.find_resources.call_count, 2)
+
+        # the list and its orderings are read again after a change to the type
+        self.registry.find_resources.return_value = ([FakeResource('id_d', 'd')], None)
+        cache.invalidate('Site')
+        self.assertEquals([res.name for res in cache.get_resources('Site', 'name', True)], ['d'])
+        self.assertEquals(self.registry.find_resources.call_count, 3)
+
+        # and when they are older than max_age
+        cache.max_age = -1
+        cache.get_resources('Site')
+        self.assertEquals(self.registry.find_resources.call_count, 4)
+
+    def test_hierarchy_invalidation(self):
+        cache = ResourceCache()
+        with patch('ion.core.containerui._build_hierarchy', return_value=({}, {})) as build_hierarchy:
+            cache.get_hierarchy()
+            cache.get_hierarchy()
+            self.assertEquals(build_hierarchy.call_count, 1)
+
+            # any change may be to a resource or association of the hierarchy
+            cache.invalidate('Site')
+            cache.get_hierarchy()
+            self.assertEquals(build_hierarchy.call_count, 2)
+
+    def test_find_subordinate_entity(self):
+        # site_1 -> site_2 -> platform_1 -> instrument_1, with site_2 also reachable from platform_1 and site_3 on
+        # its own. The former walk up from each resource looped forever on the first match.
+        parents = {
+            'site_2':('Site', 'site_1'),
+            'platform_1':('LogicalPlatform', 'site_2'),
+            'instrument_1':('LogicalInstrument', 'platform_1'),
+            'site_3':('Site', 'site_0'),
+        }
+        children = {
+            'site_1':['site_2'],
+            'site_2':['platform_1'],
+            'platform_1':['instrument_1', 'site_2'],
+            'site_0':['site_3'],
+        }
+        cache = ResourceCache()
+        cache.get_hierarchy = Mock(return_value=(parents, children))
+
+        with patch.object(containerui, 'resource_cache', cache):
+            # breadth first, each resource once
+            self.assertEquals(find_subordinate_entity('site_1'), ['site_2', 'platform_1', 'instrument_1'])
+            self.assertEquals(find_subordinate_entity('site_1', ['LogicalInstrument']), ['instrument_1'])
+            self.assertEquals(find_subordinate_entity('platform_1'), ['instrument_1', 'site_2'])
+            self.assertEquals(find_subordinate_entity('instrument_1'), [])
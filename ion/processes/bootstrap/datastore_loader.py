@@ -12,20 +12,36 @@ Possible Features
 - load an additional directory (not under GIT control)
 - change timestamp for resources
 - load a subset of objects by type, etc
+
+Besides the directories of YML files (one per document), datastores can be dumped to and loaded from archives
+(format=archive). An archive is a gzip file of JSON documents, one per line, named after the datastore. Documents are
+read from _all_docs and written to the datastore in batches, and a checkpoint file next to the archive records the
+progress so that an interrupted dump or load continues where it stopped when run again.
 """
 
 import yaml
 import datetime
+import gzip
+import json
 import os
 import os.path
+import time
 
 from pyon.public import CFG, log, ImmediateProcess, iex
 from pyon.datastore.datastore import DatastoreManager
 from pyon.core.bootstrap import get_sys_name
 
+# Extension of the datastore archives and of their checkpoint files
+ARCHIVE_EXT = ".json.gz"
+CHECKPOINT_EXT = ".checkpoint"
+# Number of documents read from or written to the datastore at once
+DEFAULT_BATCH_SIZE = 1000
+
 class DatastoreAdmin(ImmediateProcess):
     """
     bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=clear prefix=ion
+    bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=dump format=archive path=res/preload/local/my_dump
+    bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=load format=archive path=res/preload/local/my_dump datastore=resources
     """
     def on_init(self):
         pass
@@ -38,10 +54,16 @@ class DatastoreAdmin(ImmediateProcess):
         datastore = self.CFG.get("datastore", None)
         path = self.CFG.get("path", None)
         prefix = self.CFG.get("prefix", get_sys_name()).lower()
+        archive = self.CFG.get("format", "yml") == "archive"
+        batch_size = int(self.CFG.get("batch_size", DEFAULT_BATCH_SIZE))
         log.info("DatastoreLoader: {op=%s, datastore=%s, path=%s, prefix=%s}" % (op, datastore, path, prefix))
         if op:
-            if op == "load":
+            if op == "load" and archive:
+                self.load_datastore_archive(path, datastore, batch_size=batch_size, ignore_errors=False)
+            elif op == "load":
                 self.load_datastore(path, datastore, ignore_errors=False)
+            elif op == "dump" and archive:
+                self.dump_datastore_archive(path, datastore, batch_size=batch_size)
             elif op == "dump":
                 self.dump_datastore(path, datastore)
             elif op == "blame":
@@ -90,6 +112,7 @@ class DatastoreAdmin(ImmediateProcess):
         if not DatastoreManager.exists(ds_name):
             log.warn("Datastore does not exist: %s" % ds_name)
         ds = DatastoreManager.get_datastore_instance(ds_name)
+        start = time.time()
         objects = []
         for fn in os.listdir(path):
             fp = os.path.join(path, fn)
@@ -109,7 +132,7 @@ class DatastoreAdmin(ImmediateProcess):
         if objects:
             try:
                 res = ds.create_doc_mult(objects, allow_ids=True)
-                log.info("DatastoreLoader: Loaded %s objects into %s" % (len(res), ds_name))
+                log.info("DatastoreLoader: Loaded %s objects into %s (%s)" % (len(res), ds_name, cls._throughput(len(res), start)))
             except Exception as ex:
                 if ignore_errors:
                     log.warn("load error id=%s err=%s" % (fn, str(ex)))
@@ -133,7 +156,7 @@ class DatastoreAdmin(ImmediateProcess):
             path = "res/preload/local/dump_%s" % dtstr
         if ds_name:
             if DatastoreManager.exists(ds_name):
-                cls._dump_datastore(ds_name, path, clear_dir)
+                cls._dump_datastore(path, ds_name, clear_dir)
             else:
                 log.warn("Datastore does not exist")
         else:
@@ -158,6 +181,7 @@ class DatastoreAdmin(ImmediateProcess):
         if clear_dir:
             [os.remove(os.path.join(outpath, f)) for f in os.listdir(outpath)]
 
+        start = time.time()
         objs = ds.find_by_view("_all_docs", None, id_only=False, convert_doc=False)
         numwrites = 0
         for obj_id, obj_key, obj in objs:
@@ -167,7 +191,187 @@ class DatastoreAdmin(ImmediateProcess):
             with open("%s/%s.yml" % (outpath, fn), 'w') as f:
                 yaml.dump(obj, f, default_flow_style=False)
                 numwrites += 1
-        log.info("Wrote %s objects to %s" % (numwrites, outpath))
+        log.info("Wrote %s objects to %s (%s)" % (numwrites, outpath, cls._throughput(numwrites, start)))
+
+    @classmethod
+    def dump_datastore_archive(cls, path=None, ds_name=None, batch_size=DEFAULT_BATCH_SIZE, resume=True):
+        """
+        Dumps CouchDB datastores into a directory as archives.
+        @param path Directory to put the archives into (defaults to "res/preload/local/dump_[timestamp]")
+        @param ds_name Logical name (such as "resources") of an ION datastore, all datastores if not given
+        @param batch_size Number of documents read at once
+        @param resume if True, continue an interrupted dump from its checkpoint
+        """
+        if CFG.system.mockdb:
+            log.warn("Cannot dump from MockDB")
+            return
+        if not path:
+            dtstr = datetime.datetime.today().strftime('%Y%m%d_%H%M%S')
+            path = "res/preload/local/dump_%s" % dtstr
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        ds_list = [ds_name] if ds_name else ['resources', 'objects', 'state', 'events', 'directory', 'scidata']
+        for ds_name in ds_list:
+            if not DatastoreManager.exists(ds_name):
+                log.warn("Datastore does not exist: %s" % ds_name)
+                continue
+            ds = DatastoreManager.get_datastore_instance(ds_name)
+            cls._dump_archive(ds, os.path.join(path, ds_name + ARCHIVE_EXT), batch_size, resume)
+
+    @classmethod
+    def _dump_archive(cls, ds, filename, batch_size=DEFAULT_BATCH_SIZE, resume=True):
+        # Each batch is written as a gzip member of its own, the checkpoint holds the archive size after the last
+        # complete batch so a partly written batch can be cut off when resuming
+        checkpoint_file = filename + CHECKPOINT_EXT
+        checkpoint = cls._read_checkpoint(checkpoint_file) if resume else None
+        if checkpoint and os.path.exists(filename):
+            last_id, numwrites = checkpoint['last_id'], checkpoint['num_docs']
+            log.info("Resuming dump into %s after %s documents" % (filename, numwrites))
+            f = open(filename, 'r+b')
+            f.truncate(checkpoint['offset'])
+            f.seek(checkpoint['offset'])
+        else:
+            last_id, numwrites = None, 0
+            f = open(filename, 'wb')
+
+        start = time.time()
+        with f:
+            while True:
+                # The start key of _all_docs is inclusive, so ask for the last document written again
+                limit = batch_size + 1 if last_id is not None else batch_size
+                rows = ds.find_by_view("_all_docs", None, start_key=last_id, id_only=False, convert_doc=False, limit=limit)
+                num_rows = len(rows)
+                if last_id is not None and rows and rows[0][0] == last_id:
+                    rows = rows[1:]
+                if not rows:
+                    break
+
+                member = gzip.GzipFile(fileobj=f, mode='wb')
+                for obj_id, obj_key, obj in rows:
+                    member.write(json.dumps(obj, separators=(',', ':')) + "\n")
+                member.close()
+                f.flush()
+
+                last_id = rows[-1][0]
+                numwrites += len(rows)
+                cls._write_checkpoint(checkpoint_file, dict(last_id=last_id, num_docs=numwrites, offset=f.tell()))
+                if num_rows < limit:
+                    break
+
+        cls._remove_checkpoint(checkpoint_file)
+        log.info("Wrote %s objects to %s (%s)" % (numwrites, filename, cls._throughput(numwrites, start)))
+        return numwrites
+
+    @classmethod
+    def load_datastore_archive(cls, path=None, ds_name=None, batch_size=DEFAULT_BATCH_SIZE, ignore_errors=True, resume=True):
+        """
+        Loads the datastore archives of a directory into the datastores they are named after.
+        @param path Directory containing the archives
+        @param ds_name Logical name of the datastore to load, all archives of the directory if not given
+        @param batch_size Number of documents written at once
+        @param resume if True, continue an interrupted load from its checkpoint
+        """
+        if CFG.system.mockdb:
+            log.warn("Cannot load into MockDB")
+            return
+        if not path or not os.path.isdir(path):
+            log.warn("Load path not found: %s" % path)
+            return
+
+        if ds_name:
+            ds_list = [ds_name]
+        else:
+            ds_list = [fn[:-len(ARCHIVE_EXT)] for fn in sorted(os.listdir(path)) if fn.endswith(ARCHIVE_EXT)]
+        for ds_name in ds_list:
+            filename = os.path.join(path, ds_name + ARCHIVE_EXT)
+            if not os.path.exists(filename):
+                log.warn("Archive not found: %s" % filename)
+                continue
+            if not DatastoreManager.exists(ds_name):
+                log.warn("Datastore does not exist: %s" % ds_name)
+            ds = DatastoreManager.get_datastore_instance(ds_name)
+            cls._load_archive(ds, filename, batch_size, ignore_errors, resume)
+
+    @classmethod
+    def _load_archive(cls, ds, filename, batch_size=DEFAULT_BATCH_SIZE, ignore_errors=True, resume=True):
+        # The checkpoint holds the number of documents of the archive already written to the datastore. Documents
+        # of a batch interrupted after being written are rejected as conflicts when they are written again
+        checkpoint_file = filename + CHECKPOINT_EXT
+        checkpoint = cls._read_checkpoint(checkpoint_file) if resume else None
+        skip = checkpoint['num_docs'] if checkpoint else 0
+        if skip:
+            log.info("Resuming load from %s after %s documents" % (filename, skip))
+
+        start = time.time()
+        numloaded = skip
+        objects = []
+        with gzip.open(filename, 'rb') as f:
+            for line_num, line in enumerate(f):
+                if line_num < skip:
+                    continue
+                try:
+                    obj = json.loads(line)
+                    obj.pop("_rev", None)
+                    objects.append(obj)
+                except Exception as ex:
+                    if ignore_errors:
+                        log.warn("load error line=%s err=%s" % (line_num, str(ex)))
+                    else:
+                        raise ex
+                    # the line still counts for the checkpoint
+                    objects.append(None)
+
+                if len(objects) >= batch_size:
+                    numloaded += cls._load_archive_batch(ds, objects, ignore_errors)
+                    cls._write_checkpoint(checkpoint_file, dict(num_docs=numloaded))
+                    objects = []
+
+        if objects:
+            numloaded += cls._load_archive_batch(ds, objects, ignore_errors)
+
+        cls._remove_checkpoint(checkpoint_file)
+        log.info("DatastoreLoader: Loaded %s objects from %s (%s)" % (numloaded - skip, filename, cls._throughput(numloaded - skip, start)))
+        return numloaded - skip
+
+    @classmethod
+    def _load_archive_batch(cls, ds, objects, ignore_errors=True):
+        # Returns the number of archive lines consumed
+        docs = [obj for obj in objects if obj is not None]
+        if docs:
+            try:
+                ds.create_doc_mult(docs, allow_ids=True)
+            except Exception as ex:
+                if ignore_errors:
+                    log.warn("load error ids=%s..%s err=%s" % (docs[0].get("_id"), docs[-1].get("_id"), str(ex)))
+                else:
+                    raise ex
+        return len(objects)
+
+    @classmethod
+    def _read_checkpoint(cls, checkpoint_file):
+        if not os.path.exists(checkpoint_file):
+            return None
+        with open(checkpoint_file, 'r') as f:
+            return json.load(f)
+
+    @classmethod
+    def _write_checkpoint(cls, checkpoint_file, checkpoint):
+        # Replace the checkpoint atomically so an interruption never leaves a partial one
+        tmp_file = checkpoint_file + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(checkpoint, f)
+        os.rename(tmp_file, checkpoint_file)
+
+    @classmethod
+    def _remove_checkpoint(cls, checkpoint_file):
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+
+    @staticmethod
+    def _throughput(num_docs, start):
+        elapsed = time.time() - start
+        return "%.2f s, %.1f docs/s" % (elapsed, num_docs / elapsed if elapsed > 0 else 0.0)
 
     @classmethod
     def _get_datastore_names(cls, prefix=None):
@@ -6,19 +6,35 @@ __author__ = 'Michael Meisinger, Ian Katz, Thomas Lennan'
 
 import ast
 import csv
+import time
 import uuid
 import json
+import gevent
 
 from interface import objects
 
 from pyon.core.bootstrap import service_registry
 from pyon.datastore.datastore import DatastoreManager
+from pyon.event.event import EventPublisher
 from pyon.ion.resource import get_restype_lcsm
 from pyon.public import CFG, log, ImmediateProcess, iex, IonObject, RT, PRED
 from pyon.util.containers import named_any, get_ion_ts
 
 DEBUG = True
 
+# Categories that are loaded in bulk mode by writing the resources and associations directly into the resources
+# datastore: category -> (resource type, column prefix, [(column, predicate, referenced resource is the subject)])
+BULK_CATEGORIES = {
+    'PlatformModel':   ('PlatformModel', 'pm/', []),
+    'InstrumentModel': ('InstrumentModel', 'im/', []),
+    'Observatory':     ('Observatory', 'obs/', []),
+    'Subsite':         ('Subsite', 'site/', [('parent_site_id', PRED.hasSite, True)]),
+    'PlatformSite':    ('PlatformSite', 'ps/', [('parent_site_id', PRED.hasSite, True),
+                                                ('platform_model_ids', PRED.hasModel, False)]),
+    'InstrumentSite':  ('InstrumentSite', 'is/', [('parent_site_id', PRED.hasSite, True),
+                                                  ('instrument_model_ids', PRED.hasModel, False)]),
+    }
+
 class IONLoader(ImmediateProcess):
     """
     @see https://confluence.oceanobservatories.org/display/CIDev/R2+System+Preload
@@ -28,6 +44,7 @@ class IONLoader(ImmediateProcess):
     bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=load path=res/preload/lca_demo scenario=LCA_DEMO_PRE
     bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=load path=res/preload/lca_demo scenario=LCA_DEMO_PRE loadooi=True
     bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=load path=res/preload/lca_demo scenario=LCA_DEMO_PRE loadui=True
+    bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=load path=res/preload/lca_demo scenario=LCA_DEMO_PRE loadooi=True bulk=True
     bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=loadooi path=res/preload/lca_demo scenario=LCA_DEMO_PRE
     bin/pycc -x ion.processes.bootstrap.ion_loader.IONLoader op=loadui path=res/preload/lca_demo
     """
@@ -53,6 +70,7 @@ class IONLoader(ImmediateProcess):
         DEBUG = self.CFG.get("debug", False)
         self.loadooi = self.CFG.get("loadooi", False)
         self.loadui = self.CFG.get("loadui", False)
+        self.bulk = self.CFG.get("bulk", False)
 
         log.info("IONLoader: {op=%s, path=%s, scenario=%s}" % (op, path, scenario))
         if op:
@@ -100,7 +118,16 @@ class IONLoader(ImmediateProcess):
         self.path = path
         self.obj_classes = {}
         self.resource_ids = {}
+        self.resource_types = {}
         self.user_ids = {}
+        # Resources and associations of the bulk categories waiting to be written, and the greenlets writing them
+        self.bulk_objects = {}
+        self.bulk_assocs = {}
+        self.bulk_writers = []
+        # Names of the resources of each bulk resource type, read from the registry on the first row of the type
+        self.bulk_names = {}
+        load_start = time.time()
+        total_rows = 0
 
         self._preload_ids()
         if self.loadooi:
@@ -111,12 +138,20 @@ class IONLoader(ImmediateProcess):
 
         for category in categories:
             row_do, row_skip = 0, 0
+            category_start = time.time()
+
+            bulk_category = self.bulk and category in BULK_CATEGORIES
+            if bulk_category:
+                self.bulk_objects[category] = []
+                self.bulk_assocs[category] = []
+            else:
+                # The services loading this category may read the resources written in bulk
+                self._wait_bulk_writers()
 
             catfunc_ooi = getattr(self, "_load_%s_OOI" % category, None)
             if self.loadooi and catfunc_ooi:
                 catfunc_ooi()
 
-            catfunc = getattr(self, "_load_%s" % category)
             filename = "%s/%s.csv" % (path, category)
             log.info("Loading category %s from file %s" % (category, filename))
             try:
@@ -130,11 +165,127 @@ class IONLoader(ImmediateProcess):
                             continue
                         row_do += 1
 
-                        catfunc(row)
+                        self._load_row(category, row)
             except IOError, ioe:
                 log.warn("Resource category file %s error: %s" % (filename, str(ioe)))
 
-            log.info("Loaded category %s: %d rows imported, %d rows skipped" % (category, row_do, row_skip))
+            if bulk_category:
+                # Write the category while the next ones are read, none of them depends on the others being written
+                self.bulk_writers.append(gevent.spawn(self._bulk_write, category))
+
+            total_rows += row_do
+            elapsed = time.time() - category_start
+            log.info("Loaded category %s: %d rows imported, %d rows skipped in %.2f s (%.1f rows/s)" % (
+                category, row_do, row_skip, elapsed, row_do / elapsed if elapsed > 0 else 0.0))
+
+        self._wait_bulk_writers()
+        elapsed = time.time() - load_start
+        log.info("Preload complete: %d rows imported in %.2f s (%.1f rows/s)" % (
+            total_rows, elapsed, total_rows / elapsed if elapsed > 0 else 0.0))
+
+    def _load_row(self, category, row):
+        if self.bulk and category in BULK_CATEGORIES:
+            self._bulk_resource_row(category, row)
+        else:
+            getattr(self, "_load_%s" % category)(row)
+
+    def _bulk_resource_row(self, category, row):
+        """
+        Builds the resource of a row of a bulk category and its associations in memory, as the service calls of
+        the category's _load_ function would create them. They are written by _bulk_write.
+        """
+        restype, prefix, assoc_columns = BULK_CATEGORIES[category]
+        log.info("Bulk loading %s (ID=%s)" % (restype, row[self.COL_ID]))
+        res_obj = self._create_object_from_row(restype, row, prefix)
+        if not res_obj.name:
+            raise iex.BadRequest("%s (ID=%s) has no name" % (restype, row[self.COL_ID]))
+        self._check_bulk_name(restype, res_obj.name, row[self.COL_ID])
+
+        lcsm = get_restype_lcsm(restype)
+        res_obj.lcstate = row.get(self.COL_LCSTATE, None) or (lcsm.initial_state if lcsm else "DEPLOYED_AVAILABLE")
+        res_obj.ts_created = res_obj.ts_updated = get_ion_ts()
+        res_id = uuid.uuid4().hex
+        res_obj._id = res_id
+        self._register_id(row[self.COL_ID], res_id)
+        self.resource_types[res_id] = restype
+        self.bulk_objects[category].append(res_obj)
+
+        owner_id = self._get_op_headers(row).get('ion-actor-id', None)
+        if owner_id:
+            self._add_bulk_assoc(category, res_id, PRED.hasOwner, owner_id)
+
+        org_ids = row.get(self.COL_ORGS, None)
+        if org_ids:
+            for org_id in self._get_typed_value(org_ids, targettype="simplelist"):
+                self._add_bulk_assoc(category, self.resource_ids[org_id], PRED.hasResource, res_id)
+
+        for column, predicate, ref_is_subject in assoc_columns:
+            ref_ids = row.get(column, None)
+            if not ref_ids:
+                continue
+            for ref_id in self._get_typed_value(ref_ids, targettype="simplelist"):
+                ref_id = self.resource_ids[ref_id]
+                if ref_is_subject:
+                    self._add_bulk_assoc(category, ref_id, predicate, res_id)
+                else:
+                    self._add_bulk_assoc(category, res_id, predicate, ref_id)
+
+    def _check_bulk_name(self, restype, name, row_id):
+        """
+        The services creating the resources of the bulk categories reject a name already taken by a resource of
+        the same type, so does the bulk load.
+        """
+        if restype not in self.bulk_names:
+            rr_client = self._get_service_client("resource_registry")
+            res_list, _ = rr_client.find_resources(restype=restype, id_only=False)
+            self.bulk_names[restype] = set(res.name for res in res_list)
+        if name in self.bulk_names[restype]:
+            raise iex.BadRequest("%s resource named '%s' already exists (ID=%s)" % (restype, name, row_id))
+        self.bulk_names[restype].add(name)
+
+    def _add_bulk_assoc(self, category, subject_id, predicate, object_id):
+        assoc = objects.Association(at="",
+            s=subject_id, st=self._get_resource_type(subject_id), srv="",
+            p=predicate,
+            o=object_id, ot=self._get_resource_type(object_id), orv="",
+            ts=get_ion_ts())
+        self.bulk_assocs[category].append(assoc)
+
+    def _get_resource_type(self, res_id):
+        if res_id not in self.resource_types:
+            # A resource created through a service
+            rr_client = self._get_service_client("resource_registry")
+            self.resource_types[res_id] = rr_client.read(res_id)._get_type()
+        return self.resource_types[res_id]
+
+    def _bulk_write(self, category):
+        start = time.time()
+        res_objs = self.bulk_objects.pop(category)
+        assocs = self.bulk_assocs.pop(category)
+
+        ds = DatastoreManager.get_datastore_instance("resources")
+        if res_objs:
+            ds.create_mult(res_objs, allow_ids=True)
+        if assocs:
+            ds.create_mult(assocs)
+
+        # The registry is bypassed, publish the events it would have so that the services drop the resources they
+        # cache, like the site hierarchy of the observatory management service
+        pub = EventPublisher("ResourceModifiedEvent")
+        for res_obj in res_objs:
+            pub.publish_event(origin=res_obj._id, origin_type=self.resource_types[res_obj._id], sub_type="CREATE",
+                description="Bulk preload of category %s" % category)
+
+        elapsed = time.time() - start
+        log.info("Bulk wrote category %s: %d resources, %d associations in %.2f s (%.1f docs/s)" % (
+            category, len(res_objs), len(assocs), elapsed, (len(res_objs) + len(assocs)) / elapsed if elapsed > 0 else 0.0))
+
+    def _wait_bulk_writers(self):
+        writers, self.bulk_writers = self.bulk_writers, []
+        gevent.joinall(writers)
+        for writer in writers:
+            if writer.exception is not None:
+                raise iex.BadRequest("Bulk preload write failed: %s" % writer.exception)
 
     def _get_csv_reader(self, csvfile):
         #determine type of csv
@@ -247,6 +398,7 @@ class IONLoader(ImmediateProcess):
         svc_client = self._get_service_client(svcname)
         res_id = getattr(svc_client, svcop)(res_obj, headers=headers, **kwargs)
         self._register_id(row[self.COL_ID], res_id)
+        self.resource_types[res_id] = restype
 
         self._resource_assign_org(row, res_id)
 
@@ -285,6 +437,7 @@ class IONLoader(ImmediateProcess):
                 raise iex.BadRequest("ION org not found. Was system force_cleaned since bootstrap?")
             ion_org_id = org_ids[0]
             self._register_id(self.ID_ORG_ION, ion_org_id)
+            self.resource_types[ion_org_id] = RT.Org
 
     # --------------------------------------------------------------------------------------------------
     # Add specific types of resources below
@@ -301,6 +454,7 @@ class IONLoader(ImmediateProcess):
         user_id = ims.create_actor_identity(actor_identity_obj)
         self._register_user_id(name, user_id)
         self._register_id(row[self.COL_ID], user_id)
+        self.resource_types[user_id] = RT.ActorIdentity
 
         user_credentials_obj = IonObject("UserCredentials", {"name": subject})
         ims.register_user_credentials(user_id, user_credentials_obj)
@@ -326,6 +480,7 @@ class IONLoader(ImmediateProcess):
             log.warn("Unknown Org type: %s" % org_type)
 
         self._register_id(row[self.COL_ID], res_id)
+        self.resource_types[res_id] = RT.Org
 
     def _load_UserRole(self, row):
         log.info("Loading UserRole")
@@ -365,7 +520,7 @@ class IONLoader(ImmediateProcess):
             mf_id = 'MF_RSN' if pm_def['code'].startswith("R") else 'MF_CGSN'
             fakerow['mf_ids'] = mf_id
 
-            self._load_PlatformModel(fakerow)
+            self._load_row("PlatformModel", fakerow)
 
     def _load_InstrumentModel(self, row):
         res_id = self._basic_resource_create(row, "InstrumentModel", "im/",
@@ -382,7 +537,7 @@ class IONLoader(ImmediateProcess):
             fakerow['im/instrument_class'] = im_def['code']
             fakerow['mf_ids'] = 'MF_RSN,MF_CGSN'
 
-            self._load_InstrumentModel(fakerow)
+            self._load_row("InstrumentModel", fakerow)
 
     def _load_Observatory(self, row):
         res_id = self._basic_resource_create(row, "Observatory", "obs/",
@@ -407,7 +562,7 @@ class IONLoader(ImmediateProcess):
             org_id = 'MF_RSN' if site_def['code'].startswith("R") else 'MF_CGSN'
             fakerow['org_ids'] = org_id
 
-            self._load_Observatory(fakerow)
+            self._load_row("Observatory", fakerow)
 
         log.info("Loading OOI Subsite assets")
         for site_def in self.sub_sites.values():
@@ -419,7 +574,7 @@ class IONLoader(ImmediateProcess):
             org_id = 'MF_RSN' if site_def['code'].startswith("R") else 'MF_CGSN'
             fakerow['org_ids'] = org_id
 
-            self._load_Subsite(fakerow)
+            self._load_row("Subsite", fakerow)
 
     def _load_PlatformSite(self, row):
         res_id = self._basic_resource_create(row, "PlatformSite", "ps/",
@@ -448,7 +603,7 @@ class IONLoader(ImmediateProcess):
             org_id = 'MF_RSN' if site_def['code'].startswith("R") else 'MF_CGSN'
             fakerow['org_ids'] = org_id
 
-            self._load_PlatformSite(fakerow)
+            self._load_row("PlatformSite", fakerow)
 
     def _load_InstrumentSite(self, row):
         res_id = self._basic_resource_create(row, "InstrumentSite", "is/",
@@ -477,7 +632,7 @@ class IONLoader(ImmediateProcess):
             org_id = 'MF_RSN' if site_def['code'].startswith("R") else 'MF_CGSN'
             fakerow['org_ids'] = org_id
 
-            self._load_InstrumentSite(fakerow)
+            self._load_row("InstrumentSite", fakerow)
 
             if DEBUG and i>20:
                 break
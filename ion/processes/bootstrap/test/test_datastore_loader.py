@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.processes.bootstrap.datastore_loader import DatastoreAdmin, CHECKPOINT_EXT
+
+
+class FakeDatastore(object):
+
+    def __init__(self, docs=None, fail_after=None):
+        self.docs = dict((doc['_id'], doc) for doc in (docs or []))
+        self.fail_after = fail_after
+        self.num_reads = 0
+
+    def find_by_view(self, design_name, view_name, start_key=None, id_only=True, convert_doc=True, limit=0):
+        if self.fail_after is not None and self.num_reads >= self.fail_after:
+            raise IOError("connection lost")
+        self.num_reads += 1
+        ids = sorted(doc_id for doc_id in self.docs if start_key is None or doc_id >= start_key)
+        return [(doc_id, doc_id, dict(self.docs[doc_id])) for doc_id in ids[:limit]]
+
+    def create_doc_mult(self, docs, allow_ids=False):
+        if self.fail_after is not None and self.num_reads >= self.fail_after:
+            raise IOError("connection lost")
+        self.num_reads += 1
+        res = []
+        for doc in docs:
+            # already existing documents are conflicts
+            if doc['_id'] not in self.docs:
+                self.docs[doc['_id']] = dict(doc, _rev='1-new')
+                res.append((True, doc['_id'], '1-new'))
+        return res
+
+
+@attr('UNIT', group='loader')
+class TestDatastoreArchive(PyonTestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.filename = os.path.join(self.path, 'resources.json.gz')
+        self.docs = [dict(_id='id%03d' % i, _rev='1-abc', name='res %s' % i, value=i) for i in xrange(25)]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _stripped(self, docs):
+        return sorted([dict((k, v) for k, v in doc.iteritems() if k != '_rev') for doc in docs])
+
+    def test_dump_and_load(self):
+        num_docs = DatastoreAdmin._dump_archive(FakeDatastore(self.docs), self.filename, batch_size=10)
+        self.assertEqual(num_docs, 25)
+        self.assertFalse(os.path.exists(self.filename + CHECKPOINT_EXT))
+
+        target = FakeDatastore()
+        num_docs = DatastoreAdmin._load_archive(target, self.filename, batch_size=7)
+        self.assertEqual(num_docs, 25)
+        self.assertEqual(self._stripped(target.docs.values()), self._stripped(self.docs))
+
+    def test_resume_dump(self):
+        # the third read fails, two batches of 10 documents are in the archive
+        self.assertRaises(IOError, DatastoreAdmin._dump_archive, FakeDatastore(self.docs, fail_after=2),
+                          self.filename, batch_size=10)
+        self.assertTrue(os.path.exists(self.filename + CHECKPOINT_EXT))
+
+        source = FakeDatastore(self.docs)
+        num_docs = DatastoreAdmin._dump_archive(source, self.filename, batch_size=10)
+        self.assertEqual(num_docs, 25)
+        self.assertEqual(source.num_reads, 1)
+
+        target = FakeDatastore()
+        DatastoreAdmin._load_archive(target, self.filename, batch_size=10)
+        self.assertEqual(self._stripped(target.docs.values()), self._stripped(self.docs))
+
+    def test_resume_load(self):
+        DatastoreAdmin._dump_archive(FakeDatastore(self.docs), self.filename, batch_size=10)
+
+        target = FakeDatastore(fail_after=2)
+        self.assertRaises(IOError, DatastoreAdmin._load_archive, target, self.filename, batch_size=5, ignore_errors=False)
+        self.assertEqual(len(target.docs), 10)
+
+        target.fail_after = None
+        num_docs = DatastoreAdmin._load_archive(target, self.filename, batch_size=5)
+        self.assertEqual(num_docs, 15)
+        self.assertEqual(self._stripped(target.docs.values()), self._stripped(self.docs))
+        self.assertFalse(os.path.exists(self.filename + CHECKPOINT_EXT))
@@ -2,9 +2,11 @@
 
 __author__ = 'Michael Meisinger'
 
+import gevent
 from nose.plugins.attrib import attr
 
-from pyon.public import RT
+from pyon.event.event import EventSubscriber
+from pyon.public import RT, PRED
 from pyon.util.int_test import IonIntegrationTestCase
 
 from interface.services.coi.idatastore_service import DatastoreServiceClient, DatastoreServiceProcessClient
@@ -26,3 +28,38 @@ class TestLoader(IonIntegrationTestCase):
 
         res,_ = self.container.resource_registry.find_resources(RT.DataProduct, id_only=True)
         self.assertTrue(len(res) > 1)
+
+    def test_lca_bulk_load(self):
+        config = dict(op="load", path="res/preload/lca_demo", scenario="LCA_DEMO_PRE", bulk=True)
+        self.container.spawn_process("Loader", "ion.processes.bootstrap.ion_loader", "IONLoader", config=config)
+
+        res,_ = self.container.resource_registry.find_resources(RT.PlatformSite, id_only=True)
+        self.assertTrue(len(res) > 1)
+
+        # the bulk written sites are linked to their parents and are usable by the services loading later categories
+        parents = [self.container.resource_registry.find_subjects(None, PRED.hasSite, site_id, id_only=True)[0] for site_id in res]
+        self.assertTrue(any(parents))
+
+        res,_ = self.container.resource_registry.find_resources(RT.DataProduct, id_only=True)
+        self.assertTrue(len(res) > 1)
+
+    def test_lca_bulk_load_events(self):
+        # the services caching resources see the resources written in bulk
+        modified = []
+        def receive_event(event_msg, headers):
+            modified.append((event_msg.origin, event_msg.origin_type))
+        subscriber = EventSubscriber(event_type="ResourceModifiedEvent", callback=receive_event)
+        subscriber.activate()
+        self.addCleanup(subscriber.deactivate)
+
+        config = dict(op="load", path="res/preload/lca_demo", scenario="LCA_DEMO_PRE", bulk=True)
+        self.container.spawn_process("Loader", "ion.processes.bootstrap.ion_loader", "IONLoader", config=config)
+
+        res,_ = self.container.resource_registry.find_resources(RT.PlatformSite, id_only=True)
+        self.assertTrue(len(res) > 1)
+        for i in xrange(50):
+            if all((site_id, RT.PlatformSite) in modified for site_id in res):
+                break
+            gevent.sleep(0.1)
+        else:
+            self.fail("No ResourceModifiedEvent for the bulk loaded platform sites")
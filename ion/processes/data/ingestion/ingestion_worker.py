@@ -8,7 +8,7 @@
 to couchdb datastore and hdf datastore.
 '''
 
-from interface.objects import DataStream, StreamGranuleContainer, Encoding
+from interface.objects import DataStream, StreamGranuleContainer, Encoding, DatasetIngestionConfigurationEvent
 from pyon.datastore.datastore import DataStore
 from pyon.public import log
 from pyon.ion.transform import TransformDataProcess
@@ -22,6 +22,7 @@ from interface.services.coi.iresource_registry_service import ResourceRegistrySe
 from pyon.event.event import EventSubscriber, EventPublisher
 
 from pyon.util.file_sys import FS, FileSystem
+from ion.services.dm.ingestion.ingestion_sharding import StreamHandoff, HANDOFF_MARKER, HANDOFF_DRAINED
 import hashlib
 
 class IngestionWorkerException(IonException):
@@ -63,6 +64,8 @@ class IngestionWorker(TransformDataProcess):
         self.description = self.CFG.get('description')
 
         self.ingest_config_id = self.CFG.get('configuration_id')
+        # a sharded worker only receives the dataset configs of the streams assigned to it
+        self.shard = self.CFG.get('shard')
 
         self.datastore_name = self.couch_config.get('datastore_name',None) or 'dm_datastore'
         try:
@@ -77,6 +80,9 @@ class IngestionWorker(TransformDataProcess):
         self.resource_reg_client = ResourceRegistryServiceClient(node = self.container.node)
 
         self.dataset_configs = {}
+        # streams moving to or from this worker when the workers of a sharded configuration change
+        self.handoff = StreamHandoff(self.shard, self.dataset_configs, self.ingest_packet, self._signal_drained)
+
         # update the policy
         def receive_dataset_config_event(event_msg, headers):
             log.info('Updating dataset config in ingestion worker: %s', event_msg)
@@ -86,7 +92,9 @@ class IngestionWorker(TransformDataProcess):
 
             stream_id = event_msg.configuration.stream_id
 
-            if event_msg.deleted:
+            if event_msg.sub_type == HANDOFF_DRAINED:
+                self.handoff.stream_drained(stream_id)
+            elif event_msg.deleted:
                 try:
                     del self.dataset_configs[stream_id]
                 except KeyError:
@@ -101,7 +109,7 @@ class IngestionWorker(TransformDataProcess):
         #Start the event subscriber - really - what a mess!
         self.event_subscriber = EventSubscriber(
             event_type="DatasetIngestionConfigurationEvent",
-            origin=self.ingest_config_id,
+            origin=self.shard or self.ingest_config_id,
             callback=receive_dataset_config_event
             )
 
@@ -114,10 +122,21 @@ class IngestionWorker(TransformDataProcess):
         """Process incoming data!!!!
         """
 
+        # A stream moving between the workers of a sharded configuration
+        if isinstance(packet, DatasetIngestionConfigurationEvent) and packet.sub_type == HANDOFF_MARKER:
+            self.handoff.marker(packet.configuration.stream_id, packet.origin, packet)
+            return
+
         # Ignoring any packet that is not a stream granule!
         if not isinstance(packet, StreamGranuleContainer):
             raise IngestionWorkerException('Received invalid message type: "%s"', type(packet))
 
+        self.handoff.granule(getattr(packet, 'stream_resource_id', None), packet)
+
+    def ingest_packet(self, packet):
+        """
+        Ingests a granule with the dataset config of its stream
+        """
 
         # Get the dataset config for this stream
         dset_config = self.get_dataset_config(packet)
@@ -142,6 +161,15 @@ class IngestionWorker(TransformDataProcess):
             self.ingest_process_test_hook(packet, headers)
 
 
+    def _signal_drained(self, new_worker, stream_id, dset_config):
+        # the granules of the stream queued before the handoff marker are ingested, the new worker can go on
+        self.event_pub.publish_event(event_type="DatasetIngestionConfigurationEvent", sub_type=HANDOFF_DRAINED,
+            origin=new_worker,
+            description=dset_config.description,
+            configuration=dset_config.configuration,
+            type=dset_config.type,
+            resource_id=dset_config.resource_id)
+
     def persist_immutable(self, obj):
         """
         This method is not functional yet - the doc object is python specific. The sha1 must be of a language independent form.
@@ -0,0 +1,139 @@
+'''
+@file ion/processes/data/replay_control.py
+@description Runs the publishing of a replay in the background, with progress, pause/resume and flow control
+'''
+
+import time
+
+import gevent
+from gevent.event import Event
+
+from pyon.public import log
+
+REPLAY_PENDING = 'PENDING'
+REPLAY_RUNNING = 'RUNNING'
+REPLAY_PAUSED = 'PAUSED'
+REPLAY_COMPLETE = 'COMPLETE'
+REPLAY_FAILED = 'FAILED'
+REPLAY_CANCELLED = 'CANCELLED'
+
+# a progress report is made every this many granules, and when the state of the replay changes
+DEFAULT_PROGRESS_INTERVAL = 100
+
+
+class ReplayStatus(object):
+    '''
+    State of a replay and the number of granules and bytes published so far.
+    '''
+    def __init__(self, replay_id):
+        self.replay_id = replay_id
+        self.state = REPLAY_PENDING
+        self.granules = 0
+        self.bytes = 0
+        self.started = None
+        self.updated = None
+        self.error = ''
+
+    def to_dict(self):
+        return dict(replay_id=self.replay_id, state=self.state, granules=self.granules, bytes=self.bytes,
+                    started=self.started, updated=self.updated, error=self.error)
+
+
+class ReplayControl(object):
+    '''
+    Publishes the packets of a replay from a greenlet, so that the caller starting the replay returns at once.
+
+    The replay can be paused and resumed between two packets. With a window, the replay publishes at most window
+    packets ahead of the consumer: each packet uses a credit and waits when there are none left, until the consumer
+    grants more as it processes the packets. on_progress is called with the status every progress_interval packets
+    and when the state changes.
+    '''
+    def __init__(self, replay_id, publish, size=len, window=0, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 on_progress=None):
+        self.status = ReplayStatus(replay_id)
+        self.publish = publish
+        self.size = size
+        self.window = window
+        self.credits = window
+        self.progress_interval = progress_interval
+        self.on_progress = on_progress
+        self.greenlet = None
+        self._resumed = Event()
+        self._resumed.set()
+        self._credited = Event()
+        self._cancelled = False
+
+    def start(self, packets):
+        '''
+        Starts publishing the packets, an iterable that may produce them as they are requested, and returns the
+        greenlet doing it.
+        '''
+        self.greenlet = gevent.spawn(self.run, packets)
+        return self.greenlet
+
+    def run(self, packets):
+        status = self.status
+        status.started = time.time()
+        self._set_state(REPLAY_PAUSED if not self._resumed.is_set() else REPLAY_RUNNING)
+        try:
+            for packet in packets:
+                self._resumed.wait()
+                self._take_credit()
+                if self._cancelled:
+                    break
+                self.publish(packet)
+                status.granules += 1
+                status.bytes += self.size(packet)
+                if status.granules % self.progress_interval == 0:
+                    self._report()
+        except Exception as e:
+            log.exception('Replay %s failed', status.replay_id)
+            status.error = str(e)
+            self._set_state(REPLAY_FAILED)
+            return
+        self._set_state(REPLAY_CANCELLED if self._cancelled else REPLAY_COMPLETE)
+
+    def pause(self):
+        self._resumed.clear()
+        if self.status.state == REPLAY_RUNNING:
+            self._set_state(REPLAY_PAUSED)
+
+    def resume(self):
+        self._resumed.set()
+        if self.status.state == REPLAY_PAUSED:
+            self._set_state(REPLAY_RUNNING)
+
+    def cancel(self):
+        self._cancelled = True
+        self._resumed.set()
+        self._credited.set()
+        if self.greenlet is None and self.status.state == REPLAY_PENDING:
+            # never started, run reports the cancellation otherwise
+            self._set_state(REPLAY_CANCELLED)
+
+    def grant(self, credits):
+        '''
+        Allows credits more packets to be published, when the replay has a window.
+        '''
+        self.credits += credits
+        self._credited.set()
+
+    def _take_credit(self):
+        if not self.window:
+            return
+        while self.credits <= 0 and not self._cancelled:
+            self._credited.clear()
+            self._credited.wait()
+        self.credits -= 1
+
+    def _set_state(self, state):
+        self.status.state = state
+        self._report()
+
+    def _report(self):
+        self.status.updated = time.time()
+        if self.on_progress is not None:
+            try:
+                self.on_progress(self.status)
+            except Exception:
+                log.exception('Could not report the progress of replay %s', self.status.replay_id)
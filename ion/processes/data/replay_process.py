@@ -9,11 +9,11 @@ import time
 import copy
 import hashlib
 
-from gevent.greenlet import Greenlet
 from gevent.coros import RLock
 
 from pyon.core.exception import IonException, BadRequest, Inconsistent
 from pyon.datastore.datastore import DataStore
+from pyon.event.event import EventPublisher
 from pyon.public import log
 from pyon.util.file_sys import FS, FileSystem
 
@@ -25,6 +25,11 @@ from interface.objects import BlogBase, StreamGranuleContainer, StreamDefinition
 from interface.services.dm.ireplay_process import BaseReplayProcess
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceProcessClient
 
+from ion.processes.data.replay_control import ReplayControl, DEFAULT_PROGRESS_INTERVAL
+
+# number of documents read from the dataset view at a time, each page is merged into one granule
+DEFAULT_PAGE_SIZE = 50
+
 
 
 class ReplayProcessException(IonException):
@@ -75,9 +80,19 @@ class ReplayProcess(BaseReplayProcess):
         self.domain_ids = self.definition.identifiables[self.data_record_id].domain_ids
         self.time_id = self.definition.identifiables[self.domain_ids[0]].temporal_coordinate_vector_id
 
+        # With a window the replay publishes at most that many packets ahead of the consumer, which grants more
+        # credits as it processes them
+        self.replay_id = self.CFG.get_safe('process.replay_id', self.id)
+        self.page_size = self.CFG.get_safe('process.page_size', DEFAULT_PAGE_SIZE)
+        window = self.delivery_format.get('window', self.CFG.get_safe('process.window', 0))
+        progress_interval = self.CFG.get_safe('process.progress_interval', DEFAULT_PROGRESS_INTERVAL)
+        self.event_publisher = EventPublisher()
+        self.control = ReplayControl(self.replay_id, publish=self._publish, size=self._packet_size, window=window,
+            progress_interval=progress_interval, on_progress=self._publish_progress)
+
     def execute_replay(self):
         '''
-        @brief Spawns a greenlet to take care of the query and work
+        @brief Spawns a greenlet to take care of the query and work, returns before anything is published
         '''
         if not hasattr(self, 'output'):
             raise Inconsistent('The replay process requires an output stream publisher named output. Invalid configuration!')
@@ -93,73 +108,162 @@ class ReplayProcess(BaseReplayProcess):
             'include_docs':True
         }
 
-        g = Greenlet(self._query,datastore_name=datastore_name, view_name=view_name, opts=opts,
-            callback=lambda results: self._publish_query(results))
-        g.start()
+        # the packets are generated, and the view queried, by the greenlet publishing them
+        self.control.start(self._replay_packets(datastore_name, view_name, opts))
 
-    def _query(self,datastore_name='dm_datastore', view_name='posts/posts_by_id', opts={}, callback=None):
+    def pause_replay(self):
         '''
-        @brief Makes the couch query and then callsback to publish
-        @param datastore_name Name of the datastore
-        @param view_name The name of the design view where the data is organized
-        @param opts options to pass
-        @param callback the content handler
+        @brief Stops publishing after the packet being published, until the replay is resumed
         '''
-        db = self.container.datastore_manager.get_datastore(datastore_name, DataStore.DS_PROFILE.SCIDATA, self.CFG)
+        self.control.pause()
 
-        ret = db.query_view(view_name=view_name,opts=opts)
+    def resume_replay(self):
+        self.control.resume()
 
-        callback(ret)
-
-    def _publish_query(self, results):
+    def grant_credits(self, credits=0):
         '''
-        @brief Publishes the appropriate data based on the delivery format and data returned from query
-        @param results The query results from the couch query
+        @brief Lets a consumer of a replay with a window accept credits more packets
         '''
+        self.control.grant(credits)
 
-        if results is None:
-            log.info('No Results')
-            return
-
-        publish_queue = self._parse_results(results)
-        for item in publish_queue:
-            log.debug('Item in queue: %s' % type(item))
-        granule = self._merge(publish_queue)
-        if not granule:
-            return # no dataset
+    def replay_status(self):
+        '''
+        @brief The state of the replay and the number of granules and bytes published so far
+        '''
+        return self.control.status.to_dict()
 
-        if self.delivery_format.has_key('fields'):
-            res = self.subset(granule,self.delivery_format['fields'])
-            granule = res
+    def _publish(self, packet):
+        self.lock.acquire()
+        try:
+            self.output.publish(packet)
+        finally:
+            self.lock.release()
 
-        if self.delivery_format.has_key('time'):
-            granule = self.time_subset(granule, self.delivery_format['time'])
+    def _packet_size(self, packet):
+        if isinstance(packet, StreamGranuleContainer):
+            return len(packet.identifiables[self.data_stream_id].values or '')
+        return 0
 
-        total_records = granule.identifiables[self.element_count_id].value
-        granule.identifiables[self.element_count_id].constraint.intervals = [[0, total_records-1],]
+    def _publish_progress(self, status):
+        self.event_publisher.publish_event(event_type='Event', origin=self.replay_id, origin_type='Replay',
+            sub_type=status.state, description='%d granules, %d bytes replayed' % (status.granules, status.bytes))
 
+    def cancel_replay(self):
+        '''
+        @brief Stops publishing after the packet being published and reports the replay as cancelled
+        '''
+        self.control.cancel()
+        if self.control.greenlet is not None:
+            self.control.greenlet.join(timeout=self.CFG.get_safe('process.cancel_timeout', 5))
 
-        if self.delivery_format.has_key('records'):
-            assert isinstance(self.delivery_format['records'], int), 'delivery format is incorrectly formatted.'
+    def _query(self,datastore_name='dm_datastore', view_name='posts/posts_by_id', opts={}):
+        '''
+        @brief Makes the couch query one page at a time
+        @param datastore_name Name of the datastore
+        @param view_name The name of the design view where the data is organized
+        @param opts options to pass
+        @return generator of the pages of results, each a list of at most page_size rows
+        '''
+        db = self.container.datastore_manager.get_datastore(datastore_name, DataStore.DS_PROFILE.SCIDATA, self.CFG)
 
-            for chunk in self._records(granule,self.delivery_format['records']):
-                self.lock.acquire()
-                self.output.publish(chunk)
-                self.lock.release()
-            return
+        opts = dict(opts, limit=self.page_size)
+        while True:
+            results = db.query_view(view_name=view_name,opts=opts)
+            if not results:
+                return
+            yield results
+            if len(results) < self.page_size:
+                return
+            # the next page starts after the last row, which is found by its key and document id
+            last = results[-1]
+            opts = dict(opts, start_key=last['key'], startkey_docid=last['id'], skip=1)
+
+    def _replay_packets(self, datastore_name, view_name, opts):
+        '''
+        @brief Yields the packets to publish based on the delivery format and data returned from query, one merged
+        granule (or its record chunks) per page of results so that only a page is held in memory
+        @param datastore_name Name of the datastore
+        @param view_name The name of the design view where the data is organized
+        @param opts options to pass
+        '''
+        # records of the dataset before the current page, to apply the time subset across pages
+        offset = 0
+        time_bounds = self.delivery_format.get('time')
+        # every packet carries the range of the records of the whole replay, which consumers use to tell when they
+        # have received all of it
+        replay_records = self._count_records(datastore_name, view_name, opts)
+        if time_bounds:
+            replay_records = max(min(time_bounds[1], replay_records) - max(time_bounds[0] - 1, 0), 0)
+
+        for results in self._query(datastore_name=datastore_name, view_name=view_name, opts=opts):
+            passthrough, publish_queue = self._parse_results(results)
+            for packet in passthrough:
+                yield packet
+            for item in publish_queue:
+                log.debug('Item in queue: %s' % type(item))
+            granule = self._merge(publish_queue)
+            if not granule:
+                continue # no dataset in this page
+
+            if self.delivery_format.has_key('fields'):
+                res = self.subset(granule,self.delivery_format['fields'])
+                granule = res
+
+            total_records = granule.identifiables[self.element_count_id].value
+            if time_bounds:
+                # the bounds are record numbers in the whole dataset, starting at 1
+                start = max(time_bounds[0] - 1 - offset, 0)
+                stop = min(time_bounds[1] - offset, total_records)
+                offset += total_records
+                if stop <= start:
+                    if offset >= time_bounds[1]:
+                        return
+                    continue
+                granule = self._slice(granule, slice(start, stop))
+                total_records = granule.identifiables[self.element_count_id].value
+
+            granule.identifiables[self.element_count_id].constraint.intervals = [[0, replay_records-1],]
+
+
+            if self.delivery_format.has_key('records'):
+                assert isinstance(self.delivery_format['records'], int), 'delivery format is incorrectly formatted.'
+
+                # chunks do not span pages, the last chunk of a page can be smaller
+                for chunk in self._records(granule,self.delivery_format['records']):
+                    yield chunk
+            else:
+                yield granule
 
+            if time_bounds and offset >= time_bounds[1]:
+                return # the rest of the dataset is past the time bounds
 
-        self.lock.acquire()
-        self.output.publish(granule)
-        self.lock.release()
+    def _count_records(self, datastore_name, view_name, opts):
+        '''
+        @brief Counts the records of the dataset a page at a time, reading the granules but not their data
+        @param datastore_name Name of the datastore
+        @param view_name The name of the design view where the data is organized
+        @param opts options to pass
+        @return the number of records, or at least the upper time bound when the replay has one
+        '''
+        time_bounds = self.delivery_format.get('time')
+        records = 0
+        for results in self._query(datastore_name=datastore_name, view_name=view_name, opts=opts):
+            for result in results:
+                packet = result['doc']
+                if isinstance(packet, StreamGranuleContainer) and self._parse_granule(packet):
+                    records += packet.identifiables[self.element_count_id].value
+            if time_bounds and records >= time_bounds[1]:
+                break # the records past the time bounds are not replayed
+        return records
 
     def _parse_results(self, results):
         '''
         @brief Switch-case logic for what packet types replay can handle and how to handle
         @param results List of results returned from couch view
-        @return A queue of msgs parsed and formatted to be iterated through and published.
+        @return The packets published as they are and a queue of msgs parsed and formatted to be merged.
         '''
         log.debug('called _parse_results')
+        passthrough = []
         publish_queue = []
 
         for result in results:
@@ -169,9 +273,7 @@ class ReplayProcess(BaseReplayProcess):
 
             if isinstance(packet, BlogBase):
                 packet.is_replay = True
-                self.lock.acquire()
-                self.output.publish(packet)
-                self.lock.release()
+                passthrough.append(packet)
                 continue
 
             if isinstance(packet, StreamDefinitionContainer):
@@ -187,7 +289,7 @@ class ReplayProcess(BaseReplayProcess):
 
             log.info('Unknown packet type in replay.')
 
-        return publish_queue
+        return passthrough, publish_queue
 
     def _records(self, granule, n):
         '''
@@ -1021,6 +1021,148 @@ class DataTable(object):
     return "%s(%s);" % (response_handler,
                         encoder.encode(response_obj).encode("utf-8"))
 
+  def _ColumnToJSonCells(self, encoder, col, values):
+    """Returns the JSON strings of the cells of one column.
+
+    Internal helper method for ToJSonRowsFromColumns. Numeric arrays in number
+    columns, and in date and datetime columns where they hold seconds since the
+    epoch (converted with datetime.fromtimestamp), are written without building
+    a JSON object per cell. Any other values go through CoerceValue.
+
+    Args:
+      encoder: The DataTableJSONEncoder used for the table.
+      col: The column description.
+      values: A sequence or one dimensional numpy array of the column values.
+
+    Returns:
+      A list with the JSON string of each cell.
+    """
+    col_type = col["type"]
+    dtype = getattr(values, "dtype", None)
+    kind = dtype.kind if dtype is not None else None
+
+    if kind in ("f", "i", "u") and col_type == "number":
+      if kind != "f":
+        return ['{"v":%d}' % v for v in values.tolist()]
+      # repr is what the encoder uses for finite floats, NaN and infinity are
+      # left to the encoder
+      return ['{"v":%s}' % (repr(v) if v - v == 0 else encoder.encode(v))
+              for v in values.tolist()]
+
+    if kind in ("f", "i", "u") and col_type in ("datetime", "date"):
+      values = [datetime.datetime.fromtimestamp(v) for v in values.tolist()]
+      if col_type == "datetime":
+        return ['{"v":"Date(%d,%d,%d,%d,%d,%d)"}' % (
+            v.year, v.month - 1, v.day, v.hour, v.minute, v.second)
+                for v in values]
+      return ['{"v":"Date(%d,%d,%d)"}' % (v.year, v.month - 1, v.day)
+              for v in values]
+
+    if kind is not None:
+      values = values.tolist()
+
+    cells = []
+    for value in values:
+      value = self.CoerceValue(value, col_type)
+      if value is None:
+        cell_obj = None
+      elif isinstance(value, tuple):
+        cell_obj = {"v": value[0]}
+        if len(value) > 1 and value[1] is not None:
+          cell_obj["f"] = value[1]
+        if len(value) == 3:
+          cell_obj["p"] = value[2]
+      else:
+        cell_obj = {"v": value}
+      cells.append(encoder.encode(cell_obj).encode("utf-8"))
+    return cells
+
+  def ToJSonRowsFromColumns(self, columns):
+    """Returns the JSON strings of the rows of a table given by columns.
+
+    This is a columnar alternative to loading the rows with LoadData. The data
+    of the table itself is not used or modified.
+
+    Args:
+      columns: A dictionary from column ID to a sequence or a one dimensional
+               numpy array of the values of that column. All the columns of
+               the table must be given, with the same number of values.
+
+    Returns:
+      A list with the JSON string of each row, as it appears in the "rows" of
+      the output of ToJSon.
+
+    Raises:
+      DataTableException: A column is missing or the columns are not of the
+                          same length, or a value does not match its type.
+    """
+    encoder = DataTableJSONEncoder()
+    lengths = set()
+    col_cells = []
+    for col in self.__columns:
+      if col["id"] not in columns:
+        raise DataTableException("Column %s is missing" % col["id"])
+      cells = self._ColumnToJSonCells(encoder, col, columns[col["id"]])
+      col_cells.append(cells)
+      lengths.add(len(cells))
+    if len(lengths) > 1:
+      raise DataTableException("The columns are not of the same length")
+
+    return ['{"c":[%s]}' % ",".join(cells) for cells in zip(*col_cells)]
+
+  def ToJSonResponseFromColumns(self, columns, req_id=0,
+                                response_handler="google.visualization.Query.setResponse"):
+    """Writes a table given by columns as a JSON response.
+
+    Produces the same string as loading the rows of the columns with LoadData
+    and calling ToJSonResponse, without the per cell conversions for numeric
+    columns. See ToJSonRowsFromColumns for the columns argument.
+
+    Args:
+      columns: A dictionary from column ID to the values of that column.
+      req_id: Optional. The response id, as retrieved by the request.
+      response_handler: Optional. The response handler, as retrieved by the
+          request.
+
+    Returns:
+      A JSON response string to be received by JS the visualization Query
+      object.
+    """
+    prefix, suffix = self.JSonResponseAroundRows(req_id, response_handler)
+    return prefix + ",".join(self.ToJSonRowsFromColumns(columns)) + suffix
+
+  def JSonResponseAroundRows(self, req_id=0,
+                             response_handler="google.visualization.Query.setResponse"):
+    """Returns the text of a JSON response before and after its rows.
+
+    Args:
+      req_id: Optional. The response id, as retrieved by the request.
+      response_handler: Optional. The response handler, as retrieved by the
+          request.
+
+    Returns:
+      A (prefix, suffix) tuple, such that joining the JSON strings of rows with
+      "," between them gives the JSON response for a table with these rows.
+    """
+    # The JSON object of the table without its rows
+    data, self.__data = self.__data, []
+    try:
+      table_obj = self._ToJSonObj()
+    finally:
+      self.__data = data
+
+    response_obj = {
+        "version": "0.6",
+        "reqId": str(req_id),
+        "table": table_obj,
+        "status": "ok"
+    }
+    encoder = DataTableJSONEncoder()
+    response = "%s(%s);" % (response_handler,
+                            encoder.encode(response_obj).encode("utf-8"))
+    prefix, suffix = response.split('"rows":[]', 1)
+    return prefix + '"rows":[', "]" + suffix
+
   def ToResponse(self, columns_order=None, order_by=(), tqx=""):
     """Writes the right response according to the request string passed in tqx.
 
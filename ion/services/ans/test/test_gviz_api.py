@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from datetime import datetime
+import time
+
+import numpy as np
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+import ion.services.ans.gviz_api as gviz_api
+
+
+def _numeric_table(num_rows=1024, num_vars=7):
+    description = [('time', 'datetime', 'time')] + [('var%d' % i, 'number', 'var%d' % i) for i in xrange(num_vars)]
+    columns = {'time': np.arange(num_rows, dtype='float64') * 1.5 + 1331000000.0}
+    for i in xrange(num_vars):
+        columns['var%d' % i] = np.sin(np.arange(num_rows) * (i + 1) / 10.0) * 100
+    return description, columns
+
+def _rows(description, columns):
+    rows = []
+    for i in xrange(len(columns[description[0][0]])):
+        row = []
+        for varname, vartype, _ in description:
+            val = columns[varname][i]
+            if isinstance(val, np.generic):
+                val = val.item()
+            if vartype in ('datetime', 'date') and isinstance(val, float):
+                val = datetime.fromtimestamp(val)
+            row.append(val)
+        rows.append(row)
+    return rows
+
+def benchmark(num_rows=1024, num_vars=7, repeat=10):
+    """
+    Times the JSON response of a numeric table built from rows with LoadData and ToJSonResponse against
+    ToJSonResponseFromColumns. Returns the two times in seconds.
+    """
+    description, columns = _numeric_table(num_rows, num_vars)
+
+    start = time.time()
+    for i in xrange(repeat):
+        data_table = gviz_api.DataTable(description)
+        data_table.LoadData(_rows(description, columns))
+        rows_response = data_table.ToJSonResponse()
+    rows_time = (time.time() - start) / repeat
+
+    start = time.time()
+    for i in xrange(repeat):
+        columns_response = gviz_api.DataTable(description).ToJSonResponseFromColumns(columns)
+    columns_time = (time.time() - start) / repeat
+
+    assert rows_response == columns_response
+    return rows_time, columns_time
+
+
+@attr('UNIT', group='as')
+class TestDataTableFromColumns(PyonTestCase):
+
+    def assert_same_response(self, description, columns, custom_properties=None):
+        data_table = gviz_api.DataTable(description, custom_properties=custom_properties)
+        data_table.LoadData(_rows(description, columns))
+        expected = data_table.ToJSonResponse(req_id=3)
+
+        columns_table = gviz_api.DataTable(description, custom_properties=custom_properties)
+        self.assertEqual(columns_table.ToJSonResponseFromColumns(columns, req_id=3), expected)
+
+    def test_numeric_columns(self):
+        description, columns = _numeric_table(100)
+        columns['var0'][5] = np.nan
+        columns['var1'][7] = np.inf
+        columns['count'] = np.arange(100)
+        description.append(('count', 'number', 'count'))
+        self.assert_same_response(description, columns, custom_properties={'source': 'ctd'})
+
+    def test_generic_columns(self):
+        description = [('day', 'date', 'day'), ('name', 'string', 'name'), ('value', 'number', 'value'),
+                       ('flag', 'boolean', 'flag')]
+        columns = {'day': np.array([1331000000.0, 1331100000.0, 1331200000.0]),
+                   'name': ['a', u'\xe9t\xe9', None],
+                   'value': [1, (2.5, '2.5 m'), None],
+                   'flag': np.array([True, False, True])}
+        self.assert_same_response(description, columns)
+
+    def test_empty_and_invalid_columns(self):
+        description, columns = _numeric_table(0)
+        self.assert_same_response(description, columns)
+
+        description, columns = _numeric_table(10)
+        data_table = gviz_api.DataTable(description)
+        columns['var0'] = columns['var0'][:5]
+        self.assertRaises(gviz_api.DataTableException, data_table.ToJSonRowsFromColumns, columns)
+        del columns['var0']
+        self.assertRaises(gviz_api.DataTableException, data_table.ToJSonRowsFromColumns, columns)
+
+    def test_rows_are_kept(self):
+        description, columns = _numeric_table(10)
+        data_table = gviz_api.DataTable(description)
+        data_table.LoadData(_rows(description, columns))
+        expected = data_table.ToJSonResponse()
+        prefix, suffix = data_table.JSonResponseAroundRows()
+        self.assertEqual(data_table.ToJSonResponse(), expected)
+        self.assertEqual(prefix + ','.join(data_table.ToJSonRowsFromColumns(columns)) + suffix, expected)
+
+    def test_benchmark(self):
+        rows_time, columns_time = benchmark(repeat=2)
+        self.assertTrue(columns_time > 0)
+
+
+if __name__ == '__main__':
+    rows_time, columns_time = benchmark()
+    print "1024 x 8 table: rows %.2f ms, columns %.2f ms (%.1fx)" % (rows_time * 1000, columns_time * 1000, rows_time / columns_time)
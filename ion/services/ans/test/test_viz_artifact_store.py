@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+import os
+import shutil
+import tempfile
+
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.services.ans.viz_artifact_store import VizArtifactStore
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@attr('UNIT', group='as')
+class TestVizArtifactStore(PyonTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def test_lru_eviction_and_accounting(self):
+        store = VizArtifactStore(max_bytes=30, ttl=None, clock=self.clock)
+        store.put(('img', 'dp1', 'a'), 'x' * 10, 'dp1')
+        store.put(('img', 'dp1', 'b'), 'x' * 10, 'dp1')
+        store.put(('img', 'dp2', 'c'), 'x' * 10, 'dp2')
+        self.assertEqual(store.data_product_usage('dp1'), 20)
+
+        # a is now the most recently used so b is evicted
+        self.assertEqual(store.get(('img', 'dp1', 'a')), 'x' * 10)
+        store.put(('img', 'dp2', 'd'), 'y' * 10, 'dp2')
+        self.assertEqual(store.get(('img', 'dp1', 'b')), None)
+        self.assertEqual(store.total_bytes, 30)
+        self.assertEqual(store.data_product_usage('dp1'), 10)
+        self.assertEqual(store.data_product_usage('dp2'), 20)
+        self.assertEqual(store.metrics['evictions'], 1)
+
+        # replacing a value does not count it twice
+        store.put(('img', 'dp2', 'd'), 'z' * 5, 'dp2')
+        self.assertEqual(store.data_product_usage('dp2'), 15)
+
+        store.remove_data_product('dp2')
+        self.assertEqual(store.data_product_usage('dp2'), 0)
+        self.assertEqual(len(store), 1)
+
+    def test_remove_data_product_by_type(self):
+        store = VizArtifactStore(max_bytes=100, ttl=None, clock=self.clock)
+        store.put(('google_realtime_dt', 'dp1'), 'table', 'dp1')
+        store.put(('matplotlib_graphs', 'dp1', 'temp_vs_time.png'), 'png', 'dp1')
+        store.put(('google_dt', 'dp1.ABC'), 'table', 'dp1')
+
+        store.remove_data_product('dp1', viz_product_types=('google_realtime_dt', 'matplotlib_graphs'))
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.get(('google_dt', 'dp1.ABC')), 'table')
+
+    def test_ttl(self):
+        store = VizArtifactStore(max_bytes=100, ttl=60, clock=self.clock)
+        store.put(('dt', 'dp1'), 'table', 'dp1')
+        store.put(('dt', 'dp2'), 'table', 'dp2')
+        self.clock.now += 30
+        self.assertEqual(store.get(('dt', 'dp1')), 'table')
+        self.clock.now += 31
+        self.assertEqual(store.get(('dt', 'dp1')), None)
+        store.expire()
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.total_bytes, 0)
+
+    def test_spill(self):
+        store = VizArtifactStore(max_bytes=10, ttl=None, spill_dir=self.spill_dir, max_spill_bytes=15, clock=self.clock)
+        store.put('a', 'a' * 10, 'dp1')
+        store.put('b', 'b' * 10, 'dp1')
+        self.assertEqual(store.metrics['spills'], 1)
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+        self.assertTrue('a' in store)
+
+        # reading the spilled value brings it back and spills the other one
+        self.assertEqual(store.get('a'), 'a' * 10)
+        self.assertEqual(store.metrics['spill_hits'], 1)
+        self.assertEqual(store.get('b'), 'b' * 10)
+
+        # the spill directory is bounded too
+        store.put('c', 'c' * 10, 'dp1')
+        store.put('d', 'd' * 10, 'dp1')
+        self.assertEqual(len(os.listdir(self.spill_dir)), 1)
+        self.assertEqual(store.spilled_bytes, 10)
+
+        store.remove_data_product('dp1')
+        self.assertEqual(os.listdir(self.spill_dir), [])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+from datetime import datetime
+import unittest
+
+import numpy as np
+from nose.plugins.attrib import attr
+
+import ion.services.ans.gviz_api as gviz_api
+from ion.services.ans.viz_data_buffers import RingBuffer, RealtimeDataTable, ColumnAccumulator, decimate, \
+    decimate_stride, decimate_min_max, decimate_lttb, DECIMATION_MIN_MAX, DECIMATION_LTTB
+
+
+@attr('UNIT', group='as')
+class TestRingBuffer(unittest.TestCase):
+
+    def test_extend_and_wrap(self):
+        rb = RingBuffer(5)
+        self.assertEqual(len(rb), 0)
+
+        rb.extend([1, 2, 3])
+        self.assertEqual(rb.values().tolist(), [1, 2, 3])
+
+        rb.extend([4, 5, 6, 7])
+        self.assertEqual(len(rb), 5)
+        self.assertEqual(rb.values().tolist(), [3, 4, 5, 6, 7])
+
+        # more values than the buffer can hold
+        rb.extend(range(10, 22))
+        self.assertEqual(rb.values().tolist(), [17, 18, 19, 20, 21])
+        self.assertEqual(rb.count, 19)
+
+
+@attr('UNIT', group='as')
+class TestRealtimeDataTable(unittest.TestCase):
+
+    def setUp(self):
+        self.description = [('time', 'datetime', 'time'), ('temp', 'number', 'temp'), ('conductivity', 'number', 'conductivity')]
+
+    def _packet(self, start, count):
+        return {'time': np.arange(start, start + count, dtype='float64') + 1331000000.0,
+                'temp': np.arange(start, start + count) * 0.25,
+                'conductivity': np.sin(np.arange(start, start + count))}
+
+    def test_matches_gviz_data_table(self):
+        window_size = 20
+        realtime_dt = RealtimeDataTable(self.description, window_size)
+        rows = []
+
+        for start, count in [(0, 7), (7, 1), (8, 30), (38, 3)]:
+            packet = self._packet(start, count)
+            realtime_dt.append(packet, count)
+
+            for i in xrange(count):
+                rows.append([datetime.fromtimestamp(float(packet['time'][i])), float(packet['temp'][i]), float(packet['conductivity'][i])])
+            rows = rows[-window_size:]
+
+            data_table = gviz_api.DataTable(self.description)
+            data_table.LoadData(rows)
+
+            self.assertEqual(realtime_dt.to_json_response(), data_table.ToJSonResponse())
+            self.assertEqual(len(realtime_dt), len(rows))
+
+
+@attr('UNIT', group='as')
+class TestDecimation(unittest.TestCase):
+
+    def test_column_accumulator(self):
+        acc = ColumnAccumulator(['time', 'temp'])
+        acc.append({'time': [1.0, 2.0, 3.0], 'temp': [10, 20, 30]}, 2)
+        acc.append({'time': [4.0], 'temp': [40]}, 1)
+        self.assertEqual(len(acc), 3)
+        columns = acc.columns()
+        self.assertEqual(columns['time'].tolist(), [1.0, 2.0, 4.0])
+        self.assertEqual(columns['temp'].tolist(), [10.0, 20.0, 40.0])
+        self.assertEqual(acc.columns()['temp'].tolist(), [10.0, 20.0, 40.0])
+
+    def test_stride(self):
+        self.assertEqual(decimate_stride(10, 20).tolist(), range(10))
+        # 1500 records used to be decimated with a factor of 1 and were never reduced
+        indices = decimate_stride(1500, 1024)
+        self.assertTrue(len(indices) <= 1024)
+        self.assertEqual(indices.tolist(), range(0, 1500, 2))
+        self.assertTrue(len(decimate_stride(1000000, 1024)) <= 1024)
+
+    def test_min_max_keeps_peaks(self):
+        y = np.zeros(10000)
+        y[1234] = 100.0
+        y[8765] = -100.0
+        indices = decimate_min_max(y, 100)
+        self.assertTrue(len(indices) <= 100)
+        self.assertTrue(1234 in indices)
+        self.assertTrue(8765 in indices)
+        self.assertEqual(indices.tolist(), sorted(indices.tolist()))
+
+    def test_lttb(self):
+        x = np.arange(5000, dtype='float64')
+        y = np.sin(x / 100.0)
+        y[2500] = 50.0
+        indices = decimate_lttb(x, y, 200)
+        self.assertEqual(len(indices), 200)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 4999)
+        self.assertTrue(2500 in indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_decimate(self):
+        columns = {'time': np.arange(3000, dtype='float64'), 'temp': np.random.rand(3000)}
+        for method in (None, DECIMATION_MIN_MAX, DECIMATION_LTTB):
+            indices = decimate(columns, 1024, method=method, y_var='temp')
+            self.assertTrue(0 < len(indices) <= 1024)
+        self.assertEqual(decimate(columns, 5000, method=DECIMATION_LTTB, y_var='temp').tolist(), range(3000))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+import numpy as np
+from mock import Mock, patch
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.services.ans.viz_graphs import GraphData, GraphRenderer, image_name_for, variable_for_image_name
+from ion.services.ans.viz_artifact_store import VizArtifactStore
+from ion.services.ans.visualization_service import VisualizationService
+
+
+@attr('UNIT', group='as')
+class TestVizGraphs(PyonTestCase):
+
+    def setUp(self):
+        self.graph_data = GraphData(history_size=50)
+        for start in xrange(0, 80, 10):
+            t = np.arange(start, start + 10, dtype='float64')
+            self.graph_data.extend({'time': t, 'temp': t * 2, 'latitude': np.zeros(10)})
+
+    def test_image_names(self):
+        self.assertEqual(image_name_for('temp'), 'temp_vs_time.png')
+        self.assertEqual(variable_for_image_name('temp_vs_time.png'), 'temp')
+        self.assertEqual(variable_for_image_name('temp.png'), None)
+
+    def test_graph_data(self):
+        self.assertEqual(self.graph_data.version, 8)
+        self.assertEqual(self.graph_data.plottable_variables(), ['temp'])
+
+        # only the latest 50 records are kept
+        x, ys = self.graph_data.select(['temp'])
+        self.assertEqual(x.tolist(), range(30, 80))
+
+        x, ys = self.graph_data.select(['temp'], start_time=40, end_time=44)
+        self.assertEqual(x.tolist(), [40, 41, 42, 43, 44])
+        self.assertEqual(ys['temp'].tolist(), [80, 82, 84, 86, 88])
+
+    def test_renderer_reuses_figures(self):
+        renderer = GraphRenderer(max_figures=2)
+        img = renderer.render(self.graph_data, ['temp'], width=200, height=100)
+        self.assertTrue(img.startswith('\x89PNG'))
+        fig = renderer.plots[(('temp',), 200, 100)][0]
+
+        renderer.render(self.graph_data, ['temp'], width=200, height=100, start_time=50)
+        self.assertTrue(renderer.plots[(('temp',), 200, 100)][0] is fig)
+
+        renderer.render(self.graph_data, ['temp'], width=300, height=100)
+        renderer.render(self.graph_data, ['temp'], width=400, height=100)
+        self.assertEqual(len(renderer.plots), 2)
+        self.assertFalse((('temp',), 200, 100) in renderer.plots)
+
+
+@attr('UNIT', group='as')
+class TestVizServiceGraphs(PyonTestCase):
+
+    def setUp(self):
+        self.viz = VisualizationService()
+        self.viz.viz_data_dictionary = {'matplotlib_graphs': {'dp1': {'list_of_images': []}}}
+        self.viz.graph_history_size = 50
+        self.viz.graph_data = {}
+        self.viz.graph_renderers = {}
+        self.viz.artifact_store = VizArtifactStore(ttl=None)
+        self.viz.touch_data_product = Mock(return_value=True)
+        self.start = 0
+
+    def submit(self, count=10):
+        t = range(self.start, self.start + count)
+        self.viz.submit_mpl_data('dp1', {'time': t, 'temp': [2 * v for v in t]})
+        self.start += count
+
+    def test_bounded_history(self):
+        for i in xrange(8):
+            self.submit()
+
+        # only the latest graph_history_size records of the data product are kept
+        x, ys = self.viz.graph_data['dp1'].select(['temp'])
+        self.assertEqual(x.tolist(), range(30, 80))
+        self.assertEqual(ys['temp'].tolist(), range(60, 160, 2))
+        self.assertEqual(self.viz.viz_data_dictionary['matplotlib_graphs']['dp1']['list_of_images'],
+                         ['temp_vs_time.png'])
+
+    def test_render_only_if_changed(self):
+        self.submit()
+
+        with patch('ion.services.ans.visualization_service.GraphRenderer') as renderer_class:
+            render = renderer_class.return_value.render
+            render.side_effect = lambda graph_data, variables, **kwargs: 'png %d' % render.call_count
+
+            self.assertEqual(self.viz.get_image('dp1', 'temp_vs_time.png', width=200, height=100), 'png 1')
+            self.assertEqual(self.viz.get_image('dp1', 'temp_vs_time.png', width=200, height=100), 'png 1')
+            self.assertEqual(render.call_count, 1)
+
+            # new values are rendered on the next request
+            self.submit()
+            self.assertEqual(self.viz.get_image('dp1', 'temp_vs_time.png', width=200, height=100), 'png 2')
+
+            # so are other sizes and time ranges
+            self.viz.get_image('dp1', 'temp_vs_time.png', width=300, height=100)
+            self.viz.get_image('dp1', 'temp_vs_time.png', width=200, height=100, start_time=5)
+            self.assertEqual(render.call_count, 4)
+
+            # a single renderer per data product keeps the figures
+            self.assertEqual(renderer_class.call_count, 1)
@@ -8,14 +8,15 @@ __license__ = 'Apache 2.0'
 """
 Note:
 [1] Currently for th case of replay data, the transform processes created libger on and need to be cleaned up.
-[2] Also need to clean up the storage used by the data tables in the case of replay. After they have been fetched by the
-    UI, the viz_data_dictionary should be cleaned up.
+[2] The images and data tables are kept in a size bounded VizArtifactStore. Replay data tables that are never fetched
+    by the UI expire with the store's time to live.
 """
 
 # Pyon imports
 # Note pyon imports need to be first for monkey patching to occur
 from pyon.ion.transform import TransformDataProcess
 from pyon.public import IonObject, RT, log, PRED, StreamSubscriberRegistrar, StreamPublisherRegistrar
+from pyon.core.exception import BadRequest
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
 from interface.services.dm.itransform_management_service import TransformManagementServiceClient
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient, ResourceRegistryServiceProcessClient
@@ -28,7 +29,9 @@ import random
 import StringIO
 import simplejson
 import math
+import time
 import gevent
+from gevent import spawn_later
 from gevent.greenlet import Greenlet
 
 from interface.services.ans.ivisualization_service import BaseVisualizationService
@@ -36,6 +39,7 @@ from interface.services.dm.idata_retriever_service import DataRetrieverServiceCl
 from interface.services.dm.idataset_management_service import DatasetManagementServiceClient
 from pyon.event.event import EventSubscriber
 from pyon.util.async import spawn
+from pyon.util.file_sys import FS, FileSystem
 #from interface.objects import ResourceModificationType
 from prototype.sci_data.stream_parser import PointSupplementStreamParser
 
@@ -49,6 +53,23 @@ from matplotlib.figure import Figure
 
 # Google viz library for google charts
 import ion.services.ans.gviz_api as gviz_api
+from ion.services.ans.viz_artifact_store import VizArtifactStore, DEFAULT_MAX_BYTES, DEFAULT_TTL, DEFAULT_MAX_SPILL_BYTES
+from ion.services.ans.viz_graphs import GraphData, GraphRenderer, image_name_for, variable_for_image_name, \
+    DEFAULT_GRAPH_HISTORY_SIZE, DEFAULT_IMAGE_WIDTH, DEFAULT_IMAGE_HEIGHT
+from ion.services.ans.viz_data_buffers import RealtimeDataTable, ColumnAccumulator, decimate, DECIMATION_STRIDE
+
+# Number of records kept in the sliding window of the realtime datatables
+DEFAULT_REALTIME_WINDOW_SIZE = 100
+# Minimum number of seconds between two realtime datatables published for a data product
+DEFAULT_REALTIME_PUBLISH_INTERVAL = 1.0
+# Maximum number of records in the historical datatables and how they are picked (stride, minmax or lttb)
+MAX_GOOGLE_DT_LEN = 1024
+DEFAULT_DECIMATION_METHOD = DECIMATION_STRIDE
+# Seconds between two submissions of new values by the matplotlib transforms
+DEFAULT_GRAPH_DATA_PUBLISH_INTERVAL = 5
+# Seconds after the last request for a data product before its viz transforms are torn down, and between two checks
+DEFAULT_VIZ_IDLE_TIMEOUT = 600
+DEFAULT_VIZ_IDLE_CHECK_INTERVAL = 60
 
 class VisualizationService(BaseVisualizationService):
 
@@ -61,8 +82,30 @@ class VisualizationService(BaseVisualizationService):
         self.viz_data_dictionary['google_dt'] = {}
         self.viz_data_dictionary['google_realtime_dt'] = {}
         self.viz_data_dictionary['matplotlib_graphs'] = {}
+
+        # The images and data tables themselves are kept in a size bounded store, the data dictionary only keeps
+        # track of the transforms and the names of the viz products
+        spill_dir = None
+        if self.CFG.get('viz_store_spill', False):
+            spill_dir = FileSystem.get_url(FS.CACHE, 'visualization')
+        self.artifact_store = VizArtifactStore(max_bytes=self.CFG.get('viz_store_max_bytes', DEFAULT_MAX_BYTES),
+                                               ttl=self.CFG.get('viz_store_ttl', DEFAULT_TTL),
+                                               spill_dir=spill_dir,
+                                               max_spill_bytes=self.CFG.get('viz_store_max_spill_bytes', DEFAULT_MAX_SPILL_BYTES))
+
+        # The latest values of each data product, from which the matplotlib graphs are rendered when requested,
+        # and the renderers which keep the figures of each data product
+        self.graph_history_size = self.CFG.get('graph_history_size', DEFAULT_GRAPH_HISTORY_SIZE)
+        self.graph_data = {}
+        self.graph_renderers = {}
+
         # Kind of redundant but we will maintain a separate list of data product_ids registered with the viz_service
         self.data_products = []
+        # The transforms of a data product are launched on the first request for it and torn down once it has not
+        # been requested for the idle timeout. data_product_id -> time of the last request
+        self.last_request_time = {}
+        self.idle_timeout = self.CFG.get('viz_idle_timeout', DEFAULT_VIZ_IDLE_TIMEOUT)
+        self.idle_check_interval = self.CFG.get('viz_idle_check_interval', DEFAULT_VIZ_IDLE_CHECK_INTERVAL)
 
         # Create clients to interface with PubSub, Transform Management Service and Resource Registry
         self.pubsub_cli = self.clients.pubsub_management
@@ -107,28 +150,14 @@ class VisualizationService(BaseVisualizationService):
 
         self.pubsub_cli.activate_subscription(self.viz_service_submit_stream_sub_id)
 
-        # Discover the existing data_product_ids active in the system
-        sys_prod_ids, _ = self.rr_cli.find_resources(RT.DataProduct, None, None, True)
-
-        # Register all the streams in the system, which will in turn start transform processes
-        for dp_id in sys_prod_ids:
-            self.register_new_data_product(dp_id)
-
-
-        # listen for events when new data_products show up
-        self.event_subscriber = EventSubscriber(
-            event_type = "ResourceModifiedEvent",
-            origin_type = "DataProduct",
-            sub_type="UPDATE",
-            callback=self.receive_new_dataproduct_event
-        )
-
-        self.event_subscriber.activate()
+        # The data products are registered, which starts their transform processes, when they are first requested.
+        # Tear down the transforms of the data products nobody looks at anymore
+        self.idle_data_product_reaper = spawn(self.reap_idle_data_products)
 
         return
 
     def on_stop(self):
-        self.event_subscriber.deactivate()
+        self.idle_data_product_reaper.kill()
 
         super(VisualizationService, self).on_stop()
         return
@@ -142,6 +171,9 @@ class VisualizationService(BaseVisualizationService):
         if(packet["viz_product_type"] == "google_dt"):
             self.submit_google_dt(data_product_id_token=packet["data_product_id_token"], data_table=packet["data_table"])
 
+        if(packet["viz_product_type"] == "matplotlib_data"):
+            self.submit_mpl_data(data_product_id=packet["data_product_id"], data=packet["data"])
+
         if(packet["viz_product_type"] == "matplotlib_graphs"):
             self.submit_mpl_image(data_product_id=packet["data_product_id"], image_obj=packet["image_obj"],
                                 image_name=packet["image_name"])
@@ -157,6 +189,9 @@ class VisualizationService(BaseVisualizationService):
         @throws NotFound    object with specified id, query does not exist
         """
 
+        # drop the requests for data tables that were never fetched
+        self.expire_google_dt_requests()
+
         # generate a token unique for this request
         data_product_id_token = data_product_id + "." + self.random_id_generator()
 
@@ -174,7 +209,8 @@ class VisualizationService(BaseVisualizationService):
 
         # setup the transform to handle the data coming back from the replay
         # Init storage for the resulting data_table
-        self.viz_data_dictionary['google_dt'][data_product_id_token] = {'data_table': [], 'ready_flag': False}
+        self.viz_data_dictionary['google_dt'][data_product_id_token] = {'data_product_id': data_product_id, 'ready_flag': False,
+                                                                        'request_time': time.time()}
 
         # Create the subscription to the stream. This will be passed as parameter to the transform worker
         query = StreamQuery(stream_ids=[replay_stream_id,])
@@ -222,11 +258,10 @@ class VisualizationService(BaseVisualizationService):
                 if  not self.viz_data_dictionary['google_dt'][data_product_id_token]['ready_flag']:
                     return None
                 else:
-                    # Make a reference to the data_table and clean space in global dict
-                    data_table = self.viz_data_dictionary['google_dt'][data_product_id_token]['data_table']
+                    # Make a reference to the data_table and clean space in the store
+                    data_table = self.artifact_store.get(('google_dt', data_product_id_token))
                     # clean up the transform and space in global dict
-                    self.tms_cli.deactivate_transform(self.viz_data_dictionary['google_dt'][data_product_id_token]['transform_proc'])
-                    del self.viz_data_dictionary['google_dt'][data_product_id_token]
+                    self.remove_google_dt_request(data_product_id_token)
 
                     # returning the reference to the data_table should mark the objects used by this tranform as ready
                     # for deletion
@@ -248,10 +283,10 @@ class VisualizationService(BaseVisualizationService):
         """
 
         try:
-            if data_product_id in self.viz_data_dictionary['google_realtime_dt']:
+            if self.touch_data_product(data_product_id):
                 # assign data_table to a temp var before returning it. This will ensure a complete object is returned
                 # in case the data_table is being updated by a transform process
-                data_table = self.viz_data_dictionary['google_realtime_dt'][data_product_id]['data_table']
+                data_table = self.artifact_store.get(('google_realtime_dt', data_product_id))
                 return data_table
             else:
                 return None
@@ -269,7 +304,7 @@ class VisualizationService(BaseVisualizationService):
 
         # return a json version of the array stored in the data_dict
         try:
-            if data_product_id in self.viz_data_dictionary['matplotlib_graphs']:
+            if self.touch_data_product(data_product_id):
                 # assign data_table to a temp var before returning it. This will ensure a complete object is returned
                 img_list = self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images']
                 json_img_list = simplejson.dumps({'data': img_list})
@@ -280,24 +315,64 @@ class VisualizationService(BaseVisualizationService):
         except AttributeError:
             return None
 
-    def get_image(self, data_product_id = '', image_name=''):
-        """Request to fetch a file object from within the Visualization Service
+    def get_image(self, data_product_id = '', image_name='', width=DEFAULT_IMAGE_WIDTH, height=DEFAULT_IMAGE_HEIGHT,
+                  start_time=None, end_time=None, variables=None):
+        """Request to fetch a file object from within the Visualization Service. The image is rendered from the latest
+        values of the data product when it is requested and kept until new values arrive
 
-        @param file_name    str
+        @param data_product_id    str
+        @param image_name    str
+        @param width    int
+        @param height    int
+        @param start_time    float
+        @param end_time    float
+        @param variables    list
         @retval file_obj    str
         @throws NotFound    object with specified id does not exist
+        @throws BadRequest    if the size or the time range is invalid
         """
         try:
-            if data_product_id in self.viz_data_dictionary['matplotlib_graphs']:
-                if image_name in self.viz_data_dictionary['matplotlib_graphs'][data_product_id]:
-                    img = self.viz_data_dictionary['matplotlib_graphs'][data_product_id][image_name]
-                    return img
-                else:
-                    return None
-            else:
+            if not self.touch_data_product(data_product_id):
                 return None
 
-        except AttributeError:
+            graph_data = self.graph_data.get(data_product_id)
+            if graph_data is None:
+                # nothing to render from, return an image submitted to the service if there is one
+                return self.artifact_store.get(('matplotlib_graphs', data_product_id, image_name))
+
+            # The variables to plot are given or named by the image
+            if not variables:
+                variables = [variable_for_image_name(image_name)]
+            elif isinstance(variables, basestring):
+                variables = variables.split(',')
+            plottable_variables = graph_data.plottable_variables()
+            for varname in variables:
+                if varname not in plottable_variables:
+                    return None
+
+            width, height = int(width), int(height)
+            if width <= 0 or height <= 0:
+                raise BadRequest("The image size must be positive")
+            if start_time is not None:
+                start_time = float(start_time)
+            if end_time is not None:
+                end_time = float(end_time)
+            if start_time is not None and end_time is not None and start_time > end_time:
+                raise BadRequest("The start_time of the image is after its end_time")
+
+            # Images are only rendered again once new values arrived for the data product
+            key = ('matplotlib_graphs', data_product_id, tuple(variables), width, height, start_time, end_time, graph_data.version)
+            img = self.artifact_store.get(key)
+            if img is None:
+                if data_product_id not in self.graph_renderers:
+                    self.graph_renderers[data_product_id] = GraphRenderer()
+                img = self.graph_renderers[data_product_id].render(graph_data, variables, width=width, height=height,
+                                                                   start_time=start_time, end_time=end_time)
+                self.artifact_store.put(key, img, data_product_id)
+
+            return img
+
+        except (AttributeError, ValueError):
             return None
 
 
@@ -311,9 +386,14 @@ class VisualizationService(BaseVisualizationService):
 
         """
 
-        # Just copy the datatable in to the data dictionary
-        self.viz_data_dictionary['google_dt'][data_product_id_token]['data_table'] = data_table
-        self.viz_data_dictionary['google_dt'][data_product_id_token]['ready_flag'] = True
+        # Ignore tables for requests that have expired
+        if data_product_id_token not in self.viz_data_dictionary['google_dt']:
+            return
+
+        # Just copy the datatable in to the store
+        request = self.viz_data_dictionary['google_dt'][data_product_id_token]
+        self.artifact_store.put(('google_dt', data_product_id_token), data_table, request['data_product_id'])
+        request['ready_flag'] = True
 
         #self.result.set(True)
 
@@ -329,8 +409,32 @@ class VisualizationService(BaseVisualizationService):
 
         """
 
-        # Just copy the datatable in to the data dictionary
-        self.viz_data_dictionary['google_realtime_dt'][data_product_id]['data_table'] = data_table
+        # Just copy the datatable in to the store
+        self.artifact_store.put(('google_realtime_dt', data_product_id), data_table, data_product_id)
+
+        return
+
+    def submit_mpl_data(self, data_product_id='', data=None):
+        """Send the latest values of a data product to the visualization service
+
+        @param data_product_id    str
+        @param data    dict
+        """
+
+        if data_product_id not in self.viz_data_dictionary['matplotlib_graphs']:
+            return
+
+        if data_product_id not in self.graph_data:
+            self.graph_data[data_product_id] = GraphData(self.graph_history_size)
+        graph_data = self.graph_data[data_product_id]
+        graph_data.extend(data)
+
+        # List the image of each variable the first time it shows up
+        list_of_images = self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images']
+        for varname in graph_data.plottable_variables():
+            image_name = image_name_for(varname)
+            if image_name not in list_of_images:
+                list_of_images.append(image_name)
 
         return
 
@@ -356,11 +460,40 @@ class VisualizationService(BaseVisualizationService):
             list_len = len(self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images'])
             self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['list_of_images'].append(image_name)
 
-        # Add binary data from the image to the dictionary
-        self.viz_data_dictionary['matplotlib_graphs'][data_product_id][image_name] = image_obj
+        # Add binary data from the image to the store
+        self.artifact_store.put(('matplotlib_graphs', data_product_id, image_name), image_obj, data_product_id)
 
         return
 
+    def remove_google_dt_request(self, data_product_id_token=''):
+        # Stop the replay transform of a data table request and release the table
+        request = self.viz_data_dictionary['google_dt'].pop(data_product_id_token)
+        self.artifact_store.remove(('google_dt', data_product_id_token))
+        if 'transform_proc' in request:
+            self.tms_cli.deactivate_transform(request['transform_proc'])
+
+    def expire_google_dt_requests(self):
+        """
+        Cleans up the data table requests that were made longer than the store's time to live ago and never fetched.
+        """
+        self.artifact_store.expire()
+        if self.artifact_store.ttl is None:
+            return
+
+        now = time.time()
+        for token, request in self.viz_data_dictionary['google_dt'].items():
+            if now - request['request_time'] > self.artifact_store.ttl:
+                log.debug("Visualization_service: removing the expired data table request %s", token)
+                self.remove_google_dt_request(token)
+
+    def get_viz_store_usage(self, data_product_id=''):
+        """Returns the number of bytes used in memory by the viz products of a data product
+
+        @param data_product_id    str
+        @retval usage    int
+        """
+        return self.artifact_store.data_product_usage(data_product_id)
+
     def register_new_data_product(self, data_product_id=''):
 
         """Apprise the Visualization service of a new data product in the system. This function inits transform
@@ -388,16 +521,16 @@ class VisualizationService(BaseVisualizationService):
         # Go ahead only if the data product is unique
         if data_product_id in self.data_products:
             raise BadRequest
-        self.data_products[len(self.data_products):] = data_product_id
+        self.data_products.append(data_product_id)
 
         # init the space needed to store matplotlib_graphs and realtime Google data tables
 
         # For the matplotlib graphs, the list_of_images stores the names of the image files. The actual binary data for the
-        # images is also stored in the same dictionary as {img_name1: binary_data1, img_name2: binary_data2 .. etc}
+        # images is kept in the artifact store under ('matplotlib_graphs', data_product_id, image_name)
         self.viz_data_dictionary['matplotlib_graphs'][data_product_id] = {'transform_proc': "", 'list_of_images': []}
 
-        # The 'data_table' key points to a JSON string
-        self.viz_data_dictionary['google_realtime_dt'][data_product_id] = {'transform_proc': "", 'data_table': []}
+        # The JSON string of the data table is kept in the artifact store under ('google_realtime_dt', data_product_id)
+        self.viz_data_dictionary['google_realtime_dt'][data_product_id] = {'transform_proc': ""}
 
         ###############################################################################
         # Create transform process for the matplotlib graphs.
@@ -421,6 +554,7 @@ class VisualizationService(BaseVisualizationService):
 
         # keep a record of the the viz_transform_id
         self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['transform_proc'] = viz_transform_id1
+        self.viz_data_dictionary['matplotlib_graphs'][data_product_id]['subscription_id'] = viz_subscription_id1
 
 
         ###############################################################################
@@ -446,19 +580,58 @@ class VisualizationService(BaseVisualizationService):
 
         # keep a record of the the viz_transform_id
         self.viz_data_dictionary['google_realtime_dt'][data_product_id]['transform_proc'] = viz_transform_id2
+        self.viz_data_dictionary['google_realtime_dt'][data_product_id]['subscription_id'] = viz_subscription_id2
 
+    def touch_data_product(self, data_product_id=''):
+        """
+        Notes a request for the viz products of a data product, registering it if its transforms are not running.
+        Returns False if the data product could not be registered.
+        """
+        if data_product_id not in self.viz_data_dictionary['matplotlib_graphs']:
+            self.register_new_data_product(data_product_id)
+            if data_product_id not in self.viz_data_dictionary['matplotlib_graphs']:
+                return False
 
-    def random_id_generator(self, size=8, chars=string.ascii_uppercase + string.digits):
-        id = ''.join(random.choice(chars) for x in range(size))
-        return id
+        self.last_request_time[data_product_id] = time.time()
+        return True
 
-    def receive_new_dataproduct_event(self, event_msg, headers):
+    def unregister_data_product(self, data_product_id=''):
         """
-        For now we will start a thread that emulates an event handler
+        Tears down the viz transforms of a data product and drops its realtime viz products. They are started again
+        by the next request for the data product.
         """
+        for viz_product_type in ('matplotlib_graphs', 'google_realtime_dt'):
+            record = self.viz_data_dictionary[viz_product_type].pop(data_product_id, None)
+            if record is None:
+                continue
+            try:
+                self.tms_cli.deactivate_transform(record['transform_proc'])
+                self.tms_cli.delete_transform(record['transform_proc'])
+                self.pubsub_cli.delete_subscription(record['subscription_id'])
+            except Exception as ex:
+                log.warn("Visualization_service: failed to tear down the %s transform of %s: %s", viz_product_type, data_product_id, ex)
+
+        self.artifact_store.remove_data_product(data_product_id, viz_product_types=('matplotlib_graphs', 'google_realtime_dt'))
+        self.graph_data.pop(data_product_id, None)
+        self.graph_renderers.pop(data_product_id, None)
+        self.last_request_time.pop(data_product_id, None)
+        if data_product_id in self.data_products:
+            self.data_products.remove(data_product_id)
+
+    def reap_idle_data_products(self):
+        while True:
+            gevent.sleep(self.idle_check_interval)
 
-        # register the new data product
-        self.register_new_data_product(event_msg.origin)
+            now = time.time()
+            for data_product_id, last_request_time in self.last_request_time.items():
+                if now - last_request_time > self.idle_timeout:
+                    log.debug("Visualization_service: stopping the viz transforms of idle data product %s", data_product_id)
+                    self.unregister_data_product(data_product_id)
+
+
+    def random_id_generator(self, size=8, chars=string.ascii_uppercase + string.digits):
+        id = ''.join(random.choice(chars) for x in range(size))
+        return id
 
 
 class VizTransformProcForGoogleDT(TransformDataProcess):
@@ -499,10 +672,21 @@ class VizTransformProcForGoogleDT(TransformDataProcess):
         self.stream_id = stream_ids[0]
 
         self.dataDescription = []
-        self.dataTableContent = []
-        self.varTuple = []
+        self.dataTableColumns = None
         self.total_num_of_records_recvd = 0
 
+        # The realtime window and the publish throttle
+        self.realtime_window_size = self.CFG.get('realtime_window_size', DEFAULT_REALTIME_WINDOW_SIZE)
+        self.realtime_publish_interval = self.CFG.get('realtime_publish_interval', DEFAULT_REALTIME_PUBLISH_INTERVAL)
+        self.realtime_data_table = None
+        self.last_publish_time = 0
+        self.deferred_publish = None
+
+        # Decimation of the historical datatables
+        self.max_google_dt_len = self.CFG.get('max_google_dt_len', MAX_GOOGLE_DT_LEN)
+        self.decimation_method = self.CFG.get('decimation_method', DEFAULT_DECIMATION_METHOD)
+        self.decimation_variable = self.CFG.get('decimation_variable', None)
+
 
     def process(self, packet):
 
@@ -531,96 +715,110 @@ class VizTransformProcForGoogleDT(TransformDataProcess):
 
                 self.dataDescription.append((varname, 'number', varname))
 
-            self.initDataTableFlag = False
-
+            if self.realtime_flag:
+                self.realtime_data_table = RealtimeDataTable(self.dataDescription, self.realtime_window_size)
+            else:
+                self.dataTableColumns = ColumnAccumulator([varname for varname,_,_ in self.dataDescription])
 
-        # Add the records to the datatable
-        for i in xrange(arrLen):
-            varTuple = []
+            self.initDataTableFlag = False
 
-            for varname,_,_ in self.dataDescription:
-                val = float(vardict[varname][i])
-                if varname == 'time':
-                    varTuple.append(datetime.fromtimestamp(val))
-                else:
-                    varTuple.append(val)
 
-            # Append the tuples to the data table
-            self.dataTableContent.append (varTuple)
+        if self.realtime_flag:
+            # The realtime window only keeps the latest records, the cost is proportional to the new records
+            self.realtime_data_table.append(vardict, arrLen)
+            self.publish_realtime_dt()
+            return
 
-            if self.realtime_flag:
-                # Maintain a sliding window for realtime transform processes
-                realtime_window_size = 100
-                if len(self.dataTableContent) > realtime_window_size:
-                    # always pop the first element till window size is what we want
-                    while len(self.dataTableContent) > realtime_window_size:
-                        self.dataTableContent.pop(0)
+        # Add the records to the columns of the datatable
+        self.dataTableColumns.append(vardict, arrLen)
 
 
-        if not self.realtime_flag:
-            # This is the historical view part. Make a note of now many records were received
-            data_stream_id = self.stream_def.data_stream_id
-            element_count_id = self.stream_def.identifiables[data_stream_id].element_count_id
-            # From each granule you can check the constraint on the number of records
-            expected_range = packet.identifiables[element_count_id].constraint.intervals[0]
+        # This is the historical view part. Make a note of now many records were received
+        data_stream_id = self.stream_def.data_stream_id
+        element_count_id = self.stream_def.identifiables[data_stream_id].element_count_id
+        # Every granule of a replay carries the range of the records of the whole replay, however many granules it
+        # is published in
+        expected_range = packet.identifiables[element_count_id].constraint.intervals[0]
 
-            # The number of records in a given packet is:
-            self.total_num_of_records_recvd += packet.identifiables[element_count_id].value
+        # The number of records in a given packet is:
+        self.total_num_of_records_recvd += packet.identifiables[element_count_id].value
 
 
-        # submit the Json version of the datatable to the viz service
-        if self.realtime_flag:
-        # create the google viz data table
+        # Submit table back to the service if we received all the replay data
+        if self.total_num_of_records_recvd == (expected_range[1] + 1):
             data_table = gviz_api.DataTable(self.dataDescription)
-            data_table.LoadData(self.dataTableContent)
 
             # submit resulting table back using the out stream publisher
-            msg = {"viz_product_type": "google_realtime_dt",
-                   "data_product_id": self.data_product_id,
-                   "data_table": data_table.ToJSonResponse() }
+            msg = {"viz_product_type": "google_dt",
+                   "data_product_id_token": self.data_product_id_token,
+                   "data_table": data_table.ToJSonResponseFromColumns(self.build_decimated_columns()) }
             self.out_stream_pub.publish(msg)
-        else:
-            # Submit table back to the service if we received all the replay data
-            if self.total_num_of_records_recvd == (expected_range[1] + 1):
-                # If the datatable received was too big, decimate on the fly to a fixed size
-                max_google_dt_len = 1024
-                if len(self.dataTableContent) > max_google_dt_len:
-                    decimation_factor = int(math.ceil(len(self.dataTableContent) / (max_google_dt_len)))
 
-                    for i in xrange(len(self.dataTableContent) - 1, 0, -1):
+    def build_decimated_columns(self):
+        """
+        Picks at most max_google_dt_len records from the received columns. The time column holds the timestamps
+        which the datatable converts to dates.
+        """
+        columns = self.dataTableColumns.columns()
+
+        y_var = self.decimation_variable
+        if y_var is None and len(self.dataDescription) > 1:
+            y_var = self.dataDescription[1][0]
+        method = self.decimation_method
+        if y_var not in columns:
+            method = DECIMATION_STRIDE
+
+        indices = decimate(columns, self.max_google_dt_len, method=method, x_var='time', y_var=y_var)
+
+        return dict([(varname, values[indices]) for varname, values in columns.iteritems()])
 
-                        if(i % decimation_factor == 0):
-                            continue
-                        self.dataTableContent.pop(i)
+    def publish_realtime_dt(self):
+        """
+        Submits the Json version of the realtime datatable to the viz service, at most once per publish interval.
+        When packets arrive faster than that, the latest window is published once the interval has passed.
+        """
+        if self.deferred_publish is not None:
+            # the latest window will be picked up by the pending publish
+            return
 
-                data_table = gviz_api.DataTable(self.dataDescription)
-                data_table.LoadData(self.dataTableContent)
+        wait_time = self.last_publish_time + self.realtime_publish_interval - time.time()
+        if wait_time > 0:
+            self.deferred_publish = spawn_later(wait_time, self._publish_realtime_dt)
+            return
+
+        self._publish_realtime_dt()
 
-                # submit resulting table back using the out stream publisher
-                msg = {"viz_product_type": "google_dt",
-                       "data_product_id_token": self.data_product_id_token,
-                       "data_table": data_table.ToJSonResponse() }
-                self.out_stream_pub.publish(msg)
-                return
+    def _publish_realtime_dt(self):
+        self.deferred_publish = None
+        self.last_publish_time = time.time()
 
+        # submit resulting table back using the out stream publisher
+        msg = {"viz_product_type": "google_realtime_dt",
+               "data_product_id": self.data_product_id,
+               "data_table": self.realtime_data_table.to_json_response() }
+        self.out_stream_pub.publish(msg)
 
-        # clear the tuple for future use
-        self.varTuple[:] = []
+    def on_stop(self):
+        if self.deferred_publish is not None:
+            self.deferred_publish.kill()
+        super(VizTransformProcForGoogleDT, self).on_stop()
 
 
 
 class VizTransformProcForMatplotlibGraphs(TransformDataProcess):
 
     """
-    This class is used for instantiating worker processes that have subscriptions to data streams and convert
-    incoming data from CDM format to Matplotlib graphs
+    This class is used for instantiating worker processes that have subscriptions to data streams and submit the
+    incoming data to the Visualization Service, which renders the Matplotlib graphs when they are requested
 
     """
     def on_start(self):
         super(VizTransformProcForMatplotlibGraphs,self).on_start()
         #assert len(self.streams)==1
         self.initDataFlag = True
-        self.graph_data = {} # Stores a dictionary of variables : [List of values]
+        # Values received since the last submission to the service
+        self.pending_data = None
+        self.graph_data_publish_interval = self.CFG.get('graph_data_publish_interval', DEFAULT_GRAPH_DATA_PUBLISH_INTERVAL)
 
         # Need some clients
         self.rr_cli = ResourceRegistryServiceProcessClient(process = self, node = self.container.node)
@@ -638,11 +836,11 @@ class VizTransformProcForMatplotlibGraphs(TransformDataProcess):
         self.stream_def_id = self.CFG.get("stream_def_id")
         self.stream_def = self.rr_cli.read(self.stream_def_id)
 
-        # Start the thread responsible for keeping track of time and generating graphs
+        # Start the thread responsible for keeping track of time and submitting the data
         # Mutex for ensuring proper concurrent communications between threads
         self.lock = RLock()
-        self.rendering_proc = Greenlet(self.rendering_thread)
-        self.rendering_proc.start()
+        self.publishing_proc = Greenlet(self.publishing_thread)
+        self.publishing_proc.start()
 
 
 
@@ -661,77 +859,34 @@ class VizTransformProcForMatplotlibGraphs(TransformDataProcess):
             vardict[varname] = psd.get_values(varname)
             arrLen = len(vardict[varname])
 
-        if self.initDataFlag:
-            # look at the incoming packet and store
-            for varname in psd.list_field_names():
-                self.lock.acquire()
-                self.graph_data[varname] = []
-                self.lock.release()
-
-            self.initDataFlag = False
-
-        # If code reached here, the graph data storage has been initialized. Just add values
-        # to the list
         with self.lock:
-            for varname in psd.list_field_names():
-                self.graph_data[varname].extend(vardict[varname])
+            if self.initDataFlag:
+                # look at the incoming packet and store
+                self.pending_data = ColumnAccumulator(psd.list_field_names())
+                self.initDataFlag = False
 
+            self.pending_data.append(vardict, arrLen)
 
-    def rendering_thread(self):
-        from copy import deepcopy
-        # Service Client
 
-        # init Matplotlib
-        fig = Figure()
-        ax = fig.add_subplot(111)
-        canvas = FigureCanvas(fig)
-        imgInMem = StringIO.StringIO()
+    def publishing_thread(self):
         while True:
 
-            # Sleep for a pre-decided interval. Should be specifiable in a YAML file
-            gevent.sleep(20)
+            # Sleep for a pre-decided interval
+            gevent.sleep(self.graph_data_publish_interval)
 
-            # If there's no data, wait
-            # Lock is used here to make sure the entire vector exists start to finish, this assures that the data won
-            working_set=None
+            # Nothing to do if no data arrived since the last submission
             with self.lock:
-                if len(self.graph_data) == 0:
+                if self.pending_data is None or len(self.pending_data) == 0:
                     continue
-                else:
-                    working_set = deepcopy(self.graph_data)
+                columns = self.pending_data.columns()
+                self.pending_data = ColumnAccumulator(self.pending_data.varnames)
 
+            # submit the new values to the service using the out stream publisher
+            msg = {"viz_product_type": "matplotlib_data",
+                   "data_product_id": self.data_product_id,
+                   "data": dict([(varname, values.tolist()) for varname, values in columns.iteritems()])}
+            self.out_stream_pub.publish(msg)
 
-            # For the simple case of testing, lets plot all time variant variables one at a time
-            xAxisVar = 'time'
-            xAxisFloatData = working_set[xAxisVar]
-
-            for varName, varData in working_set.iteritems():
-                if varName == 'time' or varName == 'height' or varName == 'longitude' or varName == 'latitude':
-                    continue
-
-                yAxisVar = varName
-                yAxisFloatData = working_set[varName]
-
-                # Generate the plot
-
-                ax.plot(xAxisFloatData, yAxisFloatData, 'ro')
-                ax.set_xlabel(xAxisVar)
-                ax.set_ylabel(yAxisVar)
-                ax.set_title(yAxisVar + ' vs ' + xAxisVar)
-                ax.set_autoscale_on(False)
-
-                # generate filename for the output image
-                fileName = yAxisVar + '_vs_' + xAxisVar + '.png'
-                # Save the figure to the in memory file
-                canvas.print_figure(imgInMem, format="png")
-                imgInMem.seek(0)
-
-                # submit resulting table back using the out stream publisher
-                msg = {"viz_product_type": "matplotlib_graphs",
-                       "data_product_id": self.data_product_id,
-                       "image_obj": imgInMem.getvalue(),
-                       "image_name": fileName}
-                self.out_stream_pub.publish(msg)
-
-                #clear the canvas for the next image
-                ax.clear()
+    def on_stop(self):
+        self.publishing_proc.kill()
+        super(VizTransformProcForMatplotlibGraphs, self).on_stop()
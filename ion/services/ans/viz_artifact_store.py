@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+"""
+Size bounded store for the viz products (images and datatables) held by the Visualization Service. The least recently
+used products are evicted once the memory limit is reached and products not updated within the time to live expire.
+When a spill directory is given, evicted products are written there and read back when they are requested again.
+The bytes used by each data product are accounted for so the service can report them.
+"""
+
+import os
+import time
+import hashlib
+from collections import OrderedDict
+
+# Defaults for the memory limit (bytes), the time to live (seconds) and the spill directory limit (bytes)
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_TTL = 24 * 3600
+DEFAULT_MAX_SPILL_BYTES = 512 * 1024 * 1024
+
+
+class VizArtifactStore(object):
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, spill_dir=None, max_spill_bytes=DEFAULT_MAX_SPILL_BYTES,
+                 clock=time.time):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.clock = clock
+
+        # key -> (data_product_id, value, timestamp), least recently used first
+        self.entries = OrderedDict()
+        # key -> (data_product_id, file path, size, timestamp) of the products written to the spill directory
+        self.spilled = OrderedDict()
+        self.total_bytes = 0
+        self.spilled_bytes = 0
+        # data_product_id -> bytes held in memory
+        self.usage = {}
+        self.metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'spills': 0, 'spill_hits': 0}
+
+        if self.spill_dir and not os.path.exists(self.spill_dir):
+            os.makedirs(self.spill_dir)
+
+    def __len__(self):
+        return len(self.entries) + len(self.spilled)
+
+    def __contains__(self, key):
+        return key in self.entries or key in self.spilled
+
+    def put(self, key, value, data_product_id=''):
+        """
+        Stores a str value under the key (a tuple such as (viz_product_type, data_product_id, name)) and evicts the
+        least recently used values if the store grows over its limit.
+        """
+        self.remove(key)
+        self._add(key, data_product_id, value, self.clock())
+        self._evict()
+
+    def get(self, key):
+        """
+        Returns the value stored under the key, or None if it is not in the store or has expired.
+        """
+        if key in self.entries:
+            data_product_id, value, timestamp = self.entries[key]
+            if self._expired(timestamp):
+                self.metrics['expirations'] += 1
+                self.remove(key)
+                self.metrics['misses'] += 1
+                return None
+            # move the entry to the most recently used end
+            del self.entries[key]
+            self.entries[key] = (data_product_id, value, timestamp)
+            self.metrics['hits'] += 1
+            return value
+
+        if key in self.spilled:
+            data_product_id, path, size, timestamp = self.spilled[key]
+            value = None
+            if not self._expired(timestamp):
+                try:
+                    with open(path, 'rb') as f:
+                        value = f.read()
+                except IOError:
+                    value = None
+            else:
+                self.metrics['expirations'] += 1
+            self._remove_spilled(key)
+            if value is None:
+                self.metrics['misses'] += 1
+                return None
+            # bring the value back in memory
+            self._add(key, data_product_id, value, timestamp)
+            self._evict()
+            self.metrics['spill_hits'] += 1
+            return value
+
+        self.metrics['misses'] += 1
+        return None
+
+    def remove(self, key):
+        if key in self.entries:
+            data_product_id, value, timestamp = self.entries.pop(key)
+            self._account(data_product_id, -len(value))
+        if key in self.spilled:
+            self._remove_spilled(key)
+
+    def remove_data_product(self, data_product_id='', viz_product_types=None):
+        # drop everything stored for a data product, or only the values whose key starts with one of viz_product_types
+        def matches(key, entry):
+            return entry[0] == data_product_id and (viz_product_types is None or key[0] in viz_product_types)
+
+        for key in [key for key, entry in self.entries.iteritems() if matches(key, entry)]:
+            self.remove(key)
+        for key in [key for key, entry in self.spilled.iteritems() if matches(key, entry)]:
+            self._remove_spilled(key)
+
+    def expire(self):
+        """
+        Removes all the values that have not been updated within the time to live.
+        """
+        for key in [key for key, entry in self.entries.iteritems() if self._expired(entry[2])]:
+            self.remove(key)
+            self.metrics['expirations'] += 1
+        for key in [key for key, entry in self.spilled.iteritems() if self._expired(entry[3])]:
+            self._remove_spilled(key)
+            self.metrics['expirations'] += 1
+
+    def data_product_usage(self, data_product_id=''):
+        return self.usage.get(data_product_id, 0)
+
+    def _add(self, key, data_product_id, value, timestamp):
+        self.entries[key] = (data_product_id, value, timestamp)
+        self._account(data_product_id, len(value))
+
+    def _account(self, data_product_id, size):
+        self.total_bytes += size
+        usage = self.usage.get(data_product_id, 0) + size
+        if usage > 0:
+            self.usage[data_product_id] = usage
+        else:
+            self.usage.pop(data_product_id, None)
+
+    def _expired(self, timestamp):
+        return self.ttl is not None and self.clock() - timestamp > self.ttl
+
+    def _evict(self):
+        # keep the most recently used value even if it is larger than the limit on its own
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, (data_product_id, value, timestamp) = self.entries.popitem(last=False)
+            self._account(data_product_id, -len(value))
+            self.metrics['evictions'] += 1
+            if self.spill_dir:
+                self._spill(key, data_product_id, value, timestamp)
+
+    def _spill(self, key, data_product_id, value, timestamp):
+        path = os.path.join(self.spill_dir, hashlib.sha1(repr(key)).hexdigest())
+        with open(path, 'wb') as f:
+            f.write(value)
+        self.spilled[key] = (data_product_id, path, len(value), timestamp)
+        self.spilled_bytes += len(value)
+        self.metrics['spills'] += 1
+
+        while self.spilled_bytes > self.max_spill_bytes and self.spilled:
+            self._remove_spilled(next(iter(self.spilled)))
+
+    def _remove_spilled(self, key):
+        data_product_id, path, size, timestamp = self.spilled.pop(key)
+        self.spilled_bytes -= size
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
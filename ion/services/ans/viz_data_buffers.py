@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+"""
+Fixed size data structures used by the visualization transforms so that the memory and CPU they use per packet
+depends on the number of new values received and not on the amount of data seen so far.
+"""
+
+from collections import deque
+
+import numpy as np
+
+import ion.services.ans.gviz_api as gviz_api
+
+
+class RingBuffer(object):
+    """
+    Keeps the most recent 'size' values of a variable in a preallocated NumPy array.
+    """
+
+    def __init__(self, size, dtype='float64'):
+        self.size = size
+        self.data = np.zeros(size, dtype=dtype)
+        # Total number of values ever appended, the next value is written at count % size
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self.data.dtype)
+        n = len(values)
+        if n == 0:
+            return
+        if n > self.size:
+            # Only the tail of the values will survive
+            self.count += n - self.size
+            values = values[-self.size:]
+            n = self.size
+
+        start = self.count % self.size
+        end = start + n
+        if end <= self.size:
+            self.data[start:end] = values
+        else:
+            split = self.size - start
+            self.data[start:] = values[:split]
+            self.data[:end - self.size] = values[split:]
+        self.count += n
+
+    def values(self):
+        """
+        Returns the buffered values, oldest first. The array is a copy only when the buffer has wrapped around.
+        """
+        if self.count <= self.size:
+            return self.data[:self.count]
+        start = self.count % self.size
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+
+class RealtimeDataTable(object):
+    """
+    Sliding window Google DataTable for the realtime views. Each row is converted to its JSON form once when it is
+    received and the JSON response for the window is assembled from those fragments, producing the same output as
+    building a gviz_api.DataTable from all the rows in the window and calling ToJSonResponse().
+    """
+
+    def __init__(self, data_description, window_size=100):
+        self.data_description = data_description
+        self.window_size = window_size
+        self.row_json = deque(maxlen=window_size)
+        self.data_table = gviz_api.DataTable(data_description)
+        self.response_prefix, self.response_suffix = self.data_table.JSonResponseAroundRows()
+
+    def __len__(self):
+        return len(self.row_json)
+
+    def append(self, vardict, count):
+        """
+        Adds the first 'count' values of each variable in vardict to the window.
+        """
+        if count > self.window_size:
+            vardict = dict([(varname, values[count - self.window_size:count]) for varname, values in vardict.iteritems()])
+            count = self.window_size
+
+        columns = {}
+        for varname, _, _ in self.data_description:
+            columns[varname] = np.asarray(vardict[varname][:count], dtype='float64')
+
+        # the time column holds timestamps, which the datatable converts to dates
+        self.row_json.extend(self.data_table.ToJSonRowsFromColumns(columns))
+
+    def to_json_response(self):
+        return self.response_prefix + ",".join(self.row_json) + self.response_suffix
+
+
+class ColumnAccumulator(object):
+    """
+    Accumulates the values of each variable as a list of NumPy arrays, one per packet, which are joined only once
+    when the columns are requested.
+    """
+
+    def __init__(self, varnames):
+        self.varnames = list(varnames)
+        self.chunks = dict([(varname, []) for varname in self.varnames])
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, vardict, count):
+        for varname in self.varnames:
+            self.chunks[varname].append(np.array(vardict[varname][:count], dtype='float64'))
+        self.count += count
+
+    def columns(self):
+        columns = {}
+        for varname in self.varnames:
+            if self.chunks[varname]:
+                columns[varname] = np.concatenate(self.chunks[varname])
+            else:
+                columns[varname] = np.zeros(0, dtype='float64')
+            # keep the joined array so later calls do not copy again
+            self.chunks[varname] = [columns[varname]]
+        return columns
+
+
+DECIMATION_STRIDE = 'stride'
+DECIMATION_MIN_MAX = 'minmax'
+DECIMATION_LTTB = 'lttb'
+
+def decimate_stride(n, max_points):
+    """
+    Returns the indices of every k-th point so that at most max_points of the n points are kept.
+    """
+    if n <= max_points:
+        return np.arange(n)
+    factor = int(np.ceil(float(n) / max_points))
+    return np.arange(0, n, factor)
+
+def decimate_min_max(y, max_points):
+    """
+    Splits the points in max_points / 2 buckets and keeps the points with the minimum and maximum y value of each
+    bucket, in their original order, so that peaks are preserved.
+    """
+    y = np.asarray(y, dtype='float64')
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    num_buckets = max(max_points // 2, 1)
+    bucket_size = int(np.ceil(float(n) / num_buckets))
+    num_buckets = int(np.ceil(float(n) / bucket_size))
+
+    # pad the last bucket so the values can be viewed as a (buckets x bucket_size) matrix
+    padded_min = np.empty(num_buckets * bucket_size)
+    padded_min.fill(np.inf)
+    padded_min[:n] = y
+    padded_max = np.empty(num_buckets * bucket_size)
+    padded_max.fill(-np.inf)
+    padded_max[:n] = y
+
+    offsets = np.arange(num_buckets) * bucket_size
+    min_idx = padded_min.reshape(num_buckets, bucket_size).argmin(axis=1) + offsets
+    max_idx = padded_max.reshape(num_buckets, bucket_size).argmax(axis=1) + offsets
+
+    return np.unique(np.concatenate((min_idx, max_idx)))
+
+def decimate_lttb(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Keeps the first and last points and, from each bucket in between,
+    the point forming the largest triangle with the point kept from the previous bucket and the average of the next
+    bucket. Every point is looked at once, so the cost is linear in the number of points.
+    """
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    # bucket boundaries for the points between the first and the last
+    edges = (np.arange(max_points - 1) * (float(n - 2) / (max_points - 2))).astype(int) + 1
+    edges[-1] = n - 1
+
+    # averages of all buckets and of the last point, used as the third corner of the triangles
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[n - 1])
+    avg_y = np.append(sums_y / sizes, y[n - 1])
+
+    indices = np.zeros(max_points, dtype=int)
+    a = 0
+    for bucket in xrange(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the area of the triangles formed with point a and the average of the next bucket
+        areas = np.abs((x[a] - avg_x[bucket + 1]) * (y[start:end] - y[a]) -
+                       (x[a] - x[start:end]) * (avg_y[bucket + 1] - y[a]))
+        a = start + int(areas.argmax())
+        indices[bucket + 1] = a
+    indices[-1] = n - 1
+
+    return indices
+
+def decimate(columns, max_points, method=DECIMATION_STRIDE, x_var='time', y_var=None):
+    """
+    Returns the indices of the rows to keep so that at most max_points rows of the columns remain. The min/max and
+    LTTB methods select the rows based on the values of y_var.
+    """
+    n = len(columns[x_var])
+    if n <= max_points:
+        return np.arange(n)
+    if method == DECIMATION_MIN_MAX:
+        return decimate_min_max(columns[y_var], max_points)
+    if method == DECIMATION_LTTB:
+        return decimate_lttb(columns[x_var], columns[y_var], max_points)
+    return decimate_stride(n, max_points)
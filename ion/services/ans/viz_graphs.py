@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+"""
+On demand rendering of the matplotlib graphs of a data product. The Visualization Service keeps the latest values of
+each data product in a GraphData and renders an image only when one is requested, using a GraphRenderer that reuses
+its figures and line artists between requests.
+"""
+
+from collections import OrderedDict
+import StringIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+from ion.services.ans.viz_data_buffers import RingBuffer
+
+# Number of records per variable kept for the matplotlib graphs
+DEFAULT_GRAPH_HISTORY_SIZE = 10000
+# Variables that are not plotted against time
+GRAPH_SKIP_VARIABLES = ('time', 'height', 'longitude', 'latitude')
+# Default image size in pixels
+DEFAULT_IMAGE_WIDTH = 800
+DEFAULT_IMAGE_HEIGHT = 600
+IMAGE_DPI = 100
+# Number of figures a renderer keeps for reuse
+MAX_FIGURES = 8
+
+
+def image_name_for(varname, x_var='time'):
+    return varname + '_vs_' + x_var + '.png'
+
+def variable_for_image_name(image_name, x_var='time'):
+    suffix = '_vs_' + x_var + '.png'
+    if not image_name.endswith(suffix):
+        return None
+    return image_name[:-len(suffix)]
+
+
+class GraphData(object):
+    """
+    Latest values of the variables of a data product, kept in a RingBuffer per variable. The version is incremented
+    every time values are added.
+    """
+
+    def __init__(self, history_size=DEFAULT_GRAPH_HISTORY_SIZE):
+        self.history_size = history_size
+        self.buffers = {}
+        self.version = 0
+
+    def extend(self, vardict):
+        for varname, values in vardict.iteritems():
+            if varname not in self.buffers:
+                self.buffers[varname] = RingBuffer(self.history_size)
+            self.buffers[varname].extend(values)
+        self.version += 1
+
+    def plottable_variables(self):
+        if 'time' not in self.buffers:
+            return []
+        return sorted([varname for varname in self.buffers if varname not in GRAPH_SKIP_VARIABLES])
+
+    def select(self, variables, start_time=None, end_time=None):
+        """
+        Returns the time values and a dict of the values of the variables between start_time and end_time.
+        """
+        x = self.buffers['time'].values()
+        mask = None
+        if start_time is not None:
+            mask = x >= start_time
+        if end_time is not None:
+            mask = (x <= end_time) if mask is None else (mask & (x <= end_time))
+
+        # every packet has values for all the variables so the buffers are filled in step
+        ys = {}
+        for varname in variables:
+            y = self.buffers[varname].values()
+            ys[varname] = y if mask is None else y[mask]
+        if mask is not None:
+            x = x[mask]
+        return x, ys
+
+
+class GraphRenderer(object):
+    """
+    Renders PNG images of variables against time. The figures are kept per (variables, size) so that rendering
+    the same graph again only updates the data of its lines.
+    """
+
+    def __init__(self, max_figures=MAX_FIGURES):
+        self.max_figures = max_figures
+        # (variables, width, height) -> (figure, axes, lines, canvas), least recently used first
+        self.plots = OrderedDict()
+
+    def render(self, graph_data, variables, width=DEFAULT_IMAGE_WIDTH, height=DEFAULT_IMAGE_HEIGHT,
+               start_time=None, end_time=None, x_var='time'):
+        fig, ax, lines, canvas = self._get_plot(tuple(variables), width, height, x_var)
+
+        x, ys = graph_data.select(variables, start_time, end_time)
+        for varname, line in zip(variables, lines):
+            line.set_data(x, ys[varname])
+        ax.relim()
+        ax.autoscale_view()
+
+        imgInMem = StringIO.StringIO()
+        canvas.print_figure(imgInMem, format="png", dpi=IMAGE_DPI)
+        return imgInMem.getvalue()
+
+    def _get_plot(self, variables, width, height, x_var):
+        key = (variables, width, height)
+        if key in self.plots:
+            plot = self.plots.pop(key)
+        else:
+            fig = Figure(figsize=(float(width) / IMAGE_DPI, float(height) / IMAGE_DPI), dpi=IMAGE_DPI)
+            ax = fig.add_subplot(111)
+            canvas = FigureCanvas(fig)
+            styles = ('ro', 'bo', 'go', 'co', 'mo', 'yo', 'ko')
+            lines = [ax.plot([], [], styles[i % len(styles)], label=varname)[0] for i, varname in enumerate(variables)]
+            ax.set_xlabel(x_var)
+            ax.set_ylabel(', '.join(variables))
+            ax.set_title(', '.join(variables) + ' vs ' + x_var)
+            if len(variables) > 1:
+                ax.legend()
+            plot = (fig, ax, lines, canvas)
+
+        # most recently used at the end, drop the oldest figure when there are too many
+        self.plots[key] = plot
+        if len(self.plots) > self.max_figures:
+            self.plots.popitem(last=False)
+        return plot
@@ -5,8 +5,10 @@ __license__ = 'Apache 2.0'
 
 import uuid
 import json
+import time
 
 import gevent
+from gevent.coros import BoundedSemaphore
 
 from pyon.public import log, PRED
 from pyon.core.exception import NotFound, BadRequest
@@ -16,6 +18,8 @@ from pyon.event.event import EventPublisher
 from interface.services.cei.iprocess_dispatcher_service import BaseProcessDispatcherService
 from interface.objects import ProcessStateEnum
 
+# number of processes the local backend spawns at the same time
+DEFAULT_SPAWN_CONCURRENCY = 8
 
 class ProcessDispatcherService(BaseProcessDispatcherService):
 
@@ -57,7 +61,14 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         else:
             log.debug("Using Process Dispatcher Local backend -- spawns processes in local container")
 
-            self.backend = PDLocalBackend(self.container)
+            try:
+                spawn_concurrency = self.CFG.process_dispatcher.spawn_concurrency
+            except AttributeError:
+                spawn_concurrency = DEFAULT_SPAWN_CONCURRENCY
+            self.backend = PDLocalBackend(self.container, spawn_concurrency)
+
+        # process definition id -> process definition, so that scheduling does not read the registry every time
+        self._definitions = {}
 
     def on_start(self):
         self.backend.initialize()
@@ -84,6 +95,7 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         @throws Conflict    object not based on latest persisted object version
         """
         self.clients.resource_registry.update(process_definition)
+        self._definitions.pop(process_definition._id, None)
 
     def read_process_definition(self, process_definition_id=''):
         """Returns a Process Definition as object.
@@ -102,6 +114,7 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         @throws NotFound    object with specified id does not exist
         """
         self.clients.resource_registry.delete(process_definition_id)
+        self._definitions.pop(process_definition_id, None)
 
 
     def associate_execution_engine(self, process_definition_id='', execution_engine_definition_id=''):
@@ -159,9 +172,68 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         @throws BadRequest    if object passed has _id or _rev attribute
         @throws NotFound    object with specified id does not exist
         """
+        # a process id chosen by the caller cannot be given to an already running warm process
+        claim_warm = not process_id
+        process_definition, configuration, process_id = self._prepare_process(process_definition_id,
+            configuration, process_id)
+
+        return self.backend.spawn(process_id, process_definition, schedule, configuration,
+            process_definition_id=process_definition_id, claim_warm=claim_warm)
+
+    def schedule_processes(self, processes=None):
+        """Schedule many processes at once. Each process definition is read once and the processes are spawned
+        concurrently, up to the spawn concurrency of the backend.
+
+        @param processes    list of dicts with the process_definition_id, schedule, configuration and process_id
+                            arguments of schedule_process
+        @retval process_ids    list of the process ids, in the order of processes
+        @throws NotFound    object with specified id does not exist
+        @throws BadRequest    if a process definition is incomplete or a configuration is invalid. The processes
+                              spawned before the error keep running.
+        """
+        requests = []
+        for process in processes or []:
+            process_definition_id = process.get('process_definition_id', '')
+            claim_warm = not process.get('process_id')
+            process_definition, configuration, process_id = self._prepare_process(process_definition_id,
+                process.get('configuration'), process.get('process_id', ''))
+            requests.append((process_id, process_definition, process.get('schedule'), configuration,
+                             process_definition_id, claim_warm))
+
+        return self.backend.spawn_many(requests)
+
+    def warm_process_pool(self, process_definition_id='', size=0, configuration=None):
+        """Keep size processes of a process definition spawned with the given configuration, ready to be handed
+        out by schedule_process when it is called with the same definition and configuration and no process id.
+        A size of 0 empties the pool.
+
+        @param process_definition_id    str
+        @param size    int
+        @param configuration    dict
+        @throws NotFound    object with specified id does not exist
+        """
+        process_definition, configuration, _ = self._prepare_process(process_definition_id, configuration, '')
+        self.backend.warm(process_definition_id, process_definition, configuration, size)
+        return True
+
+    def get_dispatch_metrics(self):
+        """Spawn latency, concurrency and warm pool usage of the backend.
+
+        @retval metrics    dict
+        """
+        return self.backend.get_metrics()
+
+    def _read_process_definition(self, process_definition_id):
+        process_definition = self._definitions.get(process_definition_id)
+        if process_definition is None:
+            process_definition = self.clients.resource_registry.read(process_definition_id)
+            self._definitions[process_definition_id] = process_definition
+        return process_definition
+
+    def _prepare_process(self, process_definition_id, configuration, process_id):
         if not process_definition_id:
             raise NotFound('No process definition was provided')
-        process_definition = self.clients.resource_registry.read(process_definition_id)
+        process_definition = self._read_process_definition(process_definition_id)
 
         # early validation before we pass definition through to backend
         try:
@@ -178,7 +250,7 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
             process_id = str(process_definition.name or "process") + uuid.uuid4().hex
             process_id = create_valid_identifier(process_id, ws_sub='_')
 
-        return self.backend.spawn(process_id, process_definition, schedule, configuration)
+        return process_definition, configuration, process_id
 
     def cancel_process(self, process_id=''):
         """Cancels the execution of the given process id.
@@ -193,45 +265,157 @@ class ProcessDispatcherService(BaseProcessDispatcherService):
         return self.backend.cancel(process_id)
 
 
+class WarmPool(object):
+    """Idle processes of a process definition, spawned with the same configuration
+    """
+
+    def __init__(self, definition, configuration, size=0):
+        self.definition = definition
+        self.configuration = configuration
+        self.size = size
+        self.idle = []
+        self.filling = False
+
+
 class PDLocalBackend(object):
     """Scheduling backend to PD that manages processes in the local container
+
+    At most spawn_concurrency processes are spawned at the same time. Warm pools keep processes of a process
+    definition spawned ahead with a given configuration; a spawn for the same definition and configuration that does
+    not ask for a specific process id takes one of them and the pool is refilled in the background.
     """
 
-    def __init__(self, container):
+    def __init__(self, container, spawn_concurrency=DEFAULT_SPAWN_CONCURRENCY):
         self.container = container
         self.event_pub = EventPublisher()
+        self.spawn_concurrency = spawn_concurrency
+        self.spawn_slots = BoundedSemaphore(spawn_concurrency)
+        # (process definition id, configuration json) -> WarmPool
+        self.warm_pools = {}
+        self.metrics = {'spawned': 0, 'failed': 0, 'spawn_time_total': 0.0, 'spawn_time_max': 0.0,
+                        'in_flight': 0, 'in_flight_max': 0, 'waiting': 0, 'warm_hits': 0, 'warm_misses': 0}
 
     def initialize(self):
         pass
 
     def shutdown(self):
-        pass
+        pools, self.warm_pools = self.warm_pools, {}
+        for pool in pools.itervalues():
+            for pid in pool.idle:
+                self.container.proc_manager.terminate_process(pid)
 
-    def spawn(self, name, definition, schedule, configuration):
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics['spawn_concurrency'] = self.spawn_concurrency
+        metrics['spawn_time_mean'] = metrics['spawn_time_total'] / metrics['spawned'] if metrics['spawned'] else 0.0
+        metrics['warm_idle'] = sum(len(pool.idle) for pool in self.warm_pools.itervalues())
+        return metrics
 
-        module = definition.executable['module']
-        cls = definition.executable['class']
+    def spawn(self, name, definition, schedule, configuration, process_definition_id='', claim_warm=False):
 
         # push the config through a JSON serializer to ensure that the same
         # config would work with the bridge backend
 
         try:
-            if configuration:
-                json.dumps(configuration)
+            config_key = json.dumps(configuration or {}, sort_keys=True)
         except TypeError, e:
             raise BadRequest("bad configuration: " + str(e))
 
-        # Spawn the process
-        pid = self.container.spawn_process(name=name, module=module, cls=cls,
-            config=configuration, process_id=name)
-        log.debug('PD: Spawned Process (%s)', pid)
+        pid = None
+        pool = self.warm_pools.get((process_definition_id, config_key))
+        if claim_warm and pool is not None:
+            if pool.idle:
+                pid = pool.idle.pop(0)
+                self.metrics['warm_hits'] += 1
+                log.debug('PD: Handed out warm Process (%s)', pid)
+            else:
+                self.metrics['warm_misses'] += 1
+            gevent.spawn(self._fill, (process_definition_id, config_key))
+
+        if pid is None:
+            pid = self._spawn(name, definition, configuration)
+            log.debug('PD: Spawned Process (%s)', pid)
 
         self.event_pub.publish_event(event_type="ProcessLifecycleEvent",
-            origin=name, origin_type="DispatchedProcess",
+            origin=pid, origin_type="DispatchedProcess",
             state=ProcessStateEnum.SPAWN)
 
         return pid
 
+    def spawn_many(self, requests):
+        """
+        Spawns processes concurrently. requests are tuples of the spawn arguments; returns the pids in the same
+        order, or raises the first error once all the spawns are done.
+        """
+        greenlets = [gevent.spawn(self.spawn, *request) for request in requests]
+        gevent.joinall(greenlets)
+        for greenlet in greenlets:
+            if not greenlet.successful():
+                raise greenlet.exception
+        return [greenlet.value for greenlet in greenlets]
+
+    def warm(self, process_definition_id, definition, configuration, size):
+        try:
+            config_key = json.dumps(configuration or {}, sort_keys=True)
+        except TypeError, e:
+            raise BadRequest("bad configuration: " + str(e))
+
+        key = (process_definition_id, config_key)
+        pool = self.warm_pools.get(key)
+        if pool is None:
+            pool = self.warm_pools[key] = WarmPool(definition, configuration)
+        pool.size = size
+        pool.definition = definition
+        self._fill(key)
+
+    def _fill(self, key):
+        pool = self.warm_pools.get(key)
+        if pool is None or pool.filling:
+            return
+        pool.filling = True
+        try:
+            while len(pool.idle) > pool.size:
+                self.container.proc_manager.terminate_process(pool.idle.pop())
+            while len(pool.idle) < pool.size:
+                name = str(pool.definition.name or "process") + uuid.uuid4().hex
+                name = create_valid_identifier(name, ws_sub='_')
+                pool.idle.append(self._spawn(name, pool.definition, pool.configuration))
+        except Exception:
+            log.exception('PD: Could not spawn a warm process for %s', key[0])
+        finally:
+            pool.filling = False
+        if not pool.size:
+            self.warm_pools.pop(key, None)
+
+    def _spawn(self, name, definition, configuration):
+        module = definition.executable['module']
+        cls = definition.executable['class']
+
+        if not self.spawn_slots.acquire(blocking=False):
+            self.metrics['waiting'] += 1
+            self.spawn_slots.acquire()
+            self.metrics['waiting'] -= 1
+
+        self.metrics['in_flight'] += 1
+        self.metrics['in_flight_max'] = max(self.metrics['in_flight'], self.metrics['in_flight_max'])
+        start = time.time()
+        try:
+            # Spawn the process
+            pid = self.container.spawn_process(name=name, module=module, cls=cls,
+                config=configuration, process_id=name)
+        except Exception:
+            self.metrics['failed'] += 1
+            raise
+        finally:
+            self.metrics['in_flight'] -= 1
+            self.spawn_slots.release()
+
+        elapsed = time.time() - start
+        self.metrics['spawned'] += 1
+        self.metrics['spawn_time_total'] += elapsed
+        self.metrics['spawn_time_max'] = max(elapsed, self.metrics['spawn_time_max'])
+        return pid
+
     def cancel(self, process_id):
         self.container.proc_manager.terminate_process(process_id)
         log.debug('PD: Terminated Process (%s)', process_id)
@@ -325,7 +509,7 @@ class PDBridgeBackend(object):
             origin=process_id, origin_type="DispatchedProcess",
             state=ion_process_state)
 
-    def spawn(self, name, definition, schedule, configuration):
+    def spawn(self, name, definition, schedule, configuration, process_definition_id='', claim_warm=False):
 
         module = definition.executable['module']
         cls = definition.executable['class']
@@ -356,6 +540,16 @@ class PDBridgeBackend(object):
         # name == upid == process_id
         return name
 
+    def spawn_many(self, requests):
+        # the real PD queues the processes itself
+        return [self.spawn(*request) for request in requests]
+
+    def warm(self, process_definition_id, definition, configuration, size):
+        log.debug("Warm process pools are not supported by the Process Dispatcher bridge")
+
+    def get_metrics(self):
+        return {}
+
     def cancel(self, process_id):
 
         if not process_id:
@@ -88,6 +88,93 @@ class ProcessDispatcherServiceTest(PyonTestCase):
 
         self.assertEqual(event_pub.publish_event.call_count, 1)
 
+    def test_local_schedule_processes(self):
+        self.pd_service.init()
+        self.pd_service.backend = PDLocalBackend(self.pd_service.container, spawn_concurrency=2)
+        self.pd_service.backend.event_pub = Mock()
+
+        proc_def = DotDict()
+        proc_def['name'] = "someprocess"
+        proc_def['executable'] = {'module':'my_module', 'class':'class'}
+        self.mock_rr_read.return_value = proc_def
+
+        def spawn(name, **kwargs):
+            gevent.sleep(0.01)
+            return name
+        self.mock_cc_spawn.side_effect = spawn
+
+        processes = [dict(process_definition_id="fake-process-def-id", configuration={"i": i},
+            process_id="proc%d" % i) for i in range(5)]
+        pids = self.pd_service.schedule_processes(processes)
+
+        self.assertEqual(pids, ["proc%d" % i for i in range(5)])
+        # the process definition is read once
+        self.assertEqual(self.mock_rr_read.call_count, 1)
+        self.assertEqual(self.mock_cc_spawn.call_count, 5)
+
+        metrics = self.pd_service.get_dispatch_metrics()
+        self.assertEqual(metrics['spawned'], 5)
+        self.assertEqual(metrics['in_flight_max'], 2)
+        self.assertEqual(metrics['in_flight'], 0)
+        self.assertEqual(metrics['spawn_concurrency'], 2)
+        self.assertTrue(metrics['spawn_time_max'] > 0)
+        self.assertEqual(self.pd_service.backend.event_pub.publish_event.call_count, 5)
+
+    def test_local_warm_pool(self):
+        self.pd_service.init()
+        self.pd_service.backend.event_pub = Mock()
+
+        proc_def = DotDict()
+        proc_def['name'] = "someprocess"
+        proc_def['executable'] = {'module':'my_module', 'class':'class'}
+        self.mock_rr_read.return_value = proc_def
+        self.mock_cc_spawn.side_effect = lambda name, **kwargs: name
+
+        configuration = {"some": "value"}
+        self.pd_service.warm_process_pool("fake-process-def-id", 2, configuration)
+        self.assertEqual(self.mock_cc_spawn.call_count, 2)
+        warm_pids = [kwargs['name'] for args, kwargs in self.mock_cc_spawn.call_args_list]
+
+        # the same definition and configuration get a warm process
+        pid = self.pd_service.schedule_process("fake-process-def-id", None, configuration)
+        self.assertIn(pid, warm_pids)
+        self.assertEqual(self.mock_cc_spawn.call_count, 2)
+
+        # a different configuration or a chosen process id do not
+        self.pd_service.schedule_process("fake-process-def-id", None, {"other": "value"})
+        self.pd_service.schedule_process("fake-process-def-id", None, configuration, "my-process")
+        self.assertEqual(self.mock_cc_spawn.call_count, 4)
+
+        # the pool is refilled in the background
+        gevent.sleep(0)
+        self.assertEqual(self.mock_cc_spawn.call_count, 5)
+
+        metrics = self.pd_service.get_dispatch_metrics()
+        self.assertEqual(metrics['warm_hits'], 1)
+        self.assertEqual(metrics['warm_idle'], 2)
+
+        self.pd_service.warm_process_pool("fake-process-def-id", 0, configuration)
+        self.assertEqual(self.mock_cc_terminate.call_count, 2)
+        self.assertEqual(self.pd_service.get_dispatch_metrics()['warm_idle'], 0)
+
+    def test_process_definition_cache(self):
+        self.pd_service.init()
+        self.pd_service.backend.event_pub = Mock()
+
+        proc_def = DotDict()
+        proc_def['_id'] = "fake-process-def-id"
+        proc_def['name'] = "someprocess"
+        proc_def['executable'] = {'module':'my_module', 'class':'class'}
+        self.mock_rr_read.return_value = proc_def
+
+        self.pd_service.schedule_process("fake-process-def-id", None, {})
+        self.pd_service.schedule_process("fake-process-def-id", None, {})
+        self.assertEqual(self.mock_rr_read.call_count, 1)
+
+        self.pd_service.update_process_definition(proc_def)
+        self.pd_service.schedule_process("fake-process-def-id", None, {})
+        self.assertEqual(self.mock_rr_read.call_count, 2)
+
     def test_schedule_process_notfound(self):
         proc_schedule = DotDict()
         configuration = {}
@@ -27,6 +27,12 @@ class OrgManagementService(BaseOrgManagementService):
         self.request_handler = NegotiateRequest(self)
         self.event_pub = EventPublisher()
 
+        #Materialized index of the User Roles granted to each user keyed by user id and then by Org id, along with
+        #the Member role of each Org, so that role lookups do not have to scan and filter every hasRole association.
+        #The index is maintained by the operations in this service which grant or revoke roles.
+        self.user_roles_index = dict()
+        self.org_member_roles = dict()
+
 
     def _validate_parameters(self, **kwargs):
 
@@ -200,6 +206,9 @@ class OrgManagementService(BaseOrgManagementService):
 
         self.clients.resource_registry.delete(org_id)
 
+        self.org_member_roles.pop(org_id, None)
+        self.user_roles_index.clear()
+
     def find_org(self, name=''):
         """Finds an Org object with the specified name. Defaults to the
         root ION object. Throws a NotFound exception if the object
@@ -245,6 +254,8 @@ class OrgManagementService(BaseOrgManagementService):
 
         aid = self.clients.resource_registry.create_association(org, PRED.hasRole, user_role_id)
 
+        self.org_member_roles.pop(org_id, None)
+
         return user_role_id
 
     def remove_user_role(self, org_id='', role_name='', force_removal=False):
@@ -269,6 +280,9 @@ class OrgManagementService(BaseOrgManagementService):
 
         self.clients.resource_registry.delete_association(aid)
 
+        self.org_member_roles.pop(org_id, None)
+        self.user_roles_index.clear()
+
         return True
 
     def find_org_role_by_name(self, org_id='', role_name=''):
@@ -681,6 +695,8 @@ class OrgManagementService(BaseOrgManagementService):
         if not aid:
             return False
 
+        self.user_roles_index.pop(user._id, None)
+
         return True
 
     def _delete_role_association(self, user, user_role):
@@ -689,6 +705,9 @@ class OrgManagementService(BaseOrgManagementService):
             raise NotFound("The association between the specified User %s and User Role %s was not found" % (user._id, user_role._id))
 
         self.clients.resource_registry.delete_association(aid)
+
+        self.user_roles_index.pop(user._id, None)
+
         return True
 
 
@@ -717,23 +736,42 @@ class OrgManagementService(BaseOrgManagementService):
         if user is None:
             raise BadRequest("The user parameter is missing")
 
+        ret_list = list(self._find_user_roles_by_org(user).get(org._id, []))
+
+        #Because a user is enrolled with an Org then the membership role is implied - so add it to the list
+        ret_list.append(self._find_member_role(org._id))
+
+        return ret_list
+
+    def _find_user_roles_by_org(self, user):
+        """Returns a dict of the User Roles granted to the user keyed by Org id. All of the user's roles
+        across Orgs are retrieved with a single query and then kept in the role index.
+        """
+        if self.user_roles_index.has_key(user._id):
+            return self.user_roles_index[user._id]
+
         role_list,_ = self.clients.resource_registry.find_objects(user, PRED.hasRole, RT.UserRole)
 
-        #Iterate the list of roles associated with user and filter by the org_id. TODO - replace this when
-        #better indexing/views are available in couch
-        ret_list = []
+        roles_by_org = dict()
         for role in role_list:
-            if role.org_id == org._id:
-                ret_list.append(role)
+            roles_by_org.setdefault(role.org_id, []).append(role)
 
-        #Because a user is enrolled with an Org then the membership role is implied - so add it to the list
-        member_role = self._find_role(org._id, MEMBER_ROLE)
+        self.user_roles_index[user._id] = roles_by_org
+
+        return roles_by_org
+
+    def _find_member_role(self, org_id):
+
+        if self.org_member_roles.has_key(org_id):
+            return self.org_member_roles[org_id]
+
+        member_role = self._find_role(org_id, MEMBER_ROLE)
         if member_role is None:
             raise Inconsistent('The %s User Role is not found.' % MEMBER_ROLE)
 
-        ret_list.append(member_role)
+        self.org_member_roles[org_id] = member_role
 
-        return ret_list
+        return member_role
 
 
     def find_roles_by_user(self, org_id='', user_id=''):
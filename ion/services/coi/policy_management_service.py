@@ -7,6 +7,7 @@ __license__ = 'Apache 2.0'
 
 from interface.services.coi.ipolicy_management_service import BasePolicyManagementService
 from pyon.core.exception import NotFound, BadRequest
+from pyon.event.event import EventSubscriber
 from pyon.public import PRED, RT, Container
 from pyon.util.containers import is_basic_identifier
 from pyon.util.log import log
@@ -16,12 +17,71 @@ MEMBER_ROLE = 'ORG_MEMBER'    # Can only access resources within the specific Or
 ION_MANAGER = 'ION_MANAGER'   # Can act upon resources across all Orgs - like a Super User access
 
 
+class PolicyRulesCache(object):
+    """
+    Keeps the assembled policy text generated for a resource or for an Org and service pair, along with the ids of
+    the resources and policies that were used to build it, so that an entry can be evicted when any of them change.
+    """
+
+    def __init__(self):
+        self._entries = dict()
+
+    def get(self, key):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def put(self, key, policy_rules, resource_ids, policy_ids):
+        self._entries[key] = (policy_rules, set(resource_ids), set(policy_ids))
+
+    def invalidate_resource(self, resource_id):
+        for key in [k for k, entry in self._entries.iteritems() if resource_id in entry[1]]:
+            del self._entries[key]
+
+    def invalidate_policy(self, policy_id):
+        for key in [k for k, entry in self._entries.iteritems() if policy_id in entry[2]]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class PolicyManagementService(BasePolicyManagementService):
 
     """
     Provides the interface to define and manage policy and a repository to store and retrieve policy and templates for
     policy definitions, aka attribute authority.
     """
+
+    def on_init(self):
+        #Cache of the generated policy rules so they are not rebuilt for every governance decision
+        self.policy_cache = PolicyRulesCache()
+        self.event_subscriber = None
+
+    def on_start(self):
+        #Listen for changes made to policies or to resources with cached policies - possibly by other
+        #instances of this service - and evict the affected policy rules.
+        self.event_subscriber = EventSubscriber(
+            event_type="ResourceModifiedEvent",
+            callback=self._receive_resource_modified_event
+        )
+        self.event_subscriber.activate()
+
+    def on_quit(self):
+        if self.event_subscriber is not None:
+            self.event_subscriber.deactivate()
+
+    def _receive_resource_modified_event(self, event_msg, headers):
+
+        if event_msg.origin_type == RT.Policy:
+            self.policy_cache.invalidate_policy(event_msg.origin)
+        else:
+            self.policy_cache.invalidate_resource(event_msg.origin)
+
     def create_policy(self, policy=None):
         """Persists the provided Policy object for the specified Org id. The id string returned
         is the internal id by which Policy will be identified in the data store.
@@ -52,6 +112,7 @@ class PolicyManagementService(BasePolicyManagementService):
             raise BadRequest("The policy name '%s' can only contain alphanumeric and underscore characters" % user_role.name)
 
         self.clients.resource_registry.update(policy)
+        self.policy_cache.invalidate_policy(policy._id)
 
     def read_policy(self, policy_id=''):
         """Returns the Policy object for the specified policy id.
@@ -84,6 +145,7 @@ class PolicyManagementService(BasePolicyManagementService):
         if not policy:
             raise NotFound("Policy %s does not exist" % policy_id)
         self.clients.resource_registry.delete(policy_id)
+        self.policy_cache.invalidate_policy(policy_id)
 
 
     def enable_policy(self, policy_id=''):
@@ -135,6 +197,8 @@ class PolicyManagementService(BasePolicyManagementService):
         if not aid:
             return False
 
+        self.policy_cache.invalidate_resource(resource_id)
+
         return True
 
 
@@ -165,6 +229,7 @@ class PolicyManagementService(BasePolicyManagementService):
             raise NotFound("The association between the specified Resource %s and Policy %s was not found" % (resource_id, policy_id))
 
         self.clients.resource_registry.delete_association(aid)
+        self.policy_cache.invalidate_resource(resource_id)
         return True
 
     def find_resource_policies(self, resource_id=''):
@@ -227,24 +292,29 @@ class PolicyManagementService(BasePolicyManagementService):
         if not resource_id:
             raise BadRequest("The resource_id parameter is missing")
 
+        cache_key = (resource_id,)
+        policy_rules = self.policy_cache.get(cache_key)
+        if policy_rules is not None:
+            return policy_rules
+
         resource = self.clients.resource_registry.read(resource_id)
         if not resource:
             raise NotFound("Resource %s does not exist" % resource_id)
 
         policy = self._get_policy_template()
 
-        #TODO - investigate better ways to optimize this
-        rules = ""
         policy_set = self.find_resource_policies(resource_id)
-
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
+        rules = self._get_enabled_policy_rules(policy_set)
 
         policy_rules = policy % ('', resource_id, rules)
 
+        self.policy_cache.put(cache_key, policy_rules, [resource_id], [p._id for p in policy_set])
+
         return policy_rules
 
+    def _get_enabled_policy_rules(self, policy_set):
+        return "".join([p.rule for p in policy_set if p.enabled])
+
     def add_service_policy(self, service_name='', policy_id=''):
         """Associates a policy rule to a specific service
 
@@ -301,33 +371,34 @@ class PolicyManagementService(BasePolicyManagementService):
         if not org_id:
             raise BadRequest("The org_id parameter is missing")
 
+        if not service_name:
+            raise BadRequest("The name parameter is missing")
+
+        cache_key = (org_id, service_name)
+        policy_rules = self.policy_cache.get(cache_key)
+        if policy_rules is not None:
+            return policy_rules
+
         org = self.clients.resource_registry.read(org_id)
         if not org:
             raise NotFound("Org %s does not exist" % org_id)
 
-        if not service_name:
-            raise BadRequest("The name parameter is missing")
-
         policy = self._get_policy_template()
 
-        #TODO - investigate better ways to optimize this
-
-        rules = ""
         #First get any global Org rules
-        policy_set = self.find_resource_policies(org_id)
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
+        org_policy_set = self.find_resource_policies(org_id)
 
         #Next get service specific rules
-        policy_set = self.find_service_policies(service_name)
-        for p in policy_set:
-            if p.enabled:
-                rules += p.rule
+        service_resource = self._find_service_resource_by_name(service_name)
+        service_policy_set = self.find_resource_policies(service_resource._id)
 
+        rules = self._get_enabled_policy_rules(org_policy_set) + self._get_enabled_policy_rules(service_policy_set)
 
         policy_rules = policy % (org.name, service_name, rules)
 
+        self.policy_cache.put(cache_key, policy_rules, [org_id, service_resource._id],
+            [p._id for p in org_policy_set + service_policy_set])
+
         return policy_rules
 
 
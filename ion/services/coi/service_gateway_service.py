@@ -7,6 +7,7 @@ __license__ = 'Apache 2.0'
 import inspect, collections, ast, simplejson, json, sys, time, traceback
 from flask import Flask, request, abort
 from gevent.wsgi import WSGIServer
+from gevent.pool import Pool
 
 from pyon.public import IonObject, Container, ProcessRPCClient
 from pyon.core.exception import NotFound, Inconsistent, BadRequest, Unauthorized
@@ -34,6 +35,8 @@ service_gateway_instance = None
 DEFAULT_WEB_SERVER_HOSTNAME = ""
 DEFAULT_WEB_SERVER_PORT = 5000
 DEFAULT_USER_CACHE_SIZE = 2000
+DEFAULT_BATCH_CONCURRENCY = 10
+DEFAULT_BATCH_MAX_REQUESTS = 100
 
 GATEWAY_RESPONSE = 'GatewayResponse'
 GATEWAY_ERROR = 'GatewayError'
@@ -65,6 +68,8 @@ class ServiceGatewayService(BaseServiceGatewayService):
         self.web_server_enabled = True
         self.logging = None
         self.user_cache_size = DEFAULT_USER_CACHE_SIZE
+        self.batch_concurrency = DEFAULT_BATCH_CONCURRENCY
+        self.batch_max_requests = DEFAULT_BATCH_MAX_REQUESTS
 
         #retain a pointer to this object for use in ProcessRPC calls
         global service_gateway_instance
@@ -102,6 +107,17 @@ class ServiceGatewayService(BaseServiceGatewayService):
         except Exception, e:
             self.user_cache_size = DEFAULT_USER_CACHE_SIZE
 
+        try:
+            #Get the maximum number of batched service requests executed concurrently and allowed per batch
+            self.batch_concurrency = self.CFG['container']['service_gateway']['batch_concurrency']
+        except Exception, e:
+            self.batch_concurrency = DEFAULT_BATCH_CONCURRENCY
+
+        try:
+            self.batch_max_requests = self.CFG['container']['service_gateway']['batch_max_requests']
+        except Exception, e:
+            self.batch_max_requests = DEFAULT_BATCH_MAX_REQUESTS
+
 
         #Start the gevent web server unless disabled
         if self.web_server_enabled:
@@ -177,26 +193,7 @@ def process_gateway_request(service_name, operation):
 
     try:
 
-        if not service_name:
-            raise BadRequest("Target service name not found in the URL")
-
-        #Retrieve service definition
-        from pyon.core.bootstrap import service_registry
-        # MM: Note: service_registry can do more now
-        target_service = service_registry.get_service_by_name(service_name)
-
-        if not target_service:
-            raise BadRequest("The requested service (%s) is not available" % service_name)
-
-        if operation == '':
-            raise BadRequest("Service operation not specified in the URL")
-
-
-        #Find the concrete client class for making the RPC calls.
-        if not target_service.client:
-            raise Inconsistent("Cannot find a client class for the specified service: %s" % service_name )
-
-        target_client = target_service.client
+        target_service, target_client = get_target_service_client(service_name, operation)
 
         #Retrieve json data from HTTP Post payload
         json_params = None
@@ -206,20 +203,7 @@ def process_gateway_request(service_name, operation):
             #payload = '{"serviceRequest": { "serviceName": "resource_registry", "serviceOp": "find_resources", "params": { "restype": "BankAccount", "lcstate": "", "name": "", "id_only": false } } }'
             json_params = json.loads(payload)
 
-            if not json_params.has_key('serviceRequest'):
-                raise Inconsistent("The JSON request is missing the 'serviceRequest' key in the request")
-
-            if not json_params['serviceRequest'].has_key('serviceName'):
-                raise Inconsistent("The JSON request is missing the 'serviceName' key in the request")
-
-            if not json_params['serviceRequest'].has_key('serviceOp'):
-                raise Inconsistent("The JSON request is missing the 'serviceOp' key in the request")
-
-            if json_params['serviceRequest']['serviceName'] != target_service.name:
-                raise Inconsistent("Target service name in the JSON request (%s) does not match service name in URL (%s)" % (str(json_params['serviceRequest']['serviceName']), target_service.name ) )
-
-            if json_params['serviceRequest']['serviceOp'] != operation:
-                raise Inconsistent("Target service operation in the JSON request (%s) does not match service name in URL (%s)" % ( str(json_params['serviceRequest']['serviceOp']), operation ) )
+            validate_service_request_json(json_params, target_service.name, operation)
 
         param_list = create_parameter_list('serviceRequest', service_name, target_client,operation, json_params)
 
@@ -229,28 +213,167 @@ def process_gateway_request(service_name, operation):
         ion_actor_id, expiry = validate_request(ion_actor_id, expiry)
         param_list['headers'] = build_message_headers(ion_actor_id, expiry)
 
-        client = target_client(node=Container.instance.node, process=service_gateway_instance)
-        methodToCall = getattr(client, operation)
-        result = methodToCall(**param_list)
+        result = execute_service_request(target_client, operation, param_list)
 
+        return gateway_json_response(result)
 
-        #For service operations that add or remove user roles, remove the cached roles so that
-        #the next request will get the latest set of user roles
-        #TODO - this will only work while there is a single Service Gateway running - need to replace with Event
-        #framework to evict from the cache when a user roles get updated.
-        if operation == 'grant_role' or operation == 'revoke_role':
-            #Look for a user_id in the set of parameters and remove it from the user role cache
-            if param_list.has_key('user_id'):
-                service_gateway_instance.user_data_cache.evict(param_list['user_id'])
 
+    except Exception, e:
+        return build_error_response(e)
 
-        return gateway_json_response(result)
 
+# This service operation executes a list of generic service requests in a single HTTP request. Each entry in the
+# list has the same format as the serviceRequest of the generic service operation above. The requester and expiry
+# may be given once for the whole batch or per request; governance is validated only once for each distinct requester.
+# Requests are executed concurrently (limited by the batch_concurrency config value) and the response contains a
+# list of results or errors in the same order as the requests.
+#
+# curl -d 'payload={"batchRequest": { "requester": "anonymous", "requests": [
+# { "serviceRequest": { "serviceName": "resource_registry", "serviceOp": "find_resources", "params": { "restype": "BankAccount", "id_only": true } } },
+# { "serviceRequest": { "serviceName": "resource_registry", "serviceOp": "read", "params": { "object_id": "121ab46344cb3b30112" } } } ] } }'
+# http://localhost:5000/ion-service/batch
+@app.route('/ion-service/batch', methods=['POST'])
+def process_gateway_batch_request():
+
+    try:
+
+        payload = request.form['payload']
+        json_params = json.loads(payload)
+
+        if not json_params.has_key('batchRequest'):
+            raise Inconsistent("The JSON request is missing the 'batchRequest' key in the request")
+
+        if not json_params['batchRequest'].has_key('requests'):
+            raise Inconsistent("The JSON request is missing the 'requests' key in the request")
+
+        service_requests = json_params['batchRequest']['requests']
+        if not isinstance(service_requests, list):
+            raise BadRequest("The 'requests' value in the batch request must be a list of service requests")
+
+        if len(service_requests) > service_gateway_instance.batch_max_requests:
+            raise BadRequest("The batch request contains %d service requests which exceeds the maximum of %d" % (len(service_requests), service_gateway_instance.batch_max_requests))
+
+        #Default governance values for all of the requests in the batch
+        batch_actor_id, batch_expiry = get_governance_info_from_request('batchRequest', json_params)
+
+        #Validate each distinct requesting user only once and reuse the governance headers for each of their requests
+        governance_headers = dict()
+        request_actors = []
+        for service_request in service_requests:
+            actor_key = (batch_actor_id, batch_expiry)
+            if isinstance(service_request, dict) and isinstance(service_request.get('serviceRequest', None), dict):
+                actor_key = (convert_unicode(service_request['serviceRequest'].get('requester', batch_actor_id)),
+                             convert_unicode(service_request['serviceRequest'].get('expiry', batch_expiry)))
+
+            request_actors.append(actor_key)
+            if not governance_headers.has_key(actor_key):
+                try:
+                    ion_actor_id, expiry = validate_request(*actor_key)
+                    governance_headers[actor_key] = build_message_headers(ion_actor_id, expiry)
+                except Exception, e:
+                    governance_headers[actor_key] = build_error_info(e)
+
+        results = [None] * len(service_requests)
+
+        def execute_batch_entry(index):
+            try:
+                headers = governance_headers[request_actors[index]]
+                if headers.has_key(GATEWAY_ERROR_EXCEPTION):
+                    results[index] = {GATEWAY_ERROR: headers}
+                    return
+
+                service_request = service_requests[index]
+                if not isinstance(service_request, dict) or not service_request.has_key('serviceRequest'):
+                    raise Inconsistent("The JSON request is missing the 'serviceRequest' key in the request")
+
+                service_name = service_request['serviceRequest'].get('serviceName', None)
+                operation = service_request['serviceRequest'].get('serviceOp', '')
+
+                target_service, target_client = get_target_service_client(service_name, operation)
+                validate_service_request_json(service_request, target_service.name, operation)
+                service_request['serviceRequest'].setdefault('params', {})
+
+                param_list = create_parameter_list('serviceRequest', service_name, target_client, operation, service_request)
+                param_list['headers'] = dict(headers)
+
+                results[index] = {GATEWAY_RESPONSE: execute_service_request(target_client, operation, param_list)}
+
+            except Exception, e:
+                results[index] = {GATEWAY_ERROR: build_error_info(e)}
+
+        pool = Pool(size=service_gateway_instance.batch_concurrency)
+        for index in range(len(service_requests)):
+            pool.spawn(execute_batch_entry, index)
+        pool.join()
+
+        return gateway_json_response(results)
 
     except Exception, e:
         return build_error_response(e)
 
 
+#Retrieves the service definition and the concrete client class for making RPC calls to the specified service
+def get_target_service_client(service_name, operation):
+
+    if not service_name:
+        raise BadRequest("Target service name not found in the URL")
+
+    #Retrieve service definition
+    from pyon.core.bootstrap import service_registry
+    # MM: Note: service_registry can do more now
+    target_service = service_registry.get_service_by_name(service_name)
+
+    if not target_service:
+        raise BadRequest("The requested service (%s) is not available" % service_name)
+
+    if operation == '':
+        raise BadRequest("Service operation not specified in the URL")
+
+
+    #Find the concrete client class for making the RPC calls.
+    if not target_service.client:
+        raise Inconsistent("Cannot find a client class for the specified service: %s" % service_name )
+
+    return target_service, target_service.client
+
+#Checks that the posted JSON service request matches the target service and operation
+def validate_service_request_json(json_params, service_name, operation):
+
+    if not json_params.has_key('serviceRequest'):
+        raise Inconsistent("The JSON request is missing the 'serviceRequest' key in the request")
+
+    if not json_params['serviceRequest'].has_key('serviceName'):
+        raise Inconsistent("The JSON request is missing the 'serviceName' key in the request")
+
+    if not json_params['serviceRequest'].has_key('serviceOp'):
+        raise Inconsistent("The JSON request is missing the 'serviceOp' key in the request")
+
+    if json_params['serviceRequest']['serviceName'] != service_name:
+        raise Inconsistent("Target service name in the JSON request (%s) does not match service name in URL (%s)" % (str(json_params['serviceRequest']['serviceName']), service_name ) )
+
+    if json_params['serviceRequest']['serviceOp'] != operation:
+        raise Inconsistent("Target service operation in the JSON request (%s) does not match service name in URL (%s)" % ( str(json_params['serviceRequest']['serviceOp']), operation ) )
+
+#Makes the RPC call to the target service operation with the prepared parameter list, including governance headers
+def execute_service_request(target_client, operation, param_list):
+
+    client = target_client(node=Container.instance.node, process=service_gateway_instance)
+    methodToCall = getattr(client, operation)
+    result = methodToCall(**param_list)
+
+
+    #For service operations that add or remove user roles, remove the cached roles so that
+    #the next request will get the latest set of user roles
+    #TODO - this will only work while there is a single Service Gateway running - need to replace with Event
+    #framework to evict from the cache when a user roles get updated.
+    if operation == 'grant_role' or operation == 'revoke_role':
+        #Look for a user_id in the set of parameters and remove it from the user role cache
+        if param_list.has_key('user_id'):
+            service_gateway_instance.user_data_cache.evict(param_list['user_id'])
+
+    return result
+
+
 #This service method is used to communicate with a resource agent within the system from an
 #external entity using HTTP requests. A resource_id of a running agent is required as is the operation
 #that is being called and a JSON request block which specifies the data being sent to the agent.
@@ -327,7 +450,8 @@ def gateway_json_response(response_data):
 
     return json_response({'data':{ GATEWAY_RESPONSE: response_data} } )
 
-def build_error_response(e):
+#Must be called from within the exception handler since it relies on sys.exc_info()
+def build_error_info(e):
 
     exc_type, exc_obj, exc_tb = sys.exc_info()
     result = {
@@ -335,6 +459,11 @@ def build_error_response(e):
         GATEWAY_ERROR_MESSAGE : str(e.message),
         GATEWAY_ERROR_TRACE : traceback.format_exception(*sys.exc_info())
     }
+    return result
+
+def build_error_response(e):
+
+    result = build_error_info(e)
 
     if request.args.has_key(RETURN_FORMAT_PARAM):
         return_format = convert_unicode(request.args[RETURN_FORMAT_PARAM])
@@ -22,6 +22,7 @@ class TestOrgManagementService(PyonTestCase):
 
         self.org_management_service = OrgManagementService()
         self.org_management_service.clients = mock_clients
+        self.org_management_service.on_init()
 
         # Rename to save some typing
         self.mock_create = mock_clients.resource_registry.create
@@ -96,6 +97,54 @@ class TestOrgManagementService(PyonTestCase):
         self.assertEqual(ex.message, 'Org bad does not exist')
         self.mock_delete.assert_called_once_with('bad')
 
+    def test_find_all_roles_by_user(self):
+        user = Mock()
+        user._id = 'user_id'
+
+        ion_org = Mock()
+        ion_org._id = 'ion_org_id'
+        ion_org.name = 'ION'
+        org2 = Mock()
+        org2._id = 'org2_id'
+        org2.name = 'Org2'
+
+        roles = dict()
+        for org in [ion_org, org2]:
+            for role_name in ['ORG_MEMBER', 'ORG_MANAGER']:
+                role = Mock()
+                role.name = role_name
+                role.org_id = org._id
+                roles[(org._id, role_name)] = role
+
+        objects = {'user_id': user, 'ion_org_id': ion_org, 'org2_id': org2}
+        self.mock_read.side_effect = lambda object_id, rev_id='': objects[object_id]
+        self.mock_find_subjects.return_value = ([org2], [])
+        self.mock_find_resources.return_value = ([ion_org], [])
+
+        def find_objects(subject, predicate, object_type):
+            if subject is user:
+                return [roles[('ion_org_id', 'ORG_MANAGER')]], []
+            return [role for key, role in roles.iteritems() if key[0] == subject._id], []
+        self.mock_find_objects.side_effect = find_objects
+
+        roles_by_org = self.org_management_service.find_all_roles_by_user('user_id')
+
+        self.assertEqual(sorted([r.name for r in roles_by_org['ION']]), ['ORG_MANAGER', 'ORG_MEMBER'])
+        self.assertEqual([r.name for r in roles_by_org['Org2']], ['ORG_MEMBER'])
+
+        #One query for all of the user's roles plus one for the Member role of each Org
+        self.assertEqual(self.mock_find_objects.call_count, 3)
+
+        # TEST: Subsequent lookups are answered from the role index
+        role_list = self.org_management_service.find_roles_by_user('org2_id', 'user_id')
+        self.assertEqual([r.name for r in role_list], ['ORG_MEMBER'])
+        self.assertEqual(self.mock_find_objects.call_count, 3)
+
+        # TEST: Granting a role refreshes the index for the user
+        self.mock_create_association.return_value = 'aid'
+        self.org_management_service.grant_role('org2_id', 'user_id', 'ORG_MANAGER')
+        self.assertNotIn('user_id', self.org_management_service.user_roles_index)
+
 
 @attr('INT', group='coi')
 class TestOrgManagementServiceInt(IonIntegrationTestCase):
@@ -22,6 +22,7 @@ class TestPolicyManagementService(PyonTestCase):
 
         self.policy_management_service = PolicyManagementService()
         self.policy_management_service.clients = mock_clients
+        self.policy_management_service.on_init()
 
         # Rename to save some typing
         self.mock_create = mock_clients.resource_registry.create
@@ -153,6 +154,56 @@ class TestPolicyManagementService(PyonTestCase):
         self.assertEqual(ex.message, 'Role bad role does not exist')
         self.mock_read.assert_called_once_with('bad role', '')
 
+    def test_active_service_policy_rules_cached(self):
+        org = Mock()
+        org._id = 'org_id'
+        org.name = 'ION'
+        service = Mock()
+        service._id = 'service_id'
+        org_policy = Mock()
+        org_policy._id = 'org_policy_id'
+        org_policy.enabled = True
+        org_policy.rule = '<Rule id="org"/>'
+        service_policy = Mock()
+        service_policy._id = 'service_policy_id'
+        service_policy.enabled = True
+        service_policy.rule = '<Rule id="service"/>'
+        disabled_policy = Mock()
+        disabled_policy._id = 'disabled_policy_id'
+        disabled_policy.name = 'Disabled_Policy'
+        disabled_policy.enabled = False
+        disabled_policy.rule = '<Rule id="disabled"/>'
+
+        self.mock_read.side_effect = lambda object_id, rev_id='': org if object_id == 'org_id' else service
+        self.mock_find_resources.return_value = ([service], [])
+        self.mock_find_objects.side_effect = lambda subject, predicate, object_type: \
+            ([org_policy], []) if subject is org else ([service_policy, disabled_policy], [])
+
+        policy_rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'resource_registry')
+
+        self.assertIn('<Rule id="org"/><Rule id="service"/>', policy_rules)
+        self.assertNotIn('disabled', policy_rules)
+        self.assertEqual(self.mock_find_objects.call_count, 2)
+
+        # TEST: A second request is answered from the cache without any registry calls
+        self.assertEqual(self.policy_management_service.get_active_service_policy_rules('org_id', 'resource_registry'), policy_rules)
+        self.assertEqual(self.mock_find_objects.call_count, 2)
+        self.assertEqual(self.mock_find_resources.call_count, 1)
+
+        # TEST: Updating a policy used by the cached entry evicts it
+        disabled_policy.enabled = True
+        self.policy_management_service.update_policy(disabled_policy)
+        policy_rules = self.policy_management_service.get_active_service_policy_rules('org_id', 'resource_registry')
+        self.assertIn('<Rule id="disabled"/>', policy_rules)
+        self.assertEqual(self.mock_find_objects.call_count, 4)
+
+        # TEST: A resource modified event for the Org evicts the entry too
+        event_msg = Mock()
+        event_msg.origin = 'org_id'
+        event_msg.origin_type = RT.Org
+        self.policy_management_service._receive_resource_modified_event(event_msg, {})
+        self.assertEqual(len(self.policy_management_service.policy_cache), 0)
+
 
 @attr('INT', group='coi')
 class TestPolicyManagementServiceInt(IonIntegrationTestCase):
@@ -280,3 +280,70 @@ class TestServiceGatewayServiceInt(IonIntegrationTestCase):
         self.assertEqual(data_product_id, data_product_obj['_id'])
 
         self.delete_data_product_resource(data_product_id)
+
+    def test_batch_request(self):
+
+        data_product_id = self.create_data_product_resource()
+
+        batch_request = {  "batchRequest": {
+            "requester": "anonymous",
+            "requests": [
+                {   "serviceRequest": {
+                        "serviceName": "resource_registry",
+                        "serviceOp": "read",
+                        "params": {
+                            "object_id": data_product_id
+                        }
+                    }
+                },
+                {   "serviceRequest": {
+                        "serviceName": "resource_registry",
+                        "serviceOp": "read",
+                        "params": {
+                            "object_id": "does_not_exist"
+                        }
+                    }
+                },
+                {   "serviceRequest": {
+                        "serviceName": "resource_registry",
+                        "serviceOp": "find_resources",
+                        "params": {
+                            "name": "TestDataProduct",
+                            "id_only": True
+                        }
+                    }
+                },
+                {   "serviceRequest": {
+                        "serviceName": "fake_service",
+                        "serviceOp": "read"
+                    }
+                }
+            ]
+        }
+        }
+
+        response = self.test_app.post('/ion-service/batch', {'payload': simplejson.dumps(batch_request) })
+        self.check_response_headers(response)
+        self.assertIn(GATEWAY_RESPONSE, response.json['data'])
+        response_data = response.json['data'][GATEWAY_RESPONSE]
+        self.assertEqual(len(response_data), 4)
+
+        #Results are returned in the same order as the requests
+        self.assertIn(GATEWAY_RESPONSE, response_data[0])
+        self.assertEqual(data_product_id, convert_unicode(response_data[0][GATEWAY_RESPONSE])['_id'])
+
+        self.assertIn(GATEWAY_ERROR, response_data[1])
+        self.assertIn('does not exist', response_data[1][GATEWAY_ERROR][GATEWAY_ERROR_MESSAGE])
+
+        self.assertIn(GATEWAY_RESPONSE, response_data[2])
+        self.assertEqual(response_data[2][GATEWAY_RESPONSE][0], [data_product_id])
+
+        self.assertIn(GATEWAY_ERROR, response_data[3])
+        self.assertIn('BadRequest', response_data[3][GATEWAY_ERROR][GATEWAY_ERROR_EXCEPTION])
+
+        response = self.test_app.post('/ion-service/batch', {'payload': simplejson.dumps({"batchRequest": {}}) })
+        self.check_response_headers(response)
+        self.assertIn(GATEWAY_ERROR, response.json['data'])
+        self.assertIn('requests', response.json['data'][GATEWAY_ERROR][GATEWAY_ERROR_MESSAGE])
+
+        self.delete_data_product_resource(data_product_id)
@@ -12,6 +12,7 @@ and the relationships between them
 from interface.services.dm.ipubsub_management_service import\
     BasePubsubManagementService
 from pyon.core.exception import NotFound, BadRequest
+from pyon.event.event import EventSubscriber
 from pyon.public import RT, PRED, log
 from pyon.net.channel import SubscriberChannel
 from pyon.public import CFG
@@ -20,6 +21,7 @@ from interface.objects import Subscription, SubscriptionTypeEnum
 from interface import objects
 from pyon.core import bootstrap # Is the sysname imported correctly in pyon.public? Late binding???
 from pyon.net.transport import NameTrio, TransportError
+from ion.services.dm.distribution.stream_catalog import StreamCatalog, DEFAULT_STREAM_CATALOG_MAX_AGE
 
 # Can't make a couchdb data store here...
 ### so for now - the pubsub service will just publish the first message on the stream that is creates with the definition
@@ -61,6 +63,26 @@ class PubsubManagementService(BasePubsubManagementService):
         except ValueError:
             raise StandardError('Invalid CFG for core_xps.science_data: "%s"; must have "xs.xp" structure' % xs_dot_xp)
 
+        # Index of the streams for the find operations, loaded on first use
+        self.stream_catalog = StreamCatalog(CFG.get('stream_catalog_max_age', DEFAULT_STREAM_CATALOG_MAX_AGE))
+        self.event_subscriber = None
+
+    def on_start(self):
+        #Listen for changes made to streams - possibly by other instances of the service - and drop the stream catalog
+        self.event_subscriber = EventSubscriber(
+            event_type="ResourceModifiedEvent",
+            callback=self._receive_resource_modified_event
+        )
+        self.event_subscriber.activate()
+
+    def on_quit(self):
+        if self.event_subscriber is not None:
+            self.event_subscriber.deactivate()
+
+    def _receive_resource_modified_event(self, event_msg, headers):
+        if event_msg.origin_type == RT.Stream:
+            self.stream_catalog.invalidate()
+
     def create_stream_definition(self, container=None, name='', description=''):
         """
         @brief Create a new stream definition which may be used to publish on one or more streams
@@ -150,6 +172,9 @@ class PubsubManagementService(BasePubsubManagementService):
         if stream_definition_id != '':
             self.clients.resource_registry.create_association(stream_id, PRED.hasStreamDefinition, stream_definition_id)
 
+        stream_obj._id = stream_id
+        self.stream_catalog.add(stream_obj, stream_definition_id)
+
         return stream_id
 
     def update_stream(self, stream=None):
@@ -164,6 +189,7 @@ class PubsubManagementService(BasePubsubManagementService):
         log.debug("Updating stream object: %s" % stream.name)
         id, rev = self.clients.resource_registry.update(stream)
         #@todo will this throw a NotFound in the client if there was a problem?
+        self.stream_catalog.update(stream)
 
     def read_stream(self, stream_id=''):
         '''
@@ -194,41 +220,55 @@ class PubsubManagementService(BasePubsubManagementService):
             raise NotFound("Stream %s does not exist" % stream_id)
 
         self.clients.resource_registry.delete(stream_id)
+        self.stream_catalog.remove(stream_id)
 
-    def find_streams(self, filter=None):
+    def find_streams(self, filter=None, skip=0, limit=0):
         '''
         Find a stream in the resource_registry based on the filters provided.
 
         @param filter ResourceFilter object containing filter values.
+        @param skip Number of matching streams to skip, ordered by id.
+        @param limit Maximum number of streams returned, all if 0.
         @retval stream_list The list of streams that match the filter.
         '''
-        result = []
-        objects = self.clients.resource_registry.find_resources(RT.Stream, None, None, False)
-        for obj in objects:
-            match = True
-            for key in filter.keys():
-                if (getattr(obj, key) != filter[key]):
-                    match = False
-            if (match):
-                result.append(obj)
-        return result
+        catalog = self._get_stream_catalog(with_definitions=bool(filter) and 'stream_definition_id' in filter)
+        return catalog.find(filter, skip, limit)
 
-    def find_streams_by_producer(self, producer_id=''):
+    def find_streams_by_producer(self, producer_id='', skip=0, limit=0):
         '''
         Find all streams that contain a particular producer.
 
         @param producer_id The id of the producer.
+        @param skip Number of matching streams to skip, ordered by id.
+        @param limit Maximum number of streams returned, all if 0.
         @retval stream_list The list of streams that contain the producer.
         '''
-        def containsProducer(obj):
-            if producer_id in obj.producers:
-                return True
-            else:
-                return False
+        return self._get_stream_catalog().find_by_producer(producer_id, skip, limit)
 
-        objects = self.clients.resource_registry.find_resources(RT.Stream, None, None, False)
-        result = filter(containsProducer, objects)
-        return result
+    def find_streams_by_definition(self, stream_definition_id='', skip=0, limit=0):
+        '''
+        Find all streams that have a particular stream definition.
+
+        @param stream_definition_id The id of the stream definition.
+        @param skip Number of matching streams to skip, ordered by id.
+        @param limit Maximum number of streams returned, all if 0.
+        @retval stream_list The list of streams with the stream definition.
+        '''
+        return self._get_stream_catalog(with_definitions=True).find_by_definition(stream_definition_id, skip, limit)
+
+    def _get_stream_catalog(self, with_definitions=False):
+        '''
+        Returns the stream catalog, reading the streams from the resource registry if it was not loaded yet, has
+        expired or a stream was modified elsewhere. The stream definitions are only read when a query needs them.
+        The streams found in the catalog are shared with it and are read-only.
+        '''
+        if not self.stream_catalog.is_loaded():
+            streams, _ = self.clients.resource_registry.find_resources(RT.Stream, None, None, False)
+            self.stream_catalog.load(streams)
+        if with_definitions and not self.stream_catalog.definitions_loaded:
+            assocs = self.clients.resource_registry.find_associations(predicate=PRED.hasStreamDefinition, id_only=False)
+            self.stream_catalog.load_definitions([(assoc.s, assoc.o) for assoc in assocs])
+        return self.stream_catalog
 
     def find_streams_by_consumer(self, consumer_id=''):
         '''
@@ -322,7 +362,7 @@ class PubsubManagementService(BasePubsubManagementService):
                 if subscription.is_active:
                     self._bind_subscription(self.XP,subscription.exchange_name, '%s.data' % stream_id)
 
-            subscription.query.stream_ids = current_streams
+            subscription.query.stream_ids = list(updated_streams)
             id, rev = self.clients.resource_registry.update(subscription)
             return True
 
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+'''
+@package ion.services.dm.distribution.stream_catalog
+@file ion/services/dm/distribution/stream_catalog.py
+@brief In memory index of the Stream resources used by the PubSub Management service to find streams by producer,
+stream definition and name without going through every stream
+'''
+
+import time
+
+# Seconds after which the catalog is read again from the resource registry. Changes made by other instances of the
+# service are normally seen sooner, through the resource modified events; this bounds how stale the catalog can get
+# when such an event is lost
+DEFAULT_STREAM_CATALOG_MAX_AGE = 30
+
+
+class StreamCatalog(object):
+    '''
+    Streams by id, with indexes from producer, name and stream definition id to the ids of the streams. Streams are
+    added, updated and removed along with the resource registry; query results are sorted by stream id so that they
+    can be paged through with skip and limit. The streams returned are the ones held by the catalog, not copies, and
+    must not be modified.
+    '''
+
+    def __init__(self, max_age=DEFAULT_STREAM_CATALOG_MAX_AGE):
+        self.max_age = max_age
+        self.timestamp = None
+        self.definitions_loaded = False
+        self.streams = {}
+        self.by_producer = {}
+        self.by_name = {}
+        self.by_definition = {}
+        # stream id -> stream definition id
+        self.definitions = {}
+
+    def is_loaded(self):
+        return self.timestamp is not None and time.time() - self.timestamp <= self.max_age
+
+    def invalidate(self):
+        self.timestamp = None
+
+    def load(self, streams):
+        self.streams = {}
+        self.by_producer = {}
+        self.by_name = {}
+        self.timestamp = time.time()
+        self.definitions_loaded = False
+        self.by_definition = {}
+        self.definitions = {}
+        for stream in streams:
+            self._index(stream)
+
+    def load_definitions(self, stream_definition_pairs):
+        '''
+        @param stream_definition_pairs (stream id, stream definition id) of the hasStreamDefinition associations
+        '''
+        self.by_definition = {}
+        self.definitions = {}
+        for stream_id, stream_definition_id in stream_definition_pairs:
+            if stream_id in self.streams:
+                self._add_key(self.by_definition, stream_definition_id, stream_id)
+                self.definitions[stream_id] = stream_definition_id
+        self.definitions_loaded = True
+
+    def add(self, stream, stream_definition_id=''):
+        if not self.is_loaded():
+            return
+        self._index(stream)
+        if stream_definition_id:
+            self._add_key(self.by_definition, stream_definition_id, stream._id)
+            self.definitions[stream._id] = stream_definition_id
+
+    def update(self, stream):
+        if not self.is_loaded():
+            return
+        self._unindex(stream._id)
+        self._index(stream)
+
+    def remove(self, stream_id):
+        if not self.is_loaded():
+            return
+        self._unindex(stream_id)
+        stream_definition_id = self.definitions.pop(stream_id, None)
+        if stream_definition_id:
+            self._remove_key(self.by_definition, stream_definition_id, stream_id)
+
+    def find(self, filter=None, skip=0, limit=0):
+        '''
+        Returns the streams whose attributes equal the filter values. The name, producers and stream_definition_id
+        keys are looked up in the indexes, the other keys are compared on the streams left.
+        '''
+        filter = filter or {}
+        candidates = None
+        if 'name' in filter:
+            candidates = self.by_name.get(filter['name'], set())
+        if 'stream_definition_id' in filter:
+            ids = self.by_definition.get(filter['stream_definition_id'], set())
+            candidates = ids if candidates is None else candidates & ids
+        if candidates is None:
+            candidates = self.streams.viewkeys()
+
+        result = []
+        for stream_id in sorted(candidates):
+            stream = self.streams[stream_id]
+            match = True
+            for key, value in filter.iteritems():
+                if key == 'stream_definition_id' or key == 'name':
+                    continue
+                if getattr(stream, key) != value:
+                    match = False
+                    break
+            if match:
+                result.append(stream)
+        return self._page(result, skip, limit)
+
+    def find_by_producer(self, producer_id, skip=0, limit=0):
+        ids = self.by_producer.get(producer_id, set())
+        return self._page([self.streams[stream_id] for stream_id in sorted(ids)], skip, limit)
+
+    def find_by_definition(self, stream_definition_id, skip=0, limit=0):
+        ids = self.by_definition.get(stream_definition_id, set())
+        return self._page([self.streams[stream_id] for stream_id in sorted(ids)], skip, limit)
+
+    def _page(self, result, skip, limit):
+        if limit:
+            return result[skip:skip + limit]
+        return result[skip:]
+
+    def _index(self, stream):
+        self.streams[stream._id] = stream
+        self._add_key(self.by_name, stream.name, stream._id)
+        for producer in set(stream.producers):
+            self._add_key(self.by_producer, producer, stream._id)
+
+    def _unindex(self, stream_id):
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return
+        self._remove_key(self.by_name, stream.name, stream_id)
+        for producer in set(stream.producers):
+            self._remove_key(self.by_producer, producer, stream_id)
+
+    def _add_key(self, index, key, stream_id):
+        index.setdefault(key, set()).add(stream_id)
+
+    def _remove_key(self, index, key, stream_id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(stream_id)
+            if not ids:
+                del index[key]
@@ -203,35 +203,49 @@ class PubSubTest(PyonTestCase):
         self.assertEqual(self.mock_delete.call_count, 0)
 
     def test_find_stream(self):
-        self.mock_find_resources.return_value = [self.stream]
+        self.mock_find_resources.return_value = ([self.stream], [])
         filter = {'name': 'SampleStream', 'description': 'Sample Stream In PubSub'}
         streams = self.pubsub_service.find_streams(filter)
 
         self.assertEqual(streams, [self.stream])
 
     def test_find_stream_not_found(self):
-        self.mock_find_resources.return_value = [self.stream]
+        self.mock_find_resources.return_value = ([self.stream], [])
         filter = {'name': 'StreamNotFound', 'description': 'Sample Stream In PubSub'}
         streams = self.pubsub_service.find_streams(filter)
 
         self.assertEqual(streams, [])
 
     def test_find_stream_no_streams_registered(self):
-        self.mock_find_resources.return_value = []
+        self.mock_find_resources.return_value = ([], [])
         filter = {'name': 'SampleStream', 'description': 'Sample Stream In PubSub'}
         streams = self.pubsub_service.find_streams(filter)
 
         self.assertEqual(streams, [])
 
+    def test_stream_modified_event(self):
+        self.mock_find_resources.return_value = ([self.stream], [])
+        self.pubsub_service.find_streams({'name': 'SampleStream'})
+
+        # a stream modified by another instance of the service
+        self.pubsub_service._receive_resource_modified_event(DotDict(origin_type=RT.Stream, origin='other_stream'), {})
+        self.pubsub_service.find_streams({'name': 'SampleStream'})
+        self.assertEqual(self.mock_find_resources.call_count, 2)
+
+        # other resources leave the catalog loaded
+        self.pubsub_service._receive_resource_modified_event(DotDict(origin_type=RT.Subscription, origin='other'), {})
+        self.pubsub_service.find_streams({'name': 'SampleStream'})
+        self.assertEqual(self.mock_find_resources.call_count, 2)
+
     def test_find_streams_by_producer(self):
-        self.mock_find_resources.return_value = [self.stream]
+        self.mock_find_resources.return_value = ([self.stream], [])
         streams = self.pubsub_service.find_streams_by_producer("producer1")
 
         self.mock_find_resources.assert_called_once_with(RT.Stream, None, None, False)
         self.assertEqual(streams, [self.stream])
 
     def test_find_streams_by_producer_not_in_list(self):
-        self.mock_find_resources.return_value = [self.stream]
+        self.mock_find_resources.return_value = ([self.stream], [])
         streams = self.pubsub_service.find_streams_by_producer("producer_not_found")
 
         self.mock_find_resources.assert_called_once_with(RT.Stream, None, None, False)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+'''
+@file ion/services/dm/distribution/test/test_stream_catalog.py
+@test ion.services.dm.distribution.stream_catalog Unit tests and benchmark for the stream catalog
+'''
+
+import time
+
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.services.dm.distribution.stream_catalog import StreamCatalog
+
+
+class FakeStream(object):
+    def __init__(self, _id, name, producers, encoding=''):
+        self._id = _id
+        self.name = name
+        self.producers = producers
+        self.encoding = encoding
+
+
+def make_streams(num_streams):
+    # ten streams per producer and per name, a hundred per stream definition
+    streams = [FakeStream('stream_%06d' % i, 'name_%d' % (i // 10), ['producer_%d' % (i // 10)],
+                          encoding='enc_%d' % (i % 2))
+               for i in xrange(num_streams)]
+    definitions = [(stream._id, 'definition_%d' % (i // 100)) for i, stream in enumerate(streams)]
+    return streams, definitions
+
+
+@attr('UNIT', group='dm')
+class StreamCatalogTest(PyonTestCase):
+
+    def setUp(self):
+        self.streams, self.definitions = make_streams(1000)
+        self.catalog = StreamCatalog()
+        self.catalog.load(self.streams)
+        self.catalog.load_definitions(self.definitions)
+
+    def ids(self, streams):
+        return [stream._id for stream in streams]
+
+    def test_find(self):
+        self.assertEqual(self.ids(self.catalog.find({'name': 'name_3'})), ['stream_%06d' % i for i in xrange(30, 40)])
+        self.assertEqual(self.ids(self.catalog.find({'name': 'name_3', 'encoding': 'enc_1'})),
+                         ['stream_%06d' % i for i in xrange(31, 40, 2)])
+        self.assertEqual(len(self.catalog.find({'stream_definition_id': 'definition_2', 'encoding': 'enc_0'})), 50)
+        self.assertEqual(self.catalog.find({'name': 'missing'}), [])
+        self.assertEqual(len(self.catalog.find({})), 1000)
+
+    def test_find_by_producer_and_definition(self):
+        self.assertEqual(self.ids(self.catalog.find_by_producer('producer_5')), ['stream_%06d' % i for i in xrange(50, 60)])
+        self.assertEqual(len(self.catalog.find_by_definition('definition_9')), 100)
+        self.assertEqual(self.catalog.find_by_producer('missing'), [])
+
+    def test_pagination(self):
+        page1 = self.catalog.find_by_definition('definition_1', skip=0, limit=40)
+        page2 = self.catalog.find_by_definition('definition_1', skip=40, limit=40)
+        page3 = self.catalog.find_by_definition('definition_1', skip=80, limit=40)
+        self.assertEqual(map(len, (page1, page2, page3)), [40, 40, 20])
+        self.assertEqual(self.ids(page1 + page2 + page3), ['stream_%06d' % i for i in xrange(100, 200)])
+
+    def test_add_update_remove(self):
+        self.catalog.add(FakeStream('new_stream', 'name_3', ['producer_new']), 'definition_new')
+        self.assertEqual(len(self.catalog.find({'name': 'name_3'})), 11)
+        self.assertEqual(self.ids(self.catalog.find_by_definition('definition_new')), ['new_stream'])
+
+        self.catalog.update(FakeStream('new_stream', 'renamed', ['producer_new', 'producer_other']))
+        self.assertEqual(len(self.catalog.find({'name': 'name_3'})), 10)
+        self.assertEqual(self.ids(self.catalog.find_by_producer('producer_other')), ['new_stream'])
+        self.assertEqual(self.ids(self.catalog.find_by_definition('definition_new')), ['new_stream'])
+
+        self.catalog.remove('new_stream')
+        self.assertEqual(self.catalog.find({'name': 'renamed'}), [])
+        self.assertEqual(self.catalog.find_by_producer('producer_new'), [])
+        self.assertEqual(self.catalog.find_by_definition('definition_new'), [])
+
+    def test_not_loaded(self):
+        catalog = StreamCatalog()
+        self.assertFalse(catalog.is_loaded())
+        # changes before the catalog is loaded are picked up when it is loaded
+        catalog.add(FakeStream('s', 'n', []))
+        self.assertEqual(catalog.streams, {})
+
+    def test_invalidate(self):
+        self.assertTrue(self.catalog.is_loaded())
+        self.catalog.invalidate()
+        self.assertFalse(self.catalog.is_loaded())
+        # changes are ignored until the catalog is loaded again
+        self.catalog.add(FakeStream('new_stream', 'name_3', []))
+        self.catalog.load(self.streams)
+        self.assertEqual(len(self.catalog.find({'name': 'name_3'})), 10)
+
+
+def benchmark(num_streams=50000, num_queries=1000):
+    '''
+    Compares finding streams by producer with a scan of all the streams, as find_streams_by_producer used to do,
+    and with the catalog.
+    '''
+    streams, definitions = make_streams(num_streams)
+    catalog = StreamCatalog()
+    catalog.load(streams)
+    catalog.load_definitions(definitions)
+    producers = ['producer_%d' % (i * 7 % (num_streams // 10)) for i in xrange(num_queries)]
+
+    start = time.time()
+    for producer in producers:
+        [stream for stream in streams if producer in stream.producers]
+    scan_time = (time.time() - start) / num_queries
+
+    start = time.time()
+    for producer in producers:
+        catalog.find_by_producer(producer)
+    catalog_time = (time.time() - start) / num_queries
+
+    print '%d streams: scan %.3f ms, catalog %.3f ms per query' % (num_streams, scan_time * 1000, catalog_time * 1000)
+
+
+if __name__ == '__main__':
+    for num_streams in (10000, 50000):
+        benchmark(num_streams)
@@ -13,15 +13,26 @@ from pyon.core.exception import NotFound
 from pyon.public import RT, PRED, log, IonObject
 from pyon.public import CFG
 from pyon.core.exception import IonException
-from interface.objects import ExchangeQuery, IngestionConfiguration, ProcessDefinition
+from interface.objects import ExchangeQuery, StreamQuery, IngestionConfiguration, ProcessDefinition
 from interface.objects import DatasetIngestionConfiguration, DatasetIngestionByStream, DatasetIngestionTypeEnum
-from pyon.event.event import EventPublisher
+from pyon.event.event import EventPublisher, EventSubscriber
 from pyon.core.object import IonObjectSerializer, IonObjectBase
+from pyon.net.endpoint import Publisher
+from pyon.net.transport import NameTrio, TransportError
+from pyon.util.async import spawn
+from ion.services.dm.distribution.pubsub_management_service import BindingChannel
+from ion.services.dm.ingestion.ingestion_sharding import StreamShards, HANDOFF_MARKER, HANDOFF_DRAINED, HANDOFF_ROUTING_KEY
+
+import time
+from gevent.queue import Queue, Empty
 
 
 from pyon.datastore.datastore import DataStore
 
 
+# seconds a removed ingestion worker is given to ingest the granules queued for its streams before it is deleted
+DEFAULT_HANDOFF_TIMEOUT = 30
+
 
 class IngestionManagementServiceException(IonException):
     """
@@ -52,10 +63,16 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         self.serializer = IonObjectSerializer()
 
+        # When sharded, each ingestion worker has its own queue and the streams are assigned to the workers by
+        # consistent hashing, instead of all the workers competing for the granules of all the streams
+        self.sharded = False
+
 
     def on_start(self):
         super(IngestionManagementService,self).on_start()
         self.event_publisher = EventPublisher(event_type="DatasetIngestionConfigurationEvent")
+        self.sharded = self.CFG.get('ingestion_sharded', False)
+        self.handoff_timeout = self.CFG.get('ingestion_handoff_timeout', DEFAULT_HANDOFF_TIMEOUT)
 
 
         #########################################################################################################
@@ -82,18 +99,6 @@ class IngestionManagementService(BaseIngestionManagementService):
         """
 
 
-        # Give each ingestion configuration its own queue name to receive data on
-        exchange_name = 'ingestion_queue'
-
-        ##------------------------------------------------------------------------------------
-        ## declare our intent to subscribe to all messages on the exchange point
-        query = ExchangeQuery()
-
-        subscription_id = self.clients.pubsub_management.create_subscription(query=query,\
-            exchange_name=exchange_name, name='Ingestion subscription', description='Subscription for ingestion workers')
-
-        ##------------------------------------------------------------------------------------------
-
         # create an ingestion_configuration instance and update the registry
         # @todo: right now sending in the exchange_point_id as the name...
         ingestion_configuration = IngestionConfiguration( name = self.XP)
@@ -109,6 +114,25 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         ingestion_configuration_id, _ = self.clients.resource_registry.create(ingestion_configuration)
 
+        if self.sharded:
+            # the workers subscribe to the streams assigned to them as dataset configurations are created, there is
+            # always at least one worker for the streams to be assigned to
+            for i in xrange(max(ingestion_configuration.number_of_workers, 1)):
+                self._launch_shard(i + 1, ingestion_configuration_id, ingestion_configuration, self.process_definition_id)
+            return ingestion_configuration_id
+
+        # Give each ingestion configuration its own queue name to receive data on
+        exchange_name = 'ingestion_queue'
+
+        ##------------------------------------------------------------------------------------
+        ## declare our intent to subscribe to all messages on the exchange point
+        query = ExchangeQuery()
+
+        subscription_id = self.clients.pubsub_management.create_subscription(query=query,\
+            exchange_name=exchange_name, name='Ingestion subscription', description='Subscription for ingestion workers')
+
+        ##------------------------------------------------------------------------------------------
+
         self._launch_transforms(
             ingestion_configuration.number_of_workers,
             subscription_id,
@@ -146,6 +170,221 @@ class IngestionManagementService(BaseIngestionManagementService):
                 raise IngestionManagementServiceException('Transform could not be launched by ingestion.')
             self.clients.resource_registry.create_association(ingestion_configuration_id, PRED.hasTransform, transform_id)
 
+    def _launch_shard(self, index, ingestion_configuration_id, ingestion_configuration, process_definition_id):
+        """
+        Spawns one ingestion worker of a sharded ingestion configuration, with its own queue and a stream subscription
+        for the streams assigned to it. The name of the queue identifies the worker in the consistent hash ring and is
+        the origin of the dataset configuration events it receives.
+        """
+        shard = '%s_%s_%d' % (self.base_exchange_name, ingestion_configuration_id, index)
+
+        subscription_id = self.clients.pubsub_management.create_subscription(query=StreamQuery(stream_ids=[]),
+            exchange_name=shard, name='Ingestion subscription %s' % shard,
+            description='Subscription for the streams of ingestion worker %d' % index)
+
+        configuration = self.serializer.serialize(ingestion_configuration)
+        configuration.pop('type_')
+        configuration['configuration_id'] = ingestion_configuration_id
+        configuration['shard'] = shard
+
+        transform_id = self.clients.transform_management.create_transform(
+            name = '(%s)_Ingestion_Worker_%s' % (ingestion_configuration_id, index),
+            description = 'Ingestion worker',
+            in_subscription_id= subscription_id,
+            out_streams = {},
+            process_definition_id=process_definition_id,
+            configuration=configuration)
+
+        if not transform_id:
+            raise IngestionManagementServiceException('Transform could not be launched by ingestion.')
+        self.clients.resource_registry.create_association(ingestion_configuration_id, PRED.hasTransform, transform_id)
+
+        return shard, transform_id, subscription_id
+
+    def _read_shards(self, ingestion_configuration_id):
+        """
+        Returns the stream assignments of a sharded ingestion configuration, read from the subscriptions of its
+        workers, a dict of shard -> (transform id, subscription id) and whether the workers are active.
+        """
+        shards = StreamShards()
+        workers = {}
+        active = False
+        transform_ids, _ = self.clients.resource_registry.find_objects(ingestion_configuration_id, PRED.hasTransform, RT.Transform, True)
+        for transform_id in transform_ids:
+            subscriptions, _ = self.clients.resource_registry.find_objects(transform_id, PRED.hasSubscription, RT.Subscription, False)
+            if len(subscriptions) != 1:
+                raise IngestionManagementServiceException('Ingestion worker %s does not have one subscription' % transform_id)
+            subscription = subscriptions[0]
+            shards.restore(subscription.exchange_name, subscription.query.stream_ids)
+            workers[subscription.exchange_name] = (transform_id, subscription._id)
+            active = active or subscription.is_active
+
+        return shards, workers, active
+
+    def _rebalance_shards(self, ingestion_configuration_id, ingestion_configuration):
+        """
+        Launches or removes ingestion workers until there are number_of_workers of them and moves the streams whose
+        worker changed in the consistent hash ring, which are only the streams next to the workers added or removed.
+        """
+        shards, workers, active = self._read_shards(ingestion_configuration_id)
+        before = dict(shards.assignments)
+
+        # workers are added after, and removed from, the highest index
+        by_index = sorted(workers, key=lambda shard: int(shard.rsplit('_', 1)[1]))
+        next_index = int(by_index[-1].rsplit('_', 1)[1]) + 1 if by_index else 1
+
+        removed = []
+        while len(shards.ring) > max(ingestion_configuration.number_of_workers, 1):
+            shard = by_index.pop()
+            shards.remove_worker(shard)
+            removed.append(shard)
+
+        while len(shards.ring) < ingestion_configuration.number_of_workers:
+            shard, transform_id, subscription_id = self._launch_shard(next_index, ingestion_configuration_id,
+                ingestion_configuration, self.process_definition_id)
+            next_index += 1
+            workers[shard] = (transform_id, subscription_id)
+            shards.add_worker(shard)
+            if active:
+                self.clients.transform_management.activate_transform(transform_id)
+
+        moves = dict((stream_id, (worker, shards.assignments[stream_id])) for stream_id, worker in before.iteritems()
+                     if shards.assignments[stream_id] != worker)
+
+        if moves:
+            # the handoff bindings are removed, and the removed workers deleted, once the old workers have ingested the
+            # granules queued for the streams they hand over
+            drained = Queue()
+            def receive_drained_event(event_msg, headers):
+                if event_msg.sub_type == HANDOFF_DRAINED:
+                    drained.put(event_msg.configuration.stream_id)
+            subscriber = EventSubscriber(event_type="DatasetIngestionConfigurationEvent", callback=receive_drained_event)
+            gl = spawn(subscriber.listen)
+            subscriber._ready_event.wait(timeout=5)
+            handed_over = []
+            try:
+                self._move_streams(ingestion_configuration_id, moves, workers, handed_over)
+                self._wait_drained(handed_over, drained)
+            finally:
+                subscriber.close()
+                gl.kill()
+                for stream_id in handed_over:
+                    for shard in moves[stream_id]:
+                        self._unbind_handoff(shard, stream_id)
+
+        for shard in removed:
+            transform_id, subscription_id = workers[shard]
+            self.clients.transform_management.delete_transform(transform_id)
+            self.clients.pubsub_management.delete_subscription(subscription_id)
+            for association in self.clients.resource_registry.find_associations(ingestion_configuration_id, PRED.hasTransform, transform_id):
+                self.clients.resource_registry.delete_association(association)
+
+        log.info('Rebalanced ingestion configuration %s on %d workers, moved %d streams', ingestion_configuration_id,
+            len(shards.ring), len(moves))
+        return moves
+
+    def _move_streams(self, ingestion_configuration_id, moves, workers, handed_over):
+        """
+        Moves streams between workers without losing or reordering their granules, see StreamHandoff: the stream is
+        bound to the queue of its new worker, a handoff marker carrying its dataset configuration is published with
+        the handoff routing key of the stream, which only the queues of the two workers are bound to, so that it
+        reaches both queues at the same position, then the stream is unbound from the queue of its old worker. The old
+        worker keeps the dataset configuration until it reaches the marker. The streams handed over are added to
+        handed_over as their markers are published, their handoff bindings are left to the caller to remove.
+        """
+        if not moves:
+            return
+
+        dset_configs = {}
+        configs, _ = self.clients.resource_registry.find_subjects(RT.DatasetIngestionConfiguration, PRED.hasIngestionConfiguration, ingestion_configuration_id, False)
+        for dset_config in configs:
+            dset_configs[dset_config.configuration.stream_id] = dset_config
+
+        removed = {}
+        added = {}
+        for stream_id, (worker, new_worker) in moves.iteritems():
+            removed.setdefault(worker, []).append(stream_id)
+            added.setdefault(new_worker, []).append(stream_id)
+
+        for worker, stream_ids in added.iteritems():
+            self._update_shard_streams(workers[worker][1], added=stream_ids)
+
+        publisher = Publisher(node=self.container.node)
+        for stream_id, (worker, new_worker) in moves.iteritems():
+            # without a dataset configuration neither worker ingests the stream, there is nothing to hand over
+            if stream_id not in dset_configs:
+                continue
+            dset_config = dset_configs[stream_id]
+            marker = IonObject("DatasetIngestionConfigurationEvent",
+                origin=new_worker,
+                sub_type=HANDOFF_MARKER,
+                description=dset_config.description,
+                configuration=dset_config.configuration,
+                type=DatasetIngestionTypeEnum.DATASETINGESTIONBYSTREAM,
+                resource_id=dset_config._id)
+            handed_over.append(stream_id)
+            self._bind_handoff(worker, stream_id)
+            self._bind_handoff(new_worker, stream_id)
+            publisher.publish(marker, to_name=(self.XP, HANDOFF_ROUTING_KEY % stream_id))
+
+        for worker, stream_ids in removed.iteritems():
+            self._update_shard_streams(workers[worker][1], removed=stream_ids)
+
+    def _bind_handoff(self, shard, stream_id):
+        channel = self.container.node.channel(BindingChannel)
+        channel.setup_listener(NameTrio(self.XP, shard), binding=HANDOFF_ROUTING_KEY % stream_id)
+
+    def _unbind_handoff(self, shard, stream_id):
+        try:
+            channel = self.container.node.channel(BindingChannel)
+            channel._recv_name = NameTrio(self.XP, shard)
+            channel._recv_name = NameTrio(channel._recv_name.exchange, '.'.join([self.XP, shard]))
+            channel._recv_binding = HANDOFF_ROUTING_KEY % stream_id
+            channel._destroy_binding()
+        except TransportError:
+            log.exception('Could not remove the handoff binding of stream %s from ingestion worker %s', stream_id, shard)
+
+    def _wait_drained(self, stream_ids, drained):
+        """
+        Waits until the old workers of the streams have signalled, on the drained queue, that they ingested the granules
+        queued before the handoff marker.
+        """
+        pending = set(stream_ids)
+        deadline = time.time() + self.handoff_timeout
+        try:
+            while pending:
+                pending.discard(drained.get(timeout=max(deadline - time.time(), 0)))
+        except Empty:
+            log.warning('Streams %s were not drained by their old ingestion workers within %s seconds', sorted(pending),
+                self.handoff_timeout)
+
+    def _update_shard_streams(self, subscription_id, added=(), removed=()):
+        subscription = self.clients.pubsub_management.read_subscription(subscription_id)
+        stream_ids = set(subscription.query.stream_ids)
+        stream_ids.difference_update(removed)
+        stream_ids.update(added)
+        self.clients.pubsub_management.update_subscription(subscription_id, StreamQuery(stream_ids=sorted(stream_ids)))
+
+    def _dataset_config_origin(self, ingestion_configuration_id, stream_id):
+        """
+        Returns the origin of the dataset configuration events for a stream: the ingestion configuration, or the
+        worker of the stream if the ingestion is sharded.
+        """
+        if not self.sharded:
+            return ingestion_configuration_id
+        shards, _, _ = self._read_shards(ingestion_configuration_id)
+        return shards.worker_for(stream_id) or ingestion_configuration_id
+
+    def _publish_dataset_config(self, origin, dset_ingest_config, deleted=False):
+        self.event_publisher.publish_event(
+            origin=origin,
+            description = dset_ingest_config.description,
+            configuration = dset_ingest_config.configuration,
+            type = DatasetIngestionTypeEnum.DATASETINGESTIONBYSTREAM,
+            resource_id = dset_ingest_config._id,
+            deleted = deleted
+        )
+
 
     def update_ingestion_configuration(self, ingestion_configuration=None):
         """Change the number of workers or the default policy for ingesting data on each stream
@@ -155,6 +394,9 @@ class IngestionManagementService(BaseIngestionManagementService):
         log.debug("Updating ingestion configuration")
         id, rev = self.clients.resource_registry.update(ingestion_configuration)
 
+        if self.sharded:
+            self._rebalance_shards(id, ingestion_configuration)
+
     def read_ingestion_configuration(self, ingestion_configuration_id=''):
         """Get an existing ingestion configuration object.
 
@@ -222,8 +464,13 @@ class IngestionManagementService(BaseIngestionManagementService):
         if len(transform_ids) < 1:
             raise NotFound('The ingestion configuration %s does not exist' % str(ingestion_configuration_id))
 
-        # since all ingestion worker transforms have the same subscription, only deactivate one
-        self.clients.transform_management.activate_transform(transform_ids[0])
+        if self.sharded:
+            # each worker has its own subscription
+            for transform_id in transform_ids:
+                self.clients.transform_management.activate_transform(transform_id)
+        else:
+            # since all ingestion worker transforms have the same subscription, only activate one
+            self.clients.transform_management.activate_transform(transform_ids[0])
 
         return True
 
@@ -246,8 +493,13 @@ class IngestionManagementService(BaseIngestionManagementService):
         if len(transform_ids) < 1:
             raise NotFound('The ingestion configuration %s does not exist' % str(ingestion_configuration_id))
 
-        # since all ingestion worker transforms have the same subscription, only deactivate one
-        self.clients.transform_management.deactivate_transform(transform_ids[0])
+        if self.sharded:
+            # each worker has its own subscription
+            for transform_id in transform_ids:
+                self.clients.transform_management.deactivate_transform(transform_id)
+        else:
+            # since all ingestion worker transforms have the same subscription, only deactivate one
+            self.clients.transform_management.deactivate_transform(transform_ids[0])
 
         return True
 
@@ -317,6 +569,17 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         self.clients.resource_registry.create_association(dataset_id, PRED.hasIngestionConfiguration, ingestion_configuration_id)
 
+        if self.sharded:
+            # send the config to the worker of the stream before its granules are routed to that worker
+            shards, workers, _ = self._read_shards(ingestion_configuration_id)
+            worker = shards.assign(stream_id)
+            if worker is None:
+                raise IngestionManagementServiceException('Ingestion configuration %s has no workers' % ingestion_configuration_id)
+            dset_ingest_config._id = dset_ingest_config_id
+            self._publish_dataset_config(worker, dset_ingest_config)
+            self._update_shard_streams(workers[worker][1], added=[stream_id])
+            return dset_ingest_config_id
+
         self.event_publisher.publish_event(
             origin=ingestion_configuration_id, # Use the ingestion configuration ID as the origin!
             description = dset_ingest_config.description,
@@ -350,7 +613,7 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         #@todo - what is it okay to update?
         self.event_publisher.publish_event(
-            origin=ingest_config_id,
+            origin=self._dataset_config_origin(ingest_config_id, dataset_ingestion_configuration.configuration.stream_id),
             description = dataset_ingestion_configuration.description,
             configuration = dataset_ingestion_configuration.configuration,
             type = DatasetIngestionTypeEnum.DATASETINGESTIONBYSTREAM,
@@ -392,8 +655,14 @@ class IngestionManagementService(BaseIngestionManagementService):
 
         self.clients.resource_registry.delete_association(association=association_ids[0])
 
+        stream_id = dataset_ingestion_configuration.configuration.stream_id
+        origin = self._dataset_config_origin(ingest_config_id, stream_id)
+        if origin != ingest_config_id:
+            shards, workers, _ = self._read_shards(ingest_config_id)
+            self._update_shard_streams(workers[origin][1], removed=[stream_id])
+
         self.event_publisher.publish_event(
-            origin=ingest_config_id,
+            origin=origin,
             configuration = dataset_ingestion_configuration.configuration,
             type = DatasetIngestionTypeEnum.DATASETINGESTIONBYSTREAM,
             resource_id = dataset_ingestion_configuration_id,
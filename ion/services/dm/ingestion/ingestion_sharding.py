@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+'''
+@package ion.services.dm.ingestion.ingestion_sharding
+@file ion/services/dm/ingestion/ingestion_sharding.py
+@brief Assignment of streams to ingestion workers by consistent hashing, so that all the granules of a stream are
+ingested by the same worker, in order, and only the streams of a worker move when workers are added or removed
+'''
+
+import hashlib
+from bisect import bisect, insort
+
+from gevent.coros import RLock
+
+# number of points each worker has on the ring, more points spread the streams more evenly between the workers
+DEFAULT_REPLICAS = 100
+
+# sub types of the dataset configuration events handing a stream over from one worker to another: the marker
+# published to the queues of the two workers, and the signal of the old worker to the new one once it has ingested the
+# granules queued before the marker
+HANDOFF_MARKER = 'HandoffMarker'
+HANDOFF_DRAINED = 'HandoffDrained'
+# routing key of the handoff marker of a stream, which only the queues of the two workers are bound to while the
+# stream moves, so that the other subscribers of the stream never receive it
+HANDOFF_ROUTING_KEY = '%s.handoff'
+
+
+class ConsistentHashRing(object):
+    '''
+    Each worker is hashed to several points on a ring of 64 bit integers and a key belongs to the worker of the first
+    point after the hash of the key. Adding or removing a worker only changes the worker of the keys falling next to
+    its points.
+    '''
+
+    def __init__(self, workers=(), replicas=DEFAULT_REPLICAS):
+        self.replicas = replicas
+        self.workers = set()
+        # sorted hashes of the points and point hash -> worker
+        self.points = []
+        self.owners = {}
+        for worker in workers:
+            self.add(worker)
+
+    def __len__(self):
+        return len(self.workers)
+
+    def add(self, worker):
+        if worker in self.workers:
+            return
+        self.workers.add(worker)
+        for i in xrange(self.replicas):
+            point = self._hash('%s:%d' % (worker, i))
+            # on the unlikely collision of two points the last worker added wins
+            if point not in self.owners:
+                insort(self.points, point)
+            self.owners[point] = worker
+
+    def remove(self, worker):
+        if worker not in self.workers:
+            return
+        self.workers.remove(worker)
+        for i in xrange(self.replicas):
+            point = self._hash('%s:%d' % (worker, i))
+            if self.owners.get(point) == worker:
+                del self.owners[point]
+                self.points.pop(bisect(self.points, point) - 1)
+
+    def get(self, key):
+        '''
+        Returns the worker the key belongs to, or None if there are no workers.
+        '''
+        if not self.points:
+            return None
+        index = bisect(self.points, self._hash(key)) % len(self.points)
+        return self.owners[self.points[index]]
+
+    def _hash(self, key):
+        return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class StreamShards(object):
+    '''
+    The streams ingested by a sharded ingestion configuration and the worker each one is assigned to. Adding or
+    removing workers returns the streams that changed worker as a dict of stream id -> (old worker, new worker), so
+    that the subscriptions of the workers can be updated for those streams only.
+    '''
+
+    def __init__(self, workers=(), replicas=DEFAULT_REPLICAS):
+        self.ring = ConsistentHashRing(workers, replicas)
+        # stream id -> worker
+        self.assignments = {}
+
+    def workers(self):
+        return sorted(self.ring.workers)
+
+    def restore(self, worker, stream_ids):
+        '''
+        Adds a worker along with the streams already assigned to it, without moving any stream.
+        '''
+        self.ring.add(worker)
+        for stream_id in stream_ids:
+            self.assignments[stream_id] = worker
+
+    def assign(self, stream_id):
+        '''
+        Assigns a stream to its worker and returns the worker. A stream already assigned keeps its worker.
+        '''
+        if stream_id not in self.assignments:
+            self.assignments[stream_id] = self.ring.get(stream_id)
+        return self.assignments[stream_id]
+
+    def unassign(self, stream_id):
+        return self.assignments.pop(stream_id, None)
+
+    def worker_for(self, stream_id):
+        return self.assignments.get(stream_id)
+
+    def streams_for(self, worker):
+        return sorted(stream_id for stream_id, assigned in self.assignments.iteritems() if assigned == worker)
+
+    def add_worker(self, worker):
+        self.ring.add(worker)
+        return self._rebalance()
+
+    def remove_worker(self, worker):
+        self.ring.remove(worker)
+        return self._rebalance()
+
+    def _rebalance(self):
+        moves = {}
+        for stream_id, worker in self.assignments.iteritems():
+            new_worker = self.ring.get(stream_id)
+            if new_worker != worker:
+                moves[stream_id] = (worker, new_worker)
+        for stream_id, (worker, new_worker) in moves.iteritems():
+            self.assignments[stream_id] = new_worker
+        return moves
+
+
+class StreamHandoff(object):
+    '''
+    Hands streams over between the ingestion worker it belongs to and the other workers without losing or reordering
+    granules. While a stream moves, the queues of both workers are bound to it and to its handoff routing key, and a
+    single marker published with that key reaches both queues at the same position in the stream:
+     - the old worker ingests the granules queued before the marker, then drops the dataset config of the stream and
+       signals the new worker that it has drained the stream
+     - the new worker has no dataset config for the stream before the marker, so it ignores the granules the old worker
+       ingests, then holds the granules after the marker until the old worker has drained the stream and ingests them
+       in order with the dataset config carried by the marker
+
+    ingest(packet) ingests a granule with the dataset config in configs, the dict of stream id -> config shared with
+    the worker, and signal(new_worker, stream_id, config) sends the drained signal to the new worker.
+    '''
+
+    def __init__(self, worker, configs, ingest, signal):
+        self.worker = worker
+        self.configs = configs
+        self.ingest = ingest
+        self.signal = signal
+        # stream id -> granules held until the old worker has drained the stream
+        self.held = {}
+        # stream id -> dataset config of the streams held
+        self.incoming = {}
+        # streams the old worker drained before the marker was seen here
+        self.drained = set()
+        self.lock = RLock()
+
+    def granule(self, stream_id, packet):
+        with self.lock:
+            held = self.held.get(stream_id)
+            if held is not None:
+                held.append(packet)
+                return
+            self.ingest(packet)
+
+    def marker(self, stream_id, new_worker, config):
+        with self.lock:
+            if new_worker != self.worker:
+                # this worker has ingested everything queued before the marker
+                self.configs.pop(stream_id, None)
+                self.signal(new_worker, stream_id, config)
+            elif stream_id in self.drained:
+                self.drained.discard(stream_id)
+                self.configs[stream_id] = config
+            else:
+                self.held[stream_id] = []
+                self.incoming[stream_id] = config
+
+    def stream_drained(self, stream_id):
+        with self.lock:
+            if stream_id not in self.held:
+                self.drained.add(stream_id)
+                return
+            self.configs[stream_id] = self.incoming.pop(stream_id)
+            # granules arriving meanwhile wait for the lock, behind the held ones
+            for packet in self.held.pop(stream_id):
+                self.ingest(packet)
@@ -10,7 +10,7 @@ import gevent
 from gevent.timeout import Timeout
 from pyon.util.async import spawn
 
-from mock import Mock
+from mock import Mock, patch
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition, ctd_stream_packet
 from pyon.util.unit_test import PyonTestCase
 from pyon.util.int_test import IonIntegrationTestCase
@@ -279,6 +279,66 @@ class IngestionTest(PyonTestCase):
         self.mock_find_objects.assert_called_once_with(ingestion_configuration_id, PRED.hasTransform, RT.Transform , True)
         self.mock_transform_deactivate.assert_called_once_with(transform1)
 
+    def test_activate_sharded_ingestion_configuration(self):
+        """
+        Test that every worker of a sharded ingestion configuration is activated
+        """
+        self.ingestion_service.sharded = True
+        self.mock_find_objects.return_value = ['transform1', 'transform2'], None
+
+        self.ingestion_service.activate_ingestion_configuration('ingestion_configuration_id')
+
+        self.assertEquals(self.mock_transform_activate.call_count, 2)
+        self.mock_transform_activate.assert_called_with('transform2')
+
+    def test_create_sharded_ingestion_configuration_without_workers(self):
+        """
+        Test that a sharded ingestion configuration always has a worker for its streams to be assigned to
+        """
+        self.ingestion_service.sharded = True
+        self.ingestion_service.XP = 'xp'
+        self.ingestion_service._launch_shard = Mock()
+        self.mock_create.return_value = 'ingestion_configuration_id', None
+
+        self.ingestion_service.create_ingestion_configuration(exchange_point_id=self.exchange_point_id,
+            couch_storage=self.couch_storage, hdf_storage=self.hdf_storage, number_of_workers=0)
+
+        self.assertEquals(self.ingestion_service._launch_shard.call_count, 1)
+        self.assertEquals(self.ingestion_service._launch_shard.call_args[0][:2], (1, 'ingestion_configuration_id'))
+
+    def test_move_streams_publishes_marker_to_both_workers_only(self):
+        """
+        Test that the handoff marker of a stream is published with its handoff routing key, bound to the queues of its
+        old and new workers only, and not on the stream where every subscriber of the stream would receive it
+        """
+        self.ingestion_service.XP = 'xp'
+        self.ingestion_service.container = Mock()
+        self.ingestion_service._update_shard_streams = Mock()
+        self.ingestion_service._bind_handoff = Mock()
+        dset_config = DatasetIngestionConfiguration(description='dataset config')
+        dset_config._id = 'dset_config_id'
+        dset_config.configuration.stream_id = 'stream_id'
+        self.mock_find_subjects.return_value = [dset_config], None
+        workers = {'worker_1':('transform_1', 'subscription_1'), 'worker_2':('transform_2', 'subscription_2')}
+
+        handed_over = []
+        with patch('ion.services.dm.ingestion.ingestion_management_service.Publisher') as publisher:
+            self.ingestion_service._move_streams('ingestion_configuration_id',
+                {'stream_id':('worker_1', 'worker_2'), 'other_stream_id':('worker_1', 'worker_2')}, workers, handed_over)
+
+        # only the stream with a dataset configuration is handed over
+        self.assertEquals(handed_over, ['stream_id'])
+        self.assertEquals(self.ingestion_service._bind_handoff.call_args_list,
+            [(('worker_1', 'stream_id'), {}), (('worker_2', 'stream_id'), {})])
+        self.assertEquals(publisher.return_value.publish.call_count, 1)
+        marker, = publisher.return_value.publish.call_args[0]
+        self.assertEquals(marker.sub_type, 'HandoffMarker')
+        self.assertEquals(marker.origin, 'worker_2')
+        self.assertEquals(publisher.return_value.publish.call_args[1], {'to_name':('xp', 'stream_id.handoff')})
+        args, kwargs = self.ingestion_service._update_shard_streams.call_args
+        self.assertEquals(args, ('subscription_1',))
+        self.assertEquals(sorted(kwargs['removed']), ['other_stream_id', 'stream_id'])
+
     def test_activate_ingestion_configuration_not_found(self):
         """
         Test that non existent ingestion configuration does not cause crash when attempting to activate
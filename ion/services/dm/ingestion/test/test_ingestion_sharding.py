@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+'''
+@file ion/services/dm/ingestion/test/test_ingestion_sharding.py
+@description Unit tests for the assignment of streams to ingestion workers by consistent hashing
+'''
+
+import gevent
+from gevent.queue import Queue
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.services.dm.ingestion.ingestion_sharding import ConsistentHashRing, StreamShards, StreamHandoff
+
+
+class LocalWorker(object):
+    '''
+    Ingestion worker with its own queue, recording the granules of each stream in the order it processed them.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.queue = Queue()
+        self.ingested = {}
+        self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        for stream_id, seq in self.queue:
+            self.ingested.setdefault(stream_id, []).append(seq)
+            # yield so that the workers interleave
+            gevent.sleep(0)
+
+    def stop(self):
+        self.queue.put(StopIteration)
+        self.greenlet.join()
+
+
+class HandoffWorker(object):
+    '''
+    Ingestion worker with its own queue that hands streams over with StreamHandoff, appending the granules it ingests
+    to a log shared by all the workers. The old worker signals the new one after signal_delay seconds.
+    '''
+    def __init__(self, name, workers, log, delay=0, signal_delay=0):
+        self.name = name
+        self.queue = Queue()
+        self.configs = {}
+        self.log = log
+        self.delay = delay
+        self.handoff = StreamHandoff(name, self.configs, self.ingest, self.signal)
+        self.workers = workers
+        self.signal_delay = signal_delay
+        self.greenlet = gevent.spawn(self.run)
+
+    def run(self):
+        for message in self.queue:
+            if message[0] == 'marker':
+                _, stream_id, new_worker, config = message
+                self.handoff.marker(stream_id, new_worker, config)
+            else:
+                self.handoff.granule(message[0], message)
+            gevent.sleep(self.delay)
+
+    def ingest(self, packet):
+        stream_id, seq = packet
+        # a worker without the dataset config of the stream does not ingest it
+        if stream_id in self.configs:
+            self.log.append((self.name, stream_id, seq))
+
+    def signal(self, new_worker, stream_id, config):
+        gevent.spawn_later(self.signal_delay, self.workers[new_worker].handoff.stream_drained, stream_id)
+
+    def stop(self):
+        self.queue.put(StopIteration)
+        self.greenlet.join()
+
+
+@attr('UNIT', group='dm')
+class ConsistentHashRingTest(PyonTestCase):
+
+    def test_stable_and_balanced(self):
+        ring = ConsistentHashRing(['worker_%d' % i for i in xrange(4)])
+        stream_ids = ['stream_%d' % i for i in xrange(4000)]
+
+        counts = {}
+        for stream_id in stream_ids:
+            worker = ring.get(stream_id)
+            self.assertEquals(worker, ring.get(stream_id))
+            counts[worker] = counts.get(worker, 0) + 1
+
+        self.assertEquals(len(counts), 4)
+        for count in counts.itervalues():
+            self.assertTrue(500 < count < 1500, counts)
+
+        self.assertIsNone(ConsistentHashRing().get('stream_0'))
+
+    def test_remove(self):
+        ring = ConsistentHashRing(['worker_1', 'worker_2'])
+        ring.remove('worker_1')
+        self.assertEquals(len(ring.points), ring.replicas)
+        self.assertEquals(ring.get('stream_0'), 'worker_2')
+
+
+@attr('UNIT', group='dm')
+class StreamShardsTest(PyonTestCase):
+
+    def setUp(self):
+        self.shards = StreamShards(['worker_%d' % i for i in xrange(4)])
+        self.stream_ids = ['stream_%d' % i for i in xrange(1000)]
+        for stream_id in self.stream_ids:
+            self.shards.assign(stream_id)
+
+    def test_add_worker_moves_streams_to_it_only(self):
+        before = dict(self.shards.assignments)
+        moves = self.shards.add_worker('worker_4')
+
+        for stream_id, (worker, new_worker) in moves.iteritems():
+            self.assertEquals(worker, before[stream_id])
+            self.assertEquals(new_worker, 'worker_4')
+        # about a fifth of the streams move, not all of them
+        self.assertTrue(100 < len(moves) < 350, len(moves))
+        self.assertEquals(self.shards.streams_for('worker_4'), sorted(moves))
+
+    def test_remove_worker_moves_its_streams_only(self):
+        streams = self.shards.streams_for('worker_0')
+        moves = self.shards.remove_worker('worker_0')
+
+        self.assertEquals(sorted(moves), streams)
+        for worker, new_worker in moves.itervalues():
+            self.assertEquals(worker, 'worker_0')
+            self.assertNotEquals(new_worker, 'worker_0')
+        self.assertEquals(self.shards.streams_for('worker_0'), [])
+
+    def test_restore(self):
+        shards = StreamShards()
+        for worker in self.shards.workers():
+            shards.restore(worker, self.shards.streams_for(worker))
+
+        self.assertEquals(shards.assignments, self.shards.assignments)
+        self.assertEquals(shards.add_worker('worker_4'), self.shards.add_worker('worker_4'))
+
+    def test_local_workers_ordering(self):
+        # granules of many streams, interleaved, routed to the queue of the worker of their stream
+        workers = dict((name, LocalWorker(name)) for name in self.shards.workers())
+        granules = 20
+
+        for seq in xrange(granules):
+            for stream_id in self.stream_ids:
+                workers[self.shards.worker_for(stream_id)].queue.put((stream_id, seq))
+        for worker in workers.itervalues():
+            worker.stop()
+
+        ingested = 0
+        for worker in workers.itervalues():
+            for stream_id, seqs in worker.ingested.iteritems():
+                # each stream is ingested by its worker only, in the order it was published
+                self.assertEquals(self.shards.worker_for(stream_id), worker.name)
+                self.assertEquals(seqs, range(granules))
+                ingested += len(seqs)
+        self.assertEquals(ingested, granules * len(self.stream_ids))
+
+        # the load is spread over all the workers
+        for worker in workers.itervalues():
+            share = float(sum(len(seqs) for seqs in worker.ingested.itervalues())) / ingested
+            self.assertTrue(0.1 < share < 0.4, share)
+
+    def test_rebalance_ordering(self):
+        # the old workers are slow, so granules of the moved streams are still queued when the new worker starts
+        for signal_delay in (0, 0.01):
+            shards = StreamShards(['worker_%d' % i for i in xrange(2)])
+            stream_ids = self.stream_ids[:100]
+            log = []
+            workers = {}
+            for name in shards.workers():
+                workers[name] = HandoffWorker(name, workers, log, delay=0.0005, signal_delay=signal_delay)
+            # stream id -> workers whose queue is bound to it
+            bindings = {}
+            for stream_id in stream_ids:
+                worker = shards.assign(stream_id)
+                workers[worker].configs[stream_id] = 'config'
+                bindings[stream_id] = set([worker])
+
+            def publish(stream_id, message):
+                for worker in sorted(bindings[stream_id]):
+                    workers[worker].queue.put(message)
+
+            for seq in xrange(10):
+                for stream_id in stream_ids:
+                    publish(stream_id, (stream_id, seq))
+
+            # a new worker, as the ingestion management service moves the streams
+            workers['worker_2'] = HandoffWorker('worker_2', workers, log, signal_delay=signal_delay)
+            moves = shards.add_worker('worker_2')
+            self.assertTrue(moves)
+            for stream_id, (worker, new_worker) in moves.iteritems():
+                bindings[stream_id].add(new_worker)
+                publish(stream_id, ('marker', stream_id, new_worker, 'config'))
+                bindings[stream_id].discard(worker)
+
+            for seq in xrange(10, 20):
+                for stream_id in stream_ids:
+                    publish(stream_id, (stream_id, seq))
+                gevent.sleep(0)
+
+            gevent.sleep(0.05)
+            for worker in workers.itervalues():
+                worker.stop()
+
+            for stream_id in stream_ids:
+                # every granule ingested once, in order, by the old worker then the new one
+                ingested = [(worker, seq) for worker, s, seq in log if s == stream_id]
+                self.assertEquals([seq for worker, seq in ingested], range(20))
+                if stream_id in moves:
+                    worker, new_worker = moves[stream_id]
+                    self.assertEquals(ingested[0][0], worker)
+                    self.assertEquals(ingested[-1][0], new_worker)
+                    self.assertNotIn(stream_id, workers[worker].configs)
+                    self.assertIn(stream_id, workers[new_worker].configs)
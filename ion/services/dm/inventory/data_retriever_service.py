@@ -9,7 +9,7 @@ from interface.services.dm.ireplay_process import ReplayProcessClient
 from interface.objects import Replay, ProcessDefinition, StreamDefinitionContainer
 from prototype.sci_data.constructor_apis import DefinitionTree, StreamDefinitionConstructor
 from pyon.core.exception import BadRequest, NotFound
-from pyon.public import PRED
+from pyon.public import PRED, log
 
 
 
@@ -88,6 +88,7 @@ class DataRetrieverService(BaseDataRetrieverService):
         replay._id = replay_id
         replay._rev = rev
         config = {'process':{
+            'replay_id':replay_id,
             'query':query,
             'datastore_name':datastore_name,
             'view_name':view_name,
@@ -113,8 +114,8 @@ class DataRetrieverService(BaseDataRetrieverService):
 
     def start_replay(self, replay_id=''):
         """
-        Problem: start_replay does not return until execute replay is complete - it is all chained rpc.
-        Execute replay should be a command which is fired, not RPC???
+        Starts the replay and returns at once: the replay process publishes the data in the background and reports
+        its progress with events whose origin is the replay id, see read_replay_status.
         """
 
         replay = self.clients.resource_registry.read(replay_id)
@@ -122,9 +123,41 @@ class DataRetrieverService(BaseDataRetrieverService):
         cli = ReplayProcessClient(name=pid)
         cli.execute_replay()
 
+    def pause_replay(self, replay_id=''):
+        self._replay_request(self._replay_process_id(replay_id), 'pause_replay')
+
+    def resume_replay(self, replay_id=''):
+        self._replay_request(self._replay_process_id(replay_id), 'resume_replay')
+
+    def grant_replay_credits(self, replay_id='', credits=0):
+        """
+        Lets the consumer of a replay defined with a window in its delivery format accept credits more granules.
+        """
+        self._replay_request(self._replay_process_id(replay_id), 'grant_credits', credits=credits)
+
+    def read_replay_status(self, replay_id=''):
+        """
+        Returns the state of the replay, PENDING, RUNNING, PAUSED, COMPLETE, FAILED or CANCELLED, and the number of
+        granules and bytes published so far.
+        """
+        return self._replay_request(self._replay_process_id(replay_id), 'replay_status')
+
+    def _replay_process_id(self, replay_id):
+        replay = self.clients.resource_registry.read(replay_id)
+        return replay.process_id
+
+    def _replay_request(self, process_id, op, **kwargs):
+        cli = ReplayProcessClient(name=process_id)
+        return cli.request(kwargs, op=op)
+
     def cancel_replay(self, replay_id=''):
         replay = self.clients.resource_registry.read(replay_id)
         pid = replay.process_id
+        try:
+            # the replay stops publishing and reports itself cancelled before its process is killed
+            self._replay_request(pid, 'cancel_replay')
+        except Exception:
+            log.exception('Could not cancel replay %s before stopping its process', replay_id)
         self.clients.process_dispatcher.cancel_process(pid)
 
         for pred in [PRED.hasStream]:
@@ -17,6 +17,7 @@ from pyon.public import CFG
 from interface.services.cei.iprocess_dispatcher_service import ProcessDispatcherServiceClient
 from interface.services.dm.itransform_management_service import TransformManagementServiceClient
 from ion.processes.data.replay_process import ReplayProcess
+from ion.processes.data.replay_control import ReplayControl, REPLAY_COMPLETE, REPLAY_CANCELLED
 from prototype.hdf.hdf_codec import HDFEncoder
 from prototype.sci_data.constructor_apis import DefinitionTree, PointSupplementConstructor
 from prototype.sci_data.stream_defs import SBE37_CDM_stream_definition
@@ -26,9 +27,10 @@ from interface.services.dm.idata_retriever_service import DataRetrieverServiceCl
 from interface.services.dm.idataset_management_service import DatasetManagementServiceClient
 from interface.services.dm.ipubsub_management_service import PubsubManagementServiceClient
 from ion.services.dm.inventory.data_retriever_service import DataRetrieverService
+from ion.services.ans.visualization_service import VizTransformProcForGoogleDT
 
 from nose.plugins.attrib import attr
-from mock import Mock
+from mock import Mock, patch
 import unittest, time
 import random
 import hashlib
@@ -156,6 +158,7 @@ class DataRetrieverServiceTest(PyonTestCase):
         replay = Replay()
         replay.process_id = '1'
         self.mock_rr_read.return_value = replay
+        self.data_retriever_service._replay_request = Mock()
 
         #execution
         self.data_retriever_service.cancel_replay('replay_id')
@@ -165,10 +168,154 @@ class DataRetrieverServiceTest(PyonTestCase):
         self.mock_rr_delete.assert_called_with('replay_id')
 
         self.mock_pd_cancel.assert_called_with('1')
+        self.data_retriever_service._replay_request.assert_called_with('1', 'cancel_replay')
 
 
 
 
+class PagedView(object):
+    # stands in for a couch view of the dataset, returning the rows after the start key and document id
+    def __init__(self, docs):
+        self.rows = [{'id':'doc_%02d' % i, 'key':['stream_id', 1], 'doc':doc} for i, doc in enumerate(docs)]
+        self.queries = []
+
+    def query_view(self, view_name='', opts={}):
+        self.queries.append(opts)
+        rows = self.rows
+        if 'startkey_docid' in opts:
+            ids = [row['id'] for row in rows]
+            rows = rows[ids.index(opts['startkey_docid']) + opts.get('skip', 0):]
+        return rows[:opts['limit']]
+
+
+@attr('UNIT',group='dm')
+class ReplayProcessTest(PyonTestCase):
+    def setUp(self):
+        # ten granules of ten records each and a blog post, read two documents at a time
+        self.docs = [StreamGranuleContainer() for i in xrange(10)]
+        for doc in self.docs:
+            doc.identifiables = {'count':DotDict({'value':10})}
+        self.docs.insert(3, BlogPost())
+        self.view = PagedView(self.docs)
+
+        self.replay = ReplayProcess()
+        self.replay.CFG = DotDict()
+        self.replay.container = DotDict({'datastore_manager':DotDict({'get_datastore':Mock(return_value=self.view)})})
+        self.replay.page_size = 2
+        self.replay.delivery_format = {}
+        self.replay.datastore_name = 'test_data_retriever'
+        self.replay.view_name = 'datasets/dataset_by_id'
+        self.replay.key_id = 'stream_id'
+        self.replay.element_count_id = 'count'
+        self.replay.output = Mock()
+        self.replay.event_publisher = Mock()
+        self.replay.replay_id = 'replay_id'
+
+        # the hdf side of the granules is not part of the paging
+        self.merged = []
+        self.replay._parse_granule = lambda granule: {'granule':granule}
+        self.replay._merge = self.merge
+        self.replay._slice = lambda granule, slice_: self.granule(slice_.stop - slice_.start, slice_)
+
+    def granule(self, records, slice_=None):
+        return DotDict({'identifiables':{'count':DotDict({'value':records, 'constraint':DotDict({'intervals':[]})})},
+                        'slice':slice_, 'first':len(self.merged) * 10})
+
+    def merge(self, publish_queue):
+        self.merged.append(len(publish_queue))
+        return self.granule(10 * len(publish_queue)) if publish_queue else None
+
+    def intervals(self, packets):
+        return [p.identifiables['count'].constraint.intervals for p in packets if not isinstance(p, BlogPost)]
+
+    def packets(self):
+        return self.replay._replay_packets(self.replay.datastore_name, self.replay.view_name, {'include_docs':True})
+
+    def test_replay_packets_paged(self):
+        packets = self.packets()
+        # nothing is queried before the packets are requested
+        self.assertEquals(self.view.queries, [])
+
+        packets = list(packets)
+        # the records are counted first, then one merged granule per page of two documents, the blog post published
+        # as it is
+        self.assertEquals(len(self.view.queries), 12)
+        self.assertTrue(all(query['limit'] == 2 for query in self.view.queries))
+        self.assertEquals(self.merged, [2, 1, 2, 2, 2, 1])
+        self.assertIsInstance(packets[1], BlogPost)
+        self.assertEquals([p.identifiables['count'].value for p in packets if p is not packets[1]], [20, 10, 20, 20, 20, 10])
+        # every granule carries the range of the whole replay
+        self.assertEquals(self.intervals(packets), [[[0, 99]]] * 6)
+
+    def test_time_subset_across_pages(self):
+        # records 15 to 25 of the dataset, the pages after the last one needed are not read
+        self.replay.delivery_format = {'time':(15, 25)}
+        packets = list(self.packets())
+
+        self.assertEquals([p.slice for p in packets if not isinstance(p, BlogPost)], [slice(14, 20), slice(0, 5)])
+        self.assertEquals(self.intervals(packets), [[[0, 10]]] * 2)
+        # counting stops at the upper bound as well
+        self.assertEquals(len(self.view.queries), 4)
+
+    def test_paged_replay_through_google_dt(self):
+        # a historical datatable of a replay read over several pages
+        class Parser(object):
+            def __init__(self, stream_definition=None, stream_granule=None):
+                self.granule = stream_granule
+            def list_field_names(self):
+                return ['time', 'temperature']
+            def get_values(self, field_name):
+                first = self.granule.first
+                return range(first, first + self.granule.identifiables['count'].value)
+
+        viz = VizTransformProcForGoogleDT()
+        viz.name = 'viz_transform'
+        viz.stream_def = DotDict({'data_stream_id':'data', 'identifiables':{'data':DotDict({'element_count_id':'count'})}})
+        viz.initDataTableFlag = True
+        viz.realtime_flag = False
+        viz.total_num_of_records_recvd = 0
+        viz.data_product_id_token = 'token'
+        viz.max_google_dt_len = 1000
+        viz.decimation_method = 'stride'
+        viz.decimation_variable = None
+        viz.out_stream_pub = Mock()
+
+        with patch('ion.services.ans.visualization_service.PointSupplementStreamParser', Parser):
+            for packet in self.packets():
+                if not isinstance(packet, BlogPost):
+                    viz.process(packet)
+
+        # the table is published once, when the last page is received, with the records of all the pages
+        self.assertEquals(viz.out_stream_pub.publish.call_count, 1)
+        data_table = viz.out_stream_pub.publish.call_args[0][0]['data_table']
+        self.assertEquals(data_table.count('{"c":'), 100)
+
+    def test_execute_and_cancel(self):
+        self.replay.control = ReplayControl('replay_id', publish=self.replay._publish, size=self.replay._packet_size,
+            window=3, on_progress=self.replay._publish_progress)
+
+        self.replay.execute_replay()
+        self.assertEquals(self.replay.output.publish.call_count, 0)
+
+        # the window lets three packets through
+        gevent.sleep(0.01)
+        self.assertEquals(self.replay.output.publish.call_count, 3)
+
+        self.replay.cancel_replay()
+        self.assertEquals(self.replay.control.status.state, REPLAY_CANCELLED)
+        self.assertEquals(self.replay.event_publisher.publish_event.call_args[1]['sub_type'], REPLAY_CANCELLED)
+
+    def test_execute_complete(self):
+        self.replay.control = ReplayControl('replay_id', publish=self.replay._publish, size=self.replay._packet_size,
+            on_progress=self.replay._publish_progress)
+
+        self.replay.execute_replay()
+        self.replay.control.greenlet.join(timeout=5)
+        self.assertEquals(self.replay.control.status.state, REPLAY_COMPLETE)
+        self.assertEquals(self.replay.control.status.granules, 7)
+        self.assertEquals(self.replay.output.publish.call_count, 7)
+
+
 @attr('INT', group='dm')
 class DataRetrieverServiceIntTest(IonIntegrationTestCase):
     def setUp(self):
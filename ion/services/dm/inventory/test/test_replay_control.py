@@ -0,0 +1,120 @@
+'''
+@file ion/services/dm/inventory/test/test_replay_control.py
+@description Unit tests for the background publishing of replays
+'''
+import time
+
+import gevent
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.processes.data.replay_control import ReplayControl, REPLAY_PENDING, REPLAY_RUNNING, REPLAY_PAUSED, \
+    REPLAY_COMPLETE, REPLAY_FAILED, REPLAY_CANCELLED
+
+MB = 1024 * 1024
+
+
+def granules(count, size=MB):
+    # the granules are produced as they are published, so a large replay is never held in memory
+    data = 'x' * size
+    for i in xrange(count):
+        yield data
+
+
+@attr('UNIT', group='dm')
+class ReplayControlTest(PyonTestCase):
+
+    def setUp(self):
+        self.published = []
+        self.states = []
+
+    def publish(self, packet):
+        self.published.append(len(packet))
+        # a consumer on the other end of the stream
+        gevent.sleep(0)
+
+    def progress(self, status):
+        self.states.append(status.state)
+
+    def control(self, **kwargs):
+        return ReplayControl('replay1', publish=self.publish, on_progress=self.progress, **kwargs)
+
+    def test_background(self):
+        # 2 GB replayed in 1 MB granules
+        control = self.control(progress_interval=256)
+
+        start = time.time()
+        greenlet = control.start(granules(2048))
+        self.assertLess(time.time() - start, 0.1)
+        self.assertEquals(control.status.state, REPLAY_PENDING)
+        self.assertEquals(self.published, [])
+
+        greenlet.join(timeout=30)
+        status = control.status.to_dict()
+        self.assertEquals(status['state'], REPLAY_COMPLETE)
+        self.assertEquals(status['granules'], 2048)
+        self.assertEquals(status['bytes'], 2048 * MB)
+        # running, a report every 256 granules and complete
+        self.assertEquals(self.states, [REPLAY_RUNNING] + [REPLAY_RUNNING] * 8 + [REPLAY_COMPLETE])
+
+    def test_pause_resume(self):
+        control = self.control()
+        control.start(granules(100, 10))
+        gevent.sleep(0)
+        gevent.sleep(0)
+
+        control.pause()
+        self.assertEquals(control.status.state, REPLAY_PAUSED)
+        # the granule being published when paused is finished
+        gevent.sleep(0.01)
+        count = control.status.granules
+        gevent.sleep(0.01)
+        self.assertEquals(control.status.granules, count)
+        self.assertLess(count, 100)
+
+        control.resume()
+        control.greenlet.join(timeout=5)
+        self.assertEquals(control.status.granules, 100)
+        self.assertEquals(self.states, [REPLAY_RUNNING, REPLAY_PAUSED, REPLAY_RUNNING, REPLAY_RUNNING, REPLAY_COMPLETE])
+
+    def test_flow_control(self):
+        control = self.control(window=10)
+        control.start(granules(30, 10))
+        gevent.sleep(0.01)
+        self.assertEquals(control.status.granules, 10)
+
+        control.grant(5)
+        gevent.sleep(0.01)
+        self.assertEquals(control.status.granules, 15)
+
+        control.grant(100)
+        control.greenlet.join(timeout=5)
+        self.assertEquals(control.status.state, REPLAY_COMPLETE)
+        self.assertEquals(control.status.granules, 30)
+
+    def test_cancel(self):
+        control = self.control(window=10)
+        control.start(granules(30, 10))
+        gevent.sleep(0.01)
+
+        control.cancel()
+        control.greenlet.join(timeout=5)
+        self.assertEquals(control.status.state, REPLAY_CANCELLED)
+        self.assertEquals(control.status.granules, 10)
+
+        # cancelled before it was started
+        control = self.control()
+        control.cancel()
+        self.assertEquals(self.states[-1], REPLAY_CANCELLED)
+
+    def test_failure(self):
+        def publish(packet):
+            if len(self.published) == 3:
+                raise IOError('broken')
+            self.published.append(packet)
+        control = ReplayControl('replay1', publish=publish, on_progress=self.progress)
+        control.start(granules(10, 10)).join(timeout=5)
+
+        self.assertEquals(control.status.state, REPLAY_FAILED)
+        self.assertEquals(control.status.error, 'broken')
+        self.assertEquals(control.status.granules, 3)
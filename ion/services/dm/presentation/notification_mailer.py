@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+__license__ = 'Apache 2.0'
+
+
+import string, smtplib
+from email.mime.text import MIMEText
+import gevent
+from gevent import GreenletExit
+from gevent.queue import Queue, Empty
+
+from pyon.public import get_sys_name
+from pyon.util.log import log
+
+# the 'from' email address for notification emails
+ION_NOTIFICATION_EMAIL_ADDRESS = 'ION_notifications-do-not-reply@oceanobservatories.org'
+
+# the number of persistent connections kept open to the smtp server
+DEFAULT_SMTP_POOL_SIZE = 2
+# seconds to collect events for a user before they are sent together in one email
+DEFAULT_DIGEST_WINDOW = 30.0
+# number of times sending an email is retried and the delay (doubled after each attempt) between retries
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 2.0
+
+NOTIFICATION_FOOTER = ("You received this notification from ION because you asked to be notified about this event from this source. ",
+                       "To modify or remove notifications about this event, please access My Notifications Settings in the ION Web UI.",
+                       "Do not reply to this email.  This email address is not monitored and the emails will not be read.")
+
+"""
+The NotificationMailer takes the email delivery out of the event subscriber callbacks of the UNS.  Events are queued
+per recipient and coalesced into a single digest email when more than one arrives within the digest window.  The
+emails are sent by a worker greenlet over connections taken from a pool of persistent SMTP connections, and failed
+sends are retried with an exponential backoff.  Counters for the deliveries are kept in the metrics dictionary.
+"""
+
+class SMTPConnectionPool(object):
+    # keeps up to 'size' open connections to the smtp server so they can be reused for every email
+
+    def __init__(self, smtp_server=None, size=DEFAULT_SMTP_POOL_SIZE, smtp_factory=smtplib.SMTP):
+        self.smtp_server = smtp_server
+        self.size = size
+        self.smtp_factory = smtp_factory
+        self.connections = Queue()
+        self.created = 0
+
+    def get(self):
+        try:
+            return self.connections.get_nowait()
+        except Empty:
+            pass
+        if self.created < self.size:
+            connection = self.smtp_factory(self.smtp_server)
+            self.created += 1
+            return connection
+        # all connections are in use so wait for one to be returned
+        return self.connections.get()
+
+    def put(self, connection=None):
+        self.connections.put(connection)
+
+    def discard(self, connection=None):
+        # drop a connection that failed, a new one will be opened when needed
+        self.created -= 1
+        self._close(connection)
+
+    def close_all(self):
+        while True:
+            try:
+                connection = self.connections.get_nowait()
+            except Empty:
+                break
+            self.created -= 1
+            self._close(connection)
+
+    def _close(self, connection=None):
+        try:
+            connection.quit()
+        except Exception:
+            pass
+
+
+class NotificationMailer(object):
+    # queues notification events per recipient and delivers them as (digest) emails
+
+    def __init__(self, smtp_server=None, pool_size=DEFAULT_SMTP_POOL_SIZE, digest_window=DEFAULT_DIGEST_WINDOW,
+                 max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY, smtp_factory=smtplib.SMTP):
+        self.smtp_server = smtp_server
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.pool = SMTPConnectionPool(smtp_server, pool_size, smtp_factory)
+        # email address -> list of event summaries waiting for the digest window to close
+        self.pending_events = {}
+        self.digest_timers = {}
+        # timer greenlet -> email waiting to be sent again
+        self.retry_timers = {}
+        self.outbound = Queue()
+        self.workers = []
+        self.pool_size = pool_size
+        self.metrics = {'events_queued':0,
+                        'emails_sent':0,
+                        'events_sent':0,
+                        'send_failures':0,
+                        'emails_dropped':0}
+
+    def start(self):
+        # one worker per pooled connection so the connections are used concurrently
+        for i in range(self.pool_size):
+            self.workers.append(gevent.spawn(self._send_loop))
+
+    def stop(self):
+        for timer in self.digest_timers.values():
+            timer.kill(block=False)
+        # the workers are gone before the rest is sent here; an email being sent by a worker goes back in the queue
+        for worker in self.workers:
+            worker.kill(block=True)
+        self.workers = []
+        for timer, email in self.retry_timers.items():
+            timer.kill(block=True)
+            self.outbound.put(email)
+        self.retry_timers = {}
+        # send anything that is still waiting for its digest window, a retry or in the queue before stopping, without
+        # retries
+        for email_addr in self.pending_events.keys():
+            self.flush(email_addr)
+        while True:
+            try:
+                email_addr, msg, event_count, attempt = self.outbound.get_nowait()
+            except Empty:
+                break
+            self.send(email_addr, msg, event_count, self.max_retries)
+        self.pool.close_all()
+
+    def queue_event(self, email_addr=None, event_summary=None):
+        """
+        Add an event summary (a dict with the event, origin, description and time_stamp keys) to the
+        events waiting to be sent to the email address.
+        """
+        self.metrics['events_queued'] += 1
+        self.pending_events.setdefault(email_addr, []).append(event_summary)
+        if email_addr not in self.digest_timers:
+            if self.digest_window > 0:
+                self.digest_timers[email_addr] = gevent.spawn_later(self.digest_window, self.flush, email_addr)
+            else:
+                self.flush(email_addr)
+
+    def flush(self, email_addr=None):
+        # build the email for all the events pending for the email address and queue it for delivery
+        self.digest_timers.pop(email_addr, None)
+        event_summaries = self.pending_events.pop(email_addr, None)
+        if not event_summaries:
+            return
+        msg = build_notification_email(email_addr, event_summaries)
+        self.outbound.put((email_addr, msg, len(event_summaries), 0))
+
+    def _send_loop(self):
+        while True:
+            email_addr, msg, event_count, attempt = self.outbound.get()
+            self.send(email_addr, msg, event_count, attempt)
+
+    def _retry(self, email):
+        self.retry_timers.pop(gevent.getcurrent(), None)
+        self.outbound.put(email)
+
+    def send(self, email_addr=None, msg=None, event_count=1, attempt=0):
+        log.debug("NotificationMailer.send(): sending email to %s via %s" %(email_addr, self.smtp_server))
+        connection = None
+        try:
+            connection = self.pool.get()
+            connection.sendmail(msg['From'], email_addr, msg.as_string())
+        except GreenletExit:
+            # killed by stop() while sending, the connection may be half way through the email
+            if connection is not None:
+                self.pool.discard(connection)
+            self.outbound.put((email_addr, msg, event_count, attempt))
+            raise
+        except Exception as ex:
+            self.metrics['send_failures'] += 1
+            if connection is not None:
+                self.pool.discard(connection)
+            if attempt < self.max_retries:
+                delay = self.retry_delay * (2 ** attempt)
+                log.warning("NotificationMailer.send(): failed to send email to %s, retrying in %s seconds <%s>" %(email_addr, delay, ex))
+                email = (email_addr, msg, event_count, attempt + 1)
+                self.retry_timers[gevent.spawn_later(delay, self._retry, email)] = email
+            else:
+                self.metrics['emails_dropped'] += 1
+                log.warning("NotificationMailer.send(): failed to send email to %s, giving up <%s>" %(email_addr, ex))
+            return False
+        self.pool.put(connection)
+        self.metrics['emails_sent'] += 1
+        self.metrics['events_sent'] += event_count
+        return True
+
+
+def build_notification_email(email_addr=None, event_summaries=None):
+    # builds a single email for one event or a digest email for several
+    if len(event_summaries) == 1:
+        summary = event_summaries[0]
+        SUBJECT = "(SysName: " + get_sys_name() + ") ION event " + summary['event'] + " from " + summary['origin']
+    else:
+        SUBJECT = "(SysName: " + get_sys_name() + ") ION notification digest of %d events" % len(event_summaries)
+
+    lines = []
+    for summary in event_summaries:
+        lines.extend(("Event: %s" %  summary['event'],
+                      "",
+                      "Originator: %s" %  summary['origin'],
+                      "",
+                      "Description: %s" %  summary['description'],
+                      "",
+                      "Time stamp: %s" %  summary['time_stamp'],
+                      ""))
+    lines.extend(NOTIFICATION_FOOTER)
+    BODY = string.join(lines, "\r\n")
+
+    msg = MIMEText(BODY)
+    msg['Subject'] = SUBJECT
+    msg['From'] = ION_NOTIFICATION_EMAIL_ADDRESS
+    msg['To'] = email_addr
+    return msg
@@ -6,15 +6,20 @@
 from interface.services.coi.iidentity_management_service import IdentityManagementServiceClient
 from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
 from interface.services.dm.iuser_notification_service import UserNotificationServiceClient
-from ion.services.dm.presentation.user_notification_service import UserNotificationService
+from ion.services.dm.presentation.user_notification_service import UserNotificationService, NotificationEventRouter, UserEventProcessor
+from ion.services.dm.presentation.notification_mailer import NotificationMailer
+from ion.services.dm.utility.event_history import find_events_page, count_events, define_event_count_views
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import PyonTestCase
 from pyon.public import IonObject, RT, PRED
+from pyon.core.exception import NotFound
 from nose.plugins.attrib import attr
 import unittest
 from pyon.util.log import log
 from pyon.event.event import EventPublisher
 import gevent
+from gevent.event import Event
+from mock import Mock
 
 @attr('UNIT',group='dm')
 @unittest.skip('not working')
@@ -56,6 +61,239 @@ class UserNotificationTest(PyonTestCase):
         pass
 
 
+@attr('UNIT',group='dm')
+class NotificationEventRouterTest(PyonTestCase):
+    def setUp(self):
+        self.router = NotificationEventRouter()
+        self.subscribers = []
+        def create_subscriber(event_type, origin, callback):
+            subscriber = Mock()
+            subscriber.callback = callback
+            self.subscribers.append(subscriber)
+            return subscriber
+        self.router._create_subscriber = create_subscriber
+
+    def _create_user(self, user_id):
+        user_event_processor = UserEventProcessor(user_id, user_id + '@example.com', Mock(), self.router)
+        user_event_processor.subscription_callback = Mock()
+        return user_event_processor
+
+    def test_shared_subscriber_per_filter(self):
+        users = [self._create_user('user_%d' % i) for i in range(100)]
+        for user in users:
+            user.add_notification(IonObject(RT.NotificationRequest, name="notification", origin_list=['instrument_1'], events_list=['resource_lifecycle']))
+        users[0].add_notification(IonObject(RT.NotificationRequest, name="other", origin_list=['instrument_2'], events_list=['resource_lifecycle']))
+
+        # only one subscriber for every distinct (event type, origin)
+        self.assertEquals(len(self.subscribers), 2)
+        self.assertEquals(len(self.router.routes), 2)
+
+        # an event is routed to every interested user
+        self.subscribers[0].callback('event', 'headers')
+        for user in users:
+            user.subscription_callback.assert_called_once_with('event', 'headers')
+
+        # the subscriber is stopped when the last notification for it is removed
+        for i, user in enumerate(users):
+            user.notifications[0].set_notification_id('notification_%d' % i)
+            user.remove_notification('notification_%d' % i)
+        self.assertTrue(self.subscribers[0].stop_listening.called)
+        self.assertFalse(self.subscribers[1].stop_listening.called)
+        self.assertEquals(self.router.routes.keys(), [('resource_lifecycle', 'instrument_2')])
+
+
+class StandInSMTP(object):
+    # stands in for smtplib.SMTP, records the emails sent and fails the first 'failures' sends
+    sent = []
+    connections = 0
+    failures = 0
+    # an event the sends wait for, when set
+    blocked = None
+
+    def __init__(self, host=None):
+        StandInSMTP.connections += 1
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        if StandInSMTP.blocked is not None:
+            StandInSMTP.blocked.wait()
+        if StandInSMTP.failures > 0:
+            StandInSMTP.failures -= 1
+            raise Exception('stand in smtp failure')
+        StandInSMTP.sent.append((to_addrs, msg))
+
+    def quit(self):
+        pass
+
+
+@attr('UNIT',group='dm')
+class NotificationMailerTest(PyonTestCase):
+    def setUp(self):
+        StandInSMTP.sent = []
+        StandInSMTP.connections = 0
+        StandInSMTP.failures = 0
+        StandInSMTP.blocked = None
+        self.mailer = NotificationMailer(smtp_server='localhost', pool_size=2, digest_window=0.1,
+                                         max_retries=2, retry_delay=0.01, smtp_factory=StandInSMTP)
+        self.mailer.start()
+
+    def tearDown(self):
+        self.mailer.stop()
+
+    def _event_summary(self, i):
+        return {'event':'ResourceLifecycleEvent', 'origin':'instrument_1', 'description':'event %d' % i, 'time_stamp':'now'}
+
+    def test_digest_and_connection_reuse(self):
+        for i in range(20):
+            self.mailer.queue_event('user1@example.com', self._event_summary(i))
+        self.mailer.queue_event('user2@example.com', self._event_summary(0))
+        gevent.sleep(0.3)
+
+        # the events are coalesced into one email per user
+        self.assertEquals(len(StandInSMTP.sent), 2)
+        self.assertEquals(self.mailer.metrics['events_queued'], 21)
+        self.assertEquals(self.mailer.metrics['events_sent'], 21)
+        self.assertEquals(self.mailer.metrics['emails_sent'], 2)
+        self.assertIn('digest of 20 events', dict(StandInSMTP.sent)['user1@example.com'])
+
+        for i in range(5):
+            self.mailer.queue_event('user1@example.com', self._event_summary(i))
+            gevent.sleep(0.15)
+
+        # connections are kept open and reused
+        self.assertEquals(len(StandInSMTP.sent), 7)
+        self.assertTrue(StandInSMTP.connections <= 2)
+
+    def test_retry_with_backoff(self):
+        StandInSMTP.failures = 2
+        self.mailer.queue_event('user1@example.com', self._event_summary(0))
+        gevent.sleep(0.3)
+
+        self.assertEquals(len(StandInSMTP.sent), 1)
+        self.assertEquals(self.mailer.metrics['send_failures'], 2)
+        self.assertEquals(self.mailer.metrics['emails_dropped'], 0)
+
+        StandInSMTP.failures = 3
+        self.mailer.queue_event('user1@example.com', self._event_summary(1))
+        gevent.sleep(0.3)
+
+        self.assertEquals(len(StandInSMTP.sent), 1)
+        self.assertEquals(self.mailer.metrics['emails_dropped'], 1)
+
+    def test_stop(self):
+        mailer = NotificationMailer(smtp_server='localhost', pool_size=1, digest_window=0,
+                                    max_retries=2, retry_delay=0.5, smtp_factory=StandInSMTP)
+        mailer.start()
+
+        # one email waiting for a retry
+        StandInSMTP.failures = 1
+        mailer.queue_event('user1@example.com', self._event_summary(0))
+        gevent.sleep(0.05)
+        self.assertEquals(len(mailer.retry_timers), 1)
+
+        # and one being sent by the worker when the mailer is stopped
+        StandInSMTP.blocked = Event()
+        mailer.queue_event('user2@example.com', self._event_summary(1))
+        gevent.sleep(0.05)
+        StandInSMTP.blocked = None
+        with gevent.Timeout(2):
+            mailer.stop()
+
+        self.assertEquals(sorted(to for to, msg in StandInSMTP.sent), ['user1@example.com', 'user2@example.com'])
+        self.assertEquals(mailer.retry_timers, {})
+        # no retry fires after the stop
+        gevent.sleep(0.6)
+        self.assertEquals(len(StandInSMTP.sent), 2)
+
+
+def _collate(key):
+    # couch view collation of the keys used here: strings sort before objects
+    return [(1, None) if isinstance(k, dict) else (0, k) for k in key]
+
+
+class InMemoryEventStore(object):
+    # stands in for the events datastore, with the reduce views of the event count design document
+    def __init__(self, events):
+        self.events = events
+        self.docs = {}
+
+    def read_doc(self, doc_id):
+        if doc_id not in self.docs:
+            raise NotFound(doc_id)
+        return self.docs[doc_id]
+
+    def create_doc(self, doc, object_id=None):
+        self.docs[object_id] = doc
+
+    def query_view(self, view_name, opts={}):
+        design, view = view_name.split('/')
+        assert '_design/%s' % design in self.docs and view in self.docs['_design/%s' % design]['views']
+        fields = {'by_origintype': ['origin', 'type_', 'ts_created'], 'by_origin': ['origin', 'ts_created'],
+                  'by_type': ['type_', 'ts_created'], 'by_time': ['ts_created']}[view]
+        start, end = _collate(opts['start_key']), _collate(opts['end_key'])
+        count = len([e for e in self.events if start <= _collate([getattr(e[2], f) for f in fields]) <= end])
+        return [{'key': None, 'value': count}] if count else []
+
+
+class InMemoryEventRepository(object):
+    # stands in for the container's event repository, ordering events by (origin, ts_created) like its view
+    def __init__(self):
+        self.events = []
+        self.event_store = InMemoryEventStore(self.events)
+
+    def find_events(self, event_type=None, origin=None, start_ts=None, end_ts=None, descending=False, limit=0, skip=0):
+        events = [e for e in self.events if (not origin or e[2].origin == origin) and
+                                            (not start_ts or e[2].ts_created >= start_ts) and
+                                            (not end_ts or e[2].ts_created <= end_ts)]
+        events.sort(key=lambda e: e[2].ts_created, reverse=descending)
+        events = events[skip:]
+        return events[:limit] if limit else events
+
+
+@attr('UNIT',group='dm')
+class EventHistoryTest(PyonTestCase):
+    def setUp(self):
+        self.event_repo = InMemoryEventRepository()
+        for i in range(25):
+            event = Mock()
+            event.origin = 'instrument_1'
+            event.type_ = 'ResourceLifecycleEvent' if i % 2 else 'DeviceEvent'
+            # several events share the same timestamp
+            event.ts_created = '%013d' % (1000 + i / 3)
+            self.event_repo.events.append(('event_%d' % i, [event.origin, event.ts_created], event))
+
+    def test_find_events_page(self):
+        for descending in (False, True):
+            event_ids = []
+            resume_token = None
+            pages = 0
+            while True:
+                events_list, resume_token = find_events_page(self.event_repo, origin='instrument_1', page_size=4,
+                                                             resume_token=resume_token, descending=descending)
+                self.assertTrue(len(events_list) <= 4)
+                event_ids.extend([e[0] for e in events_list])
+                pages += 1
+                if resume_token is None:
+                    break
+
+            # every event is returned exactly once and in order
+            self.assertEquals(pages, 7)
+            self.assertEquals(sorted(event_ids), sorted(['event_%d' % i for i in range(25)]))
+            self.assertEquals(event_ids, [e[0] for e in self.event_repo.find_events(descending=descending)])
+
+    def test_count_events(self):
+        define_event_count_views(self.event_repo.event_store)
+        define_event_count_views(self.event_repo.event_store)
+        self.assertEquals(len(self.event_repo.event_store.docs), 1)
+
+        self.assertEquals(count_events(self.event_repo, origin='instrument_1'), 25)
+        self.assertEquals(count_events(self.event_repo, origin='instrument_2'), 0)
+        self.assertEquals(count_events(self.event_repo, origin='instrument_1', event_type='DeviceEvent'), 13)
+        self.assertEquals(count_events(self.event_repo, event_type='ResourceLifecycleEvent'), 12)
+        # timestamps 1001 to 1003 inclusive, three events each
+        self.assertEquals(count_events(self.event_repo, min_datetime='%013d' % 1001, max_datetime='%013d' % 1003), 9)
+        self.assertEquals(count_events(self.event_repo, origin='instrument_1', min_datetime='%013d' % 1007), 4)
+
+
 @attr('INT', group='dm')
 class UserNotificationIntTest(IonIntegrationTestCase):
     def setUp(self):
@@ -4,9 +4,8 @@ __author__ = 'Bill Bollenbacher'
 __license__ = 'Apache 2.0'
 
 
-import string, smtplib, time
+import time
 from datetime import datetime
-from email.mime.text import MIMEText
 from gevent import Greenlet
 
 from pyon.core.exception import BadRequest, NotFound
@@ -16,9 +15,11 @@ from pyon.util.async import spawn
 from pyon.util.log import log
 
 from interface.services.dm.iuser_notification_service import BaseUserNotificationService
+from ion.services.dm.utility.event_history import find_events_page, count_events, define_event_count_views, \
+    DEFAULT_EVENT_PAGE_SIZE
+from ion.services.dm.presentation.notification_mailer import NotificationMailer, ION_NOTIFICATION_EMAIL_ADDRESS, \
+    DEFAULT_SMTP_POOL_SIZE, DEFAULT_DIGEST_WINDOW, DEFAULT_MAX_RETRIES, DEFAULT_RETRY_DELAY
 
-# the 'from' email address for notification emails
-ION_NOTIFICATION_EMAIL_ADDRESS = 'ION_notifications-do-not-reply@oceanobservatories.org'
 # the default smtp server
 ION_SMTP_SERVER = 'mail.oceanobservatories.org'
 
@@ -31,11 +32,14 @@ doesn't already exist , and it will be deleted when the user deletes their last
 
 The user's UserEventProcessor will encapsulate a list of notification objects that the user has requested, 
 along with user information needed for send notifications (email address for LCA).  
-It will also encapsulate a subscriber callback method that is passed to all event subscribers for each notification 
+It will also encapsulate a subscriber callback method that is called for every event matching one of the notifications 
 the user has created.
 
-Each notification object will encapsulate the notification information and a list of event subscribers (only one for LCA) 
-that listen for the events in the notification.
+Each notification object will encapsulate the notification information and the (event type, origin) pair it listens for.
+The event subscribers themselves are owned by a single NotificationEventRouter in the UNS which keeps one subscriber 
+per distinct (event type, origin) pair and routes each received event to the UserEventProcessors of all the users 
+that have a notification for it.  The number of subscribers therefore grows with the number of distinct filters and 
+not with the total number of notifications.
 """
 
 class NotificationEventSubscriber(EventSubscriber):
@@ -56,39 +60,84 @@ class NotificationEventSubscriber(EventSubscriber):
         
 
 class Notification(object):
-    # encapsulates a notification's info and it's event subscriber
+    # encapsulates a notification's info and the user event processor to route it's events to
     
-    def  __init__(self, notification=None, subscriber_callback=None):
+    def  __init__(self, notification=None, user_event_processor=None):
         self.notification = notification
-        # setup subscription using subscription_callback()
-        # TODO: make this walk the lists and set up a subscriber for every pair of
-        # origin/event.  This will require a list to hold all the subscribers so they can
-        # be started and killed
-        self.subscriber = NotificationEventSubscriber(origin=notification.origin_list[0],
-                                                      event_type=notification.events_list[0],
-                                                      callback=subscriber_callback)
+        self.user_event_processor = user_event_processor
+        # TODO: make this walk the lists and route every pair of origin/event.
+        self.event_type = notification.events_list[0]
+        self.origin = notification.origin_list[0]
         self.notification_id = None
         
     def set_notification_id(self, id=None):
         self.notification_id = id
-        
-    def start_subscriber(self):
-        self.subscriber.start_listening()
 
-    def kill_subscriber(self):
-        self.subscriber.stop_listening()
-        del self.subscriber
-        
+
+class NotificationEventRouter(object):
+    # keeps a single event subscriber for every distinct (event type, origin) pair along with the
+    # notifications that are interested in it, and routes received events to the users of those notifications
+
+    def __init__(self):
+        # (event_type, origin) -> {'subscriber': NotificationEventSubscriber, 'notifications': [Notification]}
+        self.routes = {}
+
+    def _create_subscriber(self, event_type, origin, callback):
+        return NotificationEventSubscriber(origin=origin, event_type=event_type, callback=callback)
+
+    def add_notification(self, notification=None):
+        key = (notification.event_type, notification.origin)
+        if key not in self.routes:
+            def route_callback(*args, **kwargs):
+                self.route_event(key, *args, **kwargs)
+            subscriber = self._create_subscriber(notification.event_type, notification.origin, route_callback)
+            self.routes[key] = {'subscriber':subscriber, 'notifications':[]}
+            subscriber.start_listening()
+            log.debug("NotificationEventRouter.add_notification(): started subscriber for " + str(key))
+        self.routes[key]['notifications'].append(notification)
+
+    def remove_notification(self, notification=None):
+        key = (notification.event_type, notification.origin)
+        if key not in self.routes or notification not in self.routes[key]['notifications']:
+            return
+        self.routes[key]['notifications'].remove(notification)
+        if not self.routes[key]['notifications']:
+            # stop the subscription once nobody is interested in the events anymore
+            self.routes[key]['subscriber'].stop_listening()
+            del self.routes[key]
+            log.debug("NotificationEventRouter.remove_notification(): stopped subscriber for " + str(key))
+
+    def route_event(self, key, *args, **kwargs):
+        if key not in self.routes:
+            return
+        # a user with several notifications for the same events is only notified once
+        notified_users = set()
+        for n in list(self.routes[key]['notifications']):
+            user_event_processor = n.user_event_processor
+            if user_event_processor.user_id in notified_users:
+                continue
+            notified_users.add(user_event_processor.user_id)
+            try:
+                user_event_processor.subscription_callback(*args, **kwargs)
+            except Exception as ex:
+                log.warning("NotificationEventRouter.route_event(): failed to notify user %s <%s>" %(user_event_processor.user_id, ex))
+
+    def stop_all(self):
+        for route in self.routes.itervalues():
+            route['subscriber'].stop_listening()
+        self.routes.clear()
+
 
 class UserEventProcessor(object):
     # Encapsulates the user's info and a list of all the notifications they have
     # It also contains the callback that is passed to all event subscribers for this user's notifications
     # If the callback gets called, then this user had a notification for that event.
     
-    def __init__(self, user_id=None, email_addr=None, smtp_server=None):
+    def __init__(self, user_id=None, email_addr=None, mailer=None, event_router=None):
         self.user_id = user_id
         self.user_email_addr = email_addr
-        self.smtp_server = smtp_server
+        self.mailer = mailer
+        self.event_router = event_router
         self.notifications = []
         log.debug("UserEventProcessor.__init__(): email for user %s set to %s" %(self.user_id, self.user_email_addr))
     
@@ -103,47 +152,24 @@ class UserEventProcessor(object):
         description = args[0].description
         time_stamp = str( datetime.fromtimestamp(time.mktime(time.gmtime(float(args[0].ts_created)/1000))))
 
-        # build the email from the event content
-        BODY = string.join(("Event: %s" %  event,
-                            "",
-                            "Originator: %s" %  origin,
-                            "",
-                            "Description: %s" %  description,
-                            "",
-                            "Time stamp: %s" %  time_stamp,
-                            "",
-                            "You received this notification from ION because you asked to be notified about this event from this source. ",
-                            "To modify or remove notifications about this event, please access My Notifications Settings in the ION Web UI.",
-                            "Do not reply to this email.  This email address is not monitored and the emails will not be read."), 
-                           "\r\n")
-        SUBJECT = "(SysName: " + get_sys_name() + ") ION event " + event + " from " + origin
-        FROM = ION_NOTIFICATION_EMAIL_ADDRESS
-        TO = self.user_email_addr
-        msg = MIMEText(BODY)
-        msg['Subject'] = SUBJECT
-        msg['From'] = FROM
-        msg['To'] = TO
-        log.debug("UserEventProcessor.subscription_callback(): sending email to %s via %s" %(TO, self.smtp_server))
-        try:
-            smtp_client = smtplib.SMTP(self.smtp_server)
-        except Exception as ex:
-            log.warning("UserEventProcessor.subscription_callback(): failed to connect to SMTP server %s <%s>" %(ION_SMTP_SERVER, ex))
-            return
-        try:
-            smtp_client.sendmail(FROM, TO, msg.as_string())
-        except Exception as ex:
-            log.warning("UserEventProcessor.subscription_callback(): failed to send email to %s <%s>" %(TO, ex))           
-   
+        # queue the event content for the user's next email, the mailer sends it outside of the subscriber greenlet
+        event_summary = {'event':event,
+                         'origin':origin,
+                         'description':description,
+                         'time_stamp':time_stamp}
+        log.debug("UserEventProcessor.subscription_callback(): queueing email to %s" %self.user_email_addr)
+        self.mailer.queue_event(self.user_email_addr, event_summary)
+
     def add_notification(self, notification=None):
         for n in self.notifications:
             if n.notification == notification:
                 raise BadRequest("UserEventProcessor.add_notification(): notification " + 
                                  str(notification) + " already exists for " + self.user_id)                
         # create and save notification in notifications list
-        n = Notification(notification, self.subscription_callback)
+        n = Notification(notification, self)
         self.notifications.append(n)
-        # start the event subscriber listening
-        n.start_subscriber()
+        # route the notification's events to this user
+        self.event_router.add_notification(n)
         log.debug("UserEventProcessor.add_notification(): added notification " + str(notification) + " to user " + self.user_id)
         return n
     
@@ -153,12 +179,13 @@ class UserEventProcessor(object):
         for n in self.notifications:
             if n.notification_id == notification_id:
                 self.notifications.remove(n)
-                found_notification = True  
+                found_notification = True
+                break
         if not found_notification:      
             raise BadRequest("UserEventProcessor.remove_notification(): notification " +
                              str(notification_id) + " does not exist for " + self.user_id)                
-        # stop subscription
-        n.kill_subscriber()
+        # stop routing the notification's events to this user
+        self.event_router.remove_notification(n)
         log.debug("UserEventProcessor.remove_notification(): removed notification " + str(n.notification) + " from user " + self.user_id)
         # return the number of notifications left for this user
         return len(self.notifications)
@@ -174,11 +201,24 @@ class UserNotificationService(BaseUserNotificationService):
     def __init__(self):
         # get the event repository from the CC
         self.event_repo = Container.instance.event_repository
+        # shared event subscribers for the notifications of all users
+        self.event_router = NotificationEventRouter()
         BaseUserNotificationService.__init__(self)
     
     def on_start(self):
         # get the smtp server address if configured
         self.smtp_server = self.CFG.get('smtp_server', ION_SMTP_SERVER)        
+
+        # start the mailer that delivers the notification emails for all users
+        self.mailer = NotificationMailer(smtp_server=self.smtp_server,
+                                         pool_size=self.CFG.get('smtp_pool_size', DEFAULT_SMTP_POOL_SIZE),
+                                         digest_window=self.CFG.get('email_digest_window', DEFAULT_DIGEST_WINDOW),
+                                         max_retries=self.CFG.get('email_max_retries', DEFAULT_MAX_RETRIES),
+                                         retry_delay=self.CFG.get('email_retry_delay', DEFAULT_RETRY_DELAY))
+        self.mailer.start()
+
+        # the reduce views count_events counts with
+        define_event_count_views(self.event_repo.event_store)
         
         # load event originators, types, and table
         self.event_originators = CFG.event.originators        
@@ -200,6 +240,12 @@ class UserNotificationService(BaseUserNotificationService):
             print("RT.%s=%s" %(r, str(RT[r])))        
         """
         
+    def on_quit(self):
+        # stop all the shared event subscribers
+        self.event_router.stop_all()
+        # send any pending digests and close the smtp connections
+        self.mailer.stop()
+        
     def create_notification(self, notification=None, user_id=''):
         """
         Persists the provided NotificationRequest object for the specified Origin id. 
@@ -229,7 +275,7 @@ class UserNotificationService(BaseUserNotificationService):
             if not user_info.contact.email or user_info.contact.email == '':
                 raise NotFound("UserNotificationService.create_notification(): No email address in user_info for user " + user_id)
             # create event processor for user
-            self.user_event_processors[user_id] = UserEventProcessor(user_id, user_info.contact.email, self.smtp_server)
+            self.user_event_processors[user_id] = UserEventProcessor(user_id, user_info.contact.email, self.mailer, self.event_router)
             log.debug("UserNotificationService.create_notification(): added event processor " + str(self.user_event_processors[user_id]))
         
         # add notification to user's event_processor
@@ -370,6 +416,45 @@ class UserNotificationService(BaseUserNotificationService):
                                            descending=descending,
                                            limit=limit)
 
+    def find_events_page(self, origin='', type='', min_datetime='', max_datetime='', page_size=DEFAULT_EVENT_PAGE_SIZE, resume_token='', descending=False):
+        """Returns a page of events that match the specified search criteria together with a resume token.
+        Passing the resume token back returns the next page; the returned token is None after the last page.
+
+        @param origin         str
+        @param type           str
+        @param min_datetime   str
+        @param max_datetime   str
+        @param page_size      int         (maximum number of events in the page)
+        @param resume_token   str         (token returned with the previous page, empty for the first page)
+        @param descending     boolean     (if True, reverse order (of production time) is applied, e.g. most recent first)
+        @retval event_page    tuple       (list of events, resume token)
+        @throws BadRequest    the page size or resume token is not valid
+        """
+        return find_events_page(self.event_repo,
+                                event_type=type,
+                                origin=origin,
+                                min_datetime=min_datetime,
+                                max_datetime=max_datetime,
+                                page_size=page_size,
+                                resume_token=resume_token,
+                                descending=descending)
+
+    def count_events(self, origin='', type='', min_datetime='', max_datetime=''):
+        """Returns the number of events that match the specified search criteria, counted by the events
+        datastore so the events do not have to be fetched.
+
+        @param origin         str
+        @param type           str
+        @param min_datetime   str
+        @param max_datetime   str
+        @retval count         int
+        """
+        return count_events(self.event_repo,
+                            event_type=type,
+                            origin=origin,
+                            min_datetime=min_datetime,
+                            max_datetime=max_datetime)
+
     def find_event_types_for_resource(self, resource_id=''):
         resource_object = self.clients.resource_registry.read(resource_id)
         if not resource_object:
@@ -0,0 +1,150 @@
+'''
+@file ion/services/dm/transformation/test/test_transform_pool.py
+@description Unit tests for the pool of transform instances used by execute_transform
+'''
+import time
+
+import gevent
+from gevent.event import AsyncResult
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from pyon.core.exception import Timeout
+from ion.services.dm.transformation.transform_pool import TransformPool
+
+EXECUTABLE = ('ion.processes.data.transforms.transform_example', 'ReverseTransform')
+
+
+class SlowTransform(object):
+    running = 0
+    max_running = 0
+
+    def execute(self, input):
+        SlowTransform.running += 1
+        SlowTransform.max_running = max(SlowTransform.running, SlowTransform.max_running)
+        gevent.sleep(input)
+        SlowTransform.running -= 1
+        return input
+
+
+class FailingTransform(object):
+    def execute(self, input):
+        raise ValueError(input)
+
+
+def import_per_call(module, cls, data):
+    # what execute_transform did before the pool
+    module = __import__(module, fromlist=[cls])
+    instance = getattr(module, cls)()
+    result = AsyncResult()
+    def execute(data):
+        result.set(instance.execute(data))
+    gevent.spawn(execute, data)
+    return result.get(timeout=10)
+
+
+@attr('UNIT', group='dm')
+class TransformPoolTest(PyonTestCase):
+
+    def load(self, cls):
+        def load_class(process_definition_id):
+            self.loads.append(process_definition_id)
+            return cls
+        return load_class
+
+    def setUp(self):
+        self.loads = []
+        SlowTransform.running = SlowTransform.max_running = 0
+
+    def test_instances_reused(self):
+        pool = TransformPool()
+        module = __import__(EXECUTABLE[0], fromlist=[EXECUTABLE[1]])
+        load_class = self.load(getattr(module, EXECUTABLE[1]))
+
+        for i in xrange(5):
+            self.assertEquals(pool.execute('pd1', [1, 2, 3], load_class), [3, 2, 1])
+
+        self.assertEquals(self.loads, ['pd1'])
+        self.assertEquals(pool.metrics['created'], 1)
+        self.assertEquals(pool.metrics['reused'], 4)
+
+    def test_bounded_concurrency(self):
+        pool = TransformPool(size=2)
+        load_class = self.load(SlowTransform)
+
+        calls = [gevent.spawn(pool.execute, 'pd1', 0.05, load_class) for i in xrange(6)]
+        gevent.joinall(calls)
+
+        self.assertEquals([call.value for call in calls], [0.05] * 6)
+        self.assertEquals(SlowTransform.max_running, 2)
+        self.assertEquals(pool.metrics['created'], 2)
+
+    def test_recycle_after_error(self):
+        pool = TransformPool()
+        load_class = self.load(FailingTransform)
+
+        with self.assertRaises(ValueError):
+            pool.execute('pd1', 'bad', load_class)
+        with self.assertRaises(ValueError):
+            pool.execute('pd1', 'bad', load_class)
+
+        self.assertEquals(pool.metrics['recycled'], 2)
+        self.assertEquals(pool.metrics['created'], 2)
+        self.assertEquals(pool.idle['pd1'], [])
+        self.assertEquals(self.loads, ['pd1'])
+
+    def test_clear(self):
+        pool = TransformPool()
+        self.assertEquals(pool.execute('pd1', 0, self.load(SlowTransform)), 0)
+
+        # the instance running while its process definition is cleared is not reused
+        running = gevent.spawn(pool.execute, 'pd1', 0.05, self.load(SlowTransform))
+        gevent.sleep(0)
+        pool.clear('pd1')
+        self.assertEquals(running.get(), 0.05)
+        self.assertEquals(pool.idle.get('pd1', []), [])
+
+        with self.assertRaises(ValueError):
+            pool.execute('pd1', 'bad', self.load(FailingTransform))
+        self.assertEquals(self.loads, ['pd1', 'pd1'])
+
+    def test_timeout(self):
+        pool = TransformPool(size=1)
+        load_class = self.load(SlowTransform)
+
+        with self.assertRaises(Timeout):
+            pool.execute('pd1', 1, load_class, timeout=0.05)
+        self.assertEquals(pool.metrics['recycled'], 1)
+
+        # waiting for a free instance counts in the timeout
+        slow = gevent.spawn(pool.execute, 'pd1', 0.2, load_class)
+        gevent.sleep(0)
+        with self.assertRaises(Timeout):
+            pool.execute('pd1', 0, load_class, timeout=0.05)
+        self.assertEquals(slow.get(), 0.2)
+        self.assertEquals(pool.execute('pd1', 0, load_class, timeout=0.05), 0)
+
+
+def benchmark(calls=10000):
+    '''
+    Prints the time per call of execute_transform through the pool and of the import per call path it replaces.
+    '''
+    module = __import__(EXECUTABLE[0], fromlist=[EXECUTABLE[1]])
+    cls = getattr(module, EXECUTABLE[1])
+    pool = TransformPool()
+
+    start = time.time()
+    for i in xrange(calls):
+        import_per_call(EXECUTABLE[0], EXECUTABLE[1], [1, 2, 3])
+    per_call = (time.time() - start) / calls
+
+    start = time.time()
+    for i in xrange(calls):
+        pool.execute('pd1', [1, 2, 3], lambda process_definition_id: cls)
+    pooled = (time.time() - start) / calls
+
+    print 'import per call: %.1f us, pooled: %.1f us per call' % (per_call * 1e6, pooled * 1e6)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,185 @@
+'''
+@file ion/services/dm/transformation/test/test_transform_scheduler.py
+@description Unit tests for the transform scheduler, driven by a simulated clock
+'''
+import calendar
+from datetime import datetime
+
+import gevent
+from gevent.event import Event
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+from ion.services.dm.transformation.transform_scheduler import TransformScheduler, Schedule, IntervalTrigger, \
+    CronTrigger, CATCH_UP_NONE, CATCH_UP_ONCE, CATCH_UP_ALL
+
+
+def utc(*args):
+    return calendar.timegm(datetime(*args).timetuple())
+
+
+class Clock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@attr('UNIT', group='dm')
+class TriggerTest(PyonTestCase):
+
+    def test_interval(self):
+        trigger = IntervalTrigger(60, start=30)
+        self.assertEquals(trigger.next_after(0), 30)
+        self.assertEquals(trigger.next_after(30), 90)
+        self.assertEquals(trigger.next_after(100), 150)
+        self.assertEquals(trigger.last_at(0), None)
+        self.assertEquals(trigger.last_at(90), 90)
+        self.assertEquals(trigger.last_at(149), 90)
+
+    def test_cron(self):
+        # every 15 minutes during working hours on weekdays
+        trigger = CronTrigger('*/15 9-17 * * 1-5')
+        # Friday 17:50 -> Monday 9:00
+        self.assertEquals(trigger.next_after(utc(2012, 6, 1, 17, 50)), utc(2012, 6, 4, 9, 0))
+        self.assertEquals(trigger.next_after(utc(2012, 6, 4, 9, 0)), utc(2012, 6, 4, 9, 15))
+        # Monday 8:59 -> Friday 17:45
+        self.assertEquals(trigger.last_at(utc(2012, 6, 4, 8, 59)), utc(2012, 6, 1, 17, 45))
+        self.assertEquals(trigger.last_at(utc(2012, 6, 4, 9, 15, 30)), utc(2012, 6, 4, 9, 15))
+
+        # day of month or Sunday
+        trigger = CronTrigger('0 0 1 * 0')
+        self.assertEquals(trigger.next_after(utc(2012, 6, 1, 0, 0)), utc(2012, 6, 3, 0, 0))
+        self.assertEquals(trigger.next_after(utc(2012, 6, 24, 0, 0)), utc(2012, 7, 1, 0, 0))
+
+        # end of year
+        self.assertEquals(CronTrigger('30 6 1 1 *').next_after(utc(2012, 6, 1)), utc(2013, 1, 1, 6, 30))
+        self.assertEquals(CronTrigger('30 6 1 1 *').last_at(utc(2012, 6, 1)), utc(2012, 1, 1, 6, 30))
+
+    def test_cron_invalid(self):
+        for expression in ['* * * *', '60 * * * *', '* * 0 * *', '*/0 * * * *', 'a * * * *']:
+            with self.assertRaises(ValueError):
+                CronTrigger(expression)
+        with self.assertRaises(ValueError):
+            CronTrigger('0 0 30 2 *').next_after(0)
+
+
+@attr('UNIT', group='dm')
+class TransformSchedulerTest(PyonTestCase):
+
+    def setUp(self):
+        self.clock = Clock(1000)
+        self.runs = []
+        self.saved = []
+        self.scheduler = TransformScheduler(run=self.run_transform, save=self.save, clock=self.clock, random=lambda: 0.5)
+
+    def run_transform(self, transform_id, data):
+        self.runs.append((transform_id, data, self.clock()))
+
+    def save(self, schedule):
+        self.saved.append(schedule.to_dict())
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        started = self.scheduler.tick()
+        # let the runs finish
+        gevent.sleep(0)
+        return started
+
+    def test_interval(self):
+        # due at the multiples of the interval
+        self.scheduler.add(Schedule('t1', interval=60, data='d'))
+        self.assertEquals(self.advance(19), 0)
+        self.assertEquals(self.advance(1), 1)
+        self.assertEquals(self.advance(60), 1)
+        self.assertEquals(self.runs, [('t1', 'd', 1020), ('t1', 'd', 1080)])
+        self.assertEquals(self.saved[-1]['last_run'], 1080)
+
+    def test_jitter(self):
+        self.scheduler.add(Schedule('t1', interval=60, jitter=10))
+        self.assertEquals(self.advance(24), 0)
+        self.assertEquals(self.advance(1), 1)
+        # the jitter does not move the following due times
+        self.assertEquals(self.scheduler.schedules['t1'].due_at, 1080)
+        self.assertEquals(self.scheduler.schedules['t1'].next_run, 1085)
+
+    def test_catch_up(self):
+        for transform_id, policy in [('none', CATCH_UP_NONE), ('once', CATCH_UP_ONCE), ('all', CATCH_UP_ALL)]:
+            self.scheduler.add(Schedule(transform_id, interval=60, catch_up=policy, misfire_grace=30))
+
+        # five runs missed, the last one 40 seconds ago
+        self.advance(1020 - 1000 + 4 * 60 + 40)
+        counts = dict((transform_id, len([run for run in self.runs if run[0] == transform_id]))
+                      for transform_id in ['none', 'once', 'all'])
+        self.assertEquals(counts, {'none': 0, 'once': 1, 'all': 5})
+
+        # back on time
+        for schedule in self.scheduler.schedules.itervalues():
+            self.assertEquals(schedule.due_at, 1320)
+
+    def test_long_outage(self):
+        self.scheduler.add(Schedule('t1', interval=60, catch_up=CATCH_UP_NONE, misfire_grace=30))
+        # 61 runs missed, more than max_catch_up, the last one 5 seconds ago
+        self.assertEquals(self.advance(3625), 1)
+        self.assertEquals(self.saved[-1]['last_run'], 4620)
+        self.assertEquals(self.scheduler.schedules['t1'].due_at, 4680)
+
+        with self.assertRaises(ValueError):
+            Schedule('t2', interval=60, max_catch_up=0)
+
+    def test_restart(self):
+        # the schedule saved by a previous scheduler, which last ran at 1020
+        schedule = Schedule.from_dict('t1', dict(interval=60, catch_up=CATCH_UP_ALL, last_run=1020))
+        self.clock.now = 1200
+        self.scheduler.add(schedule)
+        self.assertEquals(self.advance(0), 3)
+        self.assertEquals(self.saved[-1]['last_run'], 1200)
+
+    def test_overlap(self):
+        done = Event()
+        def run(transform_id, data):
+            self.runs.append(transform_id)
+            done.wait()
+        self.scheduler.run = run
+        self.scheduler.add(Schedule('t1', interval=60))
+
+        self.assertEquals(self.advance(20), 1)
+        # still running
+        self.assertEquals(self.advance(60), 0)
+        self.assertEquals(self.scheduler.metrics['overlaps'], 1)
+
+        done.set()
+        gevent.sleep(0)
+        self.assertEquals(self.advance(60), 1)
+        self.assertEquals(self.runs, ['t1', 't1'])
+
+    def test_failure(self):
+        def run(transform_id, data):
+            raise ValueError(transform_id)
+        self.scheduler.run = run
+        self.scheduler.add(Schedule('t1', interval=60))
+
+        self.advance(20)
+        self.advance(60)
+        self.assertEquals(self.scheduler.metrics['failures'], 2)
+        self.assertFalse(self.scheduler.schedules['t1'].running)
+
+    def test_save_failure(self):
+        def save(schedule):
+            if schedule.transform_id == 't1':
+                raise ValueError('conflict')
+            self.saved.append(schedule.to_dict())
+        self.scheduler.save = save
+        self.scheduler.add(Schedule('t1', interval=60))
+        self.scheduler.add(Schedule('t2', interval=60))
+
+        # the schedule that could not be saved does not stop the other one
+        self.assertEquals(self.advance(20), 2)
+        self.assertEquals(len(self.saved), 1)
+        self.assertEquals(self.scheduler.schedules['t1'].due_at, 1080)
+
+    def test_remove(self):
+        self.scheduler.add(Schedule('t1', cron='* * * * *'))
+        self.scheduler.remove('t1')
+        self.assertEquals(self.advance(600), 0)
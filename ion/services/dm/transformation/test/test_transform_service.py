@@ -13,7 +13,7 @@ from pyon.ion.transform import TransformDataProcess
 from pyon.util.containers import DotDict
 from pyon.public import IonObject, RT, PRED
 from pyon.util.unit_test import PyonTestCase
-from mock import Mock
+from mock import Mock, patch
 from nose.plugins.attrib import attr
 from pyon.util.int_test import IonIntegrationTestCase
 from ion.services.dm.transformation.transform_management_service import TransformManagementService
@@ -31,6 +31,10 @@ import unittest
 class TestTransform(TransformDataProcess):
     pass
 
+class DoubleTransform(object):
+    def execute(self, input):
+        return [2 * x for x in input]
+
 @attr('UNIT',group='dm')
 class TransformManagementServiceTest(PyonTestCase):
     """Unit test for TransformManagementService
@@ -288,9 +292,91 @@ class TransformManagementServiceTest(PyonTestCase):
 
 
     def test_schedule_transform(self):
-        # not implemented
-        with self.assertRaises(NotImplementedError):
-            self.transform_service.schedule_transform()
+        # mocks
+        transform = DotDict({'_id':'transform_id', 'configuration':{}})
+        self.mock_rr_read.return_value = transform
+
+        # execution
+        ret = self.transform_service.schedule_transform('transform_id', interval=60, jitter=5)
+
+        # assertions
+        self.assertTrue(ret)
+        self.assertIn('transform_id', self.transform_service.scheduler.schedules)
+        self.assertEquals(transform.configuration['schedule']['interval'], 60)
+        self.assertEquals(transform.configuration['schedule']['jitter'], 5)
+        self.mock_rr_update.assert_called_with(transform)
+
+    def test_schedule_transform_invalid(self):
+        self.mock_rr_read.return_value = DotDict({'_id':'transform_id', 'configuration':{}})
+
+        with self.assertRaises(BadRequest):
+            self.transform_service.schedule_transform('transform_id')
+        with self.assertRaises(BadRequest):
+            self.transform_service.schedule_transform('transform_id', cron='61 * * * *')
+        self.assertEquals(self.transform_service.scheduler.schedules, {})
+
+    def test_schedule_transform_not_running_schedules(self):
+        # mocks
+        transform = DotDict({'_id':'transform_id', 'configuration':{}})
+        self.mock_rr_read.return_value = transform
+        self.transform_service.run_schedules = False
+
+        # execution
+        self.transform_service.schedule_transform('transform_id', interval=60)
+
+        # assertions: the schedule is saved for the instance running the schedules, not run here
+        self.assertEquals(self.transform_service.scheduler.schedules, {})
+        self.assertEquals(transform.configuration['schedule']['interval'], 60)
+
+    def test_reload_schedule(self):
+        # mocks: another instance of the service scheduled the transform
+        transform = DotDict({'_id':'transform_id', 'configuration':{'schedule':{'interval':60, 'cron':''}}})
+        self.mock_rr_read.return_value = transform
+        event = DotDict({'origin':'transform_id', 'origin_type':RT.Transform})
+
+        # execution and assertions
+        self.transform_service._receive_resource_modified_event(event, {})
+        schedule = self.transform_service.scheduler.schedules['transform_id']
+        self.assertEquals(schedule.interval, 60)
+
+        # saving the last run leaves the schedule as it is
+        transform.configuration['schedule'] = dict(schedule.to_dict(), last_run=1000)
+        self.transform_service._receive_resource_modified_event(event, {})
+        self.assertIs(self.transform_service.scheduler.schedules['transform_id'], schedule)
+
+        transform.configuration['schedule'] = dict(schedule.to_dict(), interval=30)
+        self.transform_service._receive_resource_modified_event(event, {})
+        self.assertEquals(self.transform_service.scheduler.schedules['transform_id'].interval, 30)
+
+        transform.configuration.pop('schedule')
+        self.transform_service._receive_resource_modified_event(event, {})
+        self.assertEquals(self.transform_service.scheduler.schedules, {})
+
+    def test_run_scheduled_transform(self):
+        # mocks
+        procdef = ProcessDefinition(
+            executable={
+                'module':'ion.processes.data.transforms.transform_example',
+                'class':'ReverseTransform'}
+        )
+        self.mock_pd_read.return_value = procdef
+        def find_objects(subject, predicate, object_type=None, id_only=False):
+            if predicate == PRED.hasProcessDefinition:
+                return (['1234'], '')
+            return (['stream_1', 'stream_2'], '')
+        self.mock_rr_find.side_effect = find_objects
+        self.transform_service.container = DotDict({'node':'node'})
+
+        # execution
+        with patch('ion.services.dm.transformation.transform_management_service.StreamPublisherRegistrar') as registrar:
+            self.transform_service._run_scheduled_transform('transform_id', [1,2,3,4])
+            self.transform_service._run_scheduled_transform('transform_id', [5,6])
+
+        # assertions: the results go out on both output streams, with a publisher kept per stream
+        self.assertEquals(registrar.return_value.create_publisher.call_count, 2)
+        publisher = registrar.return_value.create_publisher.return_value
+        self.assertEquals([args[0] for args, _ in publisher.publish.call_args_list],
+                          [[4,3,2,1], [4,3,2,1], [6,5], [6,5]])
 
     def test_execute_transform(self):
         # Mocks
@@ -305,6 +391,29 @@ class TransformManagementServiceTest(PyonTestCase):
 
         self.assertEquals(retval,[4,3,2,1])
 
+    def test_execute_transform_after_process_definition_update(self):
+        # Mocks
+        self.mock_pd_read.return_value = ProcessDefinition(
+            executable={
+                'module':'ion.processes.data.transforms.transform_example',
+                'class':'ReverseTransform'}
+        )
+        self.assertEquals(self.transform_service.execute_transform('1234',[1,2,3,4]), [4,3,2,1])
+
+        # the process definition now runs another class
+        self.mock_pd_read.return_value = ProcessDefinition(
+            executable={
+                'module':'ion.services.dm.transformation.test.test_transform_service',
+                'class':'DoubleTransform'}
+        )
+        # other resources leave the loaded class alone
+        self.transform_service._receive_resource_modified_event(DotDict(origin='1234', origin_type=RT.Stream), {})
+        self.assertEquals(self.transform_service.execute_transform('1234',[1,2,3,4]), [4,3,2,1])
+
+        self.transform_service._receive_resource_modified_event(DotDict(origin='1234', origin_type=RT.ProcessDefinition), {})
+        self.assertEquals(self.transform_service.execute_transform('1234',[1,2,3,4]), [2,4,6,8])
+        self.assertEquals(self.mock_pd_read.call_count, 2)
+
 
 @attr('INT', group='dm')
 class TransformManagementServiceIntTest(IonIntegrationTestCase):
@@ -4,12 +4,14 @@
 @file ion/services/dm/transformation/transform_management_service.py
 @description Implementation for TransformManagementService
 '''
-from pyon.public import log, RT, PRED
+from pyon.public import log, RT, PRED, StreamPublisherRegistrar
 from pyon.core.exception import BadRequest, NotFound
 from pyon.core.object import IonObjectSerializer, IonObjectBase
+from pyon.event.event import EventSubscriber
 from interface.services.dm.itransform_management_service import BaseTransformManagementService
-import gevent
 from interface.objects import Transform
+from ion.services.dm.transformation.transform_pool import TransformPool, DEFAULT_POOL_SIZE, DEFAULT_EXECUTE_TIMEOUT
+from ion.services.dm.transformation.transform_scheduler import TransformScheduler, Schedule, CATCH_UP_ONCE, DEFAULT_MISFIRE_GRACE
 
 class TransformManagementService(BaseTransformManagementService):
     """Provides the main orchestration for stream processing
@@ -21,15 +23,86 @@ class TransformManagementService(BaseTransformManagementService):
         BaseTransformManagementService.__init__(self)
 
         self.serializer = IonObjectSerializer()
+        self.transform_pool = TransformPool()
+        self.scheduler = TransformScheduler(run=self._run_scheduled_transform, save=self._save_schedule)
+        # stream id -> publisher of the results of the scheduled runs
+        self._publishers = {}
+        self.event_subscriber = None
+        # whether this instance runs the scheduled transforms, see on_start
+        self.run_schedules = True
 
     def on_start(self):
         super(TransformManagementService,self).on_start()
+        self.transform_pool.size = self.CFG.get_safe('service.transform_management.pool_size', DEFAULT_POOL_SIZE)
+        self.transform_pool.timeout = self.CFG.get_safe('service.transform_management.execute_timeout', DEFAULT_EXECUTE_TIMEOUT)
+
+        #Listen for changes made to process definitions and drop the transform classes loaded for them, and for
+        #changes made to transforms to pick up the schedules set through other instances of the service
+        self.event_subscriber = EventSubscriber(
+            event_type="ResourceModifiedEvent",
+            callback=self._receive_resource_modified_event
+        )
+        self.event_subscriber.activate()
+
         restart_flag = self.CFG.get_safe('service.transform_management.restart', False)
         if restart_flag:
             transform_ids, meta = self.clients.resource_registry.find_resources(restype=RT.Transform, id_only=True)
             for transform_id in transform_ids:
                 self._restart_transform(transform_id)
 
+        # The schedules are kept in the configuration of the transform resources and only one instance of the
+        # service may run them, or every instance would run each transform. With more than one instance, all but
+        # one are configured with run_schedules false; they save the schedules set through them and the running
+        # instance picks them up from the ResourceModifiedEvent of the transform.
+        self.run_schedules = self.CFG.get_safe('service.transform_management.run_schedules', True)
+        if not self.run_schedules:
+            return
+        transforms, _ = self.clients.resource_registry.find_resources(restype=RT.Transform, id_only=False)
+        for transform in transforms:
+            schedule = (transform.configuration or {}).get('schedule')
+            if schedule:
+                try:
+                    self.scheduler.add(Schedule.from_dict(transform._id, schedule))
+                except (ValueError, TypeError):
+                    log.exception('Invalid schedule for transform %s', transform._id)
+        self.scheduler.start()
+
+    def on_quit(self):
+        self.scheduler.stop()
+        if self.event_subscriber is not None:
+            self.event_subscriber.deactivate()
+        super(TransformManagementService,self).on_quit()
+
+    def _receive_resource_modified_event(self, event_msg, headers):
+        if event_msg.origin_type == RT.ProcessDefinition:
+            self.transform_pool.clear(event_msg.origin)
+        elif event_msg.origin_type == RT.Transform and self.run_schedules:
+            self._reload_schedule(event_msg.origin)
+
+    def _reload_schedule(self, transform_id):
+        """
+        Brings the schedule of a transform in line with the one saved in its configuration, which another instance
+        of the service may have set or removed. Saving the last run time of a schedule leaves it as it is.
+        """
+        try:
+            transform = self.clients.resource_registry.read(transform_id)
+            schedule_def = (transform.configuration or {}).get('schedule')
+        except NotFound:
+            schedule_def = None
+        if not schedule_def:
+            self.scheduler.remove(transform_id)
+            return
+
+        schedule = self.scheduler.schedules.get(transform_id)
+        if schedule is not None:
+            current = schedule.to_dict()
+            if all(current.get(str(k)) == v for k, v in schedule_def.iteritems() if k != 'last_run'):
+                return
+        try:
+            self.scheduler.add(Schedule.from_dict(transform_id, schedule_def))
+        except (ValueError, TypeError):
+            log.exception('Invalid schedule for transform %s', transform_id)
+
     def _restart_transform(self, transform_id):
         transform = self.clients.resource_registry.read(transform_id)
         configuration = transform.configuration
@@ -187,6 +260,7 @@ class TransformManagementService(BaseTransformManagementService):
         # get the transform resource (also verifies it's existence before continuing)
         transform_res = self.read_transform(transform_id=transform_id)
         pid = transform_res.process_id
+        self.scheduler.remove(transform_id)
 
         # get the resources
         process_definition_ids, _ = self.clients.resource_registry.find_objects(transform_id,
@@ -198,6 +272,8 @@ class TransformManagementService(BaseTransformManagementService):
 
         # build a list of all the ids above
         id_list = process_definition_ids + in_subscription_ids + out_stream_ids
+        for stream_id in out_stream_ids:
+            self._publishers.pop(stream_id, None)
 
         # stop the transform process
 
@@ -229,27 +305,21 @@ class TransformManagementService(BaseTransformManagementService):
 # ---------------------------------------------------------------------------
 
     def execute_transform(self, process_definition_id='', data=None, configuration=None):
+        """Runs the transform function of the process definition on data and returns the result. The transform
+        instances are kept warm in the transform pool between calls.
+        @param configuration may hold a 'timeout' in seconds for this call
+        @throws Timeout if the transform did not return in time
+        """
+        timeout = (configuration or {}).get('timeout')
+        return self.transform_pool.execute(process_definition_id, data, self._load_transform_class, timeout)
+
+    def _load_transform_class(self, process_definition_id):
         process_definition = self.clients.process_dispatcher.read_process_definition(process_definition_id)
         module = process_definition.executable.get('module')
         cls = process_definition.executable.get('class')
 
-
-
         module = __import__(module, fromlist=[cls])
-        cls = getattr(module,cls)
-        instance = cls()
-
-        result = gevent.event.AsyncResult()
-        def execute(data):
-            result.set(instance.execute(data))
-
-        g = gevent.greenlet.Greenlet(execute, data)
-        g.start()
-
-        retval = result.get(timeout=10)
-
-
-        return retval
+        return getattr(module,cls)
 
 
     def activate_transform(self, transform_id=''):
@@ -287,11 +357,78 @@ class TransformManagementService(BaseTransformManagementService):
 
 
 
-    def schedule_transform(self, transform_id=''):
-        """Not currently implemented
-        @throws NotImplementedError
+    def schedule_transform(self, transform_id='', interval=0, cron='', catch_up=CATCH_UP_ONCE, jitter=0,
+                           misfire_grace=DEFAULT_MISFIRE_GRACE, data=None):
+        """Runs the transform function of the transform's process definition on data every interval seconds, or at
+        the times of a cron expression (minute hour day month weekday, UTC). The schedule is saved with the transform
+        so that it survives a restart; the runs missed in between are caught up according to catch_up ('none', 'once'
+        or 'all'). A run is skipped if the previous one has not returned yet. What the transform function returns, if
+        not None, is published on the output streams of the transform.
+        The transforms are run by the one instance of the service configured with run_schedules, the others only
+        save the schedule.
+        Without interval and cron the schedule in the configuration of the transform is used.
+        @param jitter the runs are delayed by up to jitter seconds
+        @throws NotFound if the transform does not exist
+        @throws BadRequest if the schedule is not valid
         """
-        raise NotImplementedError
+        transform = self.read_transform(transform_id=transform_id)
+        configuration = transform.configuration or {}
+
+        if interval or cron:
+            schedule_def = dict(interval=interval, cron=cron, catch_up=catch_up, jitter=jitter,
+                                misfire_grace=misfire_grace, data=data)
+        else:
+            schedule_def = configuration.get('schedule')
+            if not schedule_def:
+                raise BadRequest('No interval or cron expression to schedule transform %s' % transform_id)
+        try:
+            schedule = Schedule.from_dict(transform_id, schedule_def)
+        except (ValueError, TypeError) as e:
+            raise BadRequest('Invalid schedule for transform %s: %s' % (transform_id, e))
+
+        if self.run_schedules:
+            self.scheduler.add(schedule)
+        self._save_schedule(schedule)
+        return True
 
+    def unschedule_transform(self, transform_id=''):
+        """Stops running a scheduled transform
+        @throws NotFound if the transform is not scheduled
+        """
+        removed = self.scheduler.remove(transform_id)
+        transform = self.clients.resource_registry.read(transform_id)
+        # the schedule may be run by another instance of the service
+        if removed is None and not (transform.configuration or {}).get('schedule'):
+            raise NotFound('Transform %s is not scheduled' % transform_id)
+        transform.configuration.pop('schedule', None)
+        self.clients.resource_registry.update(transform)
+        return True
+
+    def _save_schedule(self, schedule):
+        transform = self.clients.resource_registry.read(schedule.transform_id)
+        if transform.configuration is None:
+            transform.configuration = {}
+        transform.configuration['schedule'] = schedule.to_dict()
+        self.clients.resource_registry.update(transform)
+
+    def _run_scheduled_transform(self, transform_id, data):
+        proc_def_ids, _ = self.clients.resource_registry.find_objects(subject=transform_id,
+                                predicate=PRED.hasProcessDefinition, id_only=True)
+        if len(proc_def_ids) < 1:
+            raise NotFound('Transform %s has no process definition' % transform_id)
+        retval = self.transform_pool.execute(proc_def_ids[0], data, self._load_transform_class)
+        if retval is None:
+            return
+
+        # the result is published on the output streams of the transform, like the results of its process
+        stream_ids, _ = self.clients.resource_registry.find_objects(transform_id, PRED.hasOutStream, RT.Stream, True)
+        if not stream_ids:
+            log.warning('Transform %s has no output stream, the result of its scheduled run is dropped', transform_id)
+            return
+        for stream_id in stream_ids:
+            if stream_id not in self._publishers:
+                registrar = StreamPublisherRegistrar(process=self, node=self.container.node)
+                self._publishers[stream_id] = registrar.create_publisher(stream_id=stream_id)
+            self._publishers[stream_id].publish(retval)
 
 
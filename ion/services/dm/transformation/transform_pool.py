@@ -0,0 +1,108 @@
+'''
+@file ion/services/dm/transformation/transform_pool.py
+@description Warm instances of the transform functions run by TransformManagementService.execute_transform
+'''
+import time
+
+import gevent
+from gevent.coros import BoundedSemaphore
+
+from pyon.core.exception import Timeout
+from pyon.public import log
+
+# maximum number of calls running at the same time for one process definition, each on its own instance
+DEFAULT_POOL_SIZE = 4
+# seconds a call may take, including the time spent waiting for an instance
+DEFAULT_EXECUTE_TIMEOUT = 10
+
+
+class TransformPool(object):
+    '''
+    Keeps instances of the transform function class of each process definition so that the module is imported and
+    the class instantiated once, not on every call. At most size calls run at the same time for a process definition,
+    the others wait for an instance to be free. An instance whose call raised or timed out is dropped and a new one
+    is created on the next call, so a transform left in a bad state is not reused. The class of a process definition
+    is kept until clear is called for it, which its owner does when the process definition is updated or deleted.
+    '''
+    def __init__(self, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_EXECUTE_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        # process definition id -> transform class
+        self.classes = {}
+        # process definition id -> list of idle instances
+        self.idle = {}
+        # process definition id -> semaphore bounding the calls running at the same time
+        self.slots = {}
+        self.metrics = {'created': 0, 'reused': 0, 'recycled': 0, 'timeouts': 0}
+
+    def execute(self, process_definition_id, data, load_class, timeout=None):
+        '''
+        Runs the transform of the process definition on data and returns its result.
+        @param load_class called with the process definition id the first time it is used, returns the transform class
+        @param timeout seconds, the pool timeout by default
+        @throws Timeout if no instance was free or the transform did not return in time
+        '''
+        timeout = timeout or self.timeout
+        slots = self.slots.get(process_definition_id)
+        if slots is None:
+            slots = self.slots[process_definition_id] = BoundedSemaphore(self.size)
+
+        deadline = time.time() + timeout
+        if not slots.acquire(timeout=timeout):
+            self.metrics['timeouts'] += 1
+            raise Timeout('No instance of the transform %s was free within %s seconds' % (process_definition_id, timeout))
+
+        try:
+            instance = self._checkout(process_definition_id, load_class)
+
+            # the transform runs in the calling greenlet, the timer interrupts it when it yields past the deadline
+            timer = gevent.Timeout(max(deadline - time.time(), 0))
+            timer.start()
+            try:
+                retval = instance.execute(data)
+            except gevent.Timeout as t:
+                if t is not timer:
+                    raise
+                self._recycle(process_definition_id)
+                self.metrics['timeouts'] += 1
+                raise Timeout('The transform %s did not return within %s seconds' % (process_definition_id, timeout))
+            except Exception:
+                self._recycle(process_definition_id)
+                raise
+            finally:
+                timer.cancel()
+
+            # an instance of a class dropped by clear during the call is not reused
+            if type(instance) is self.classes.get(process_definition_id):
+                self.idle.setdefault(process_definition_id, []).append(instance)
+            return retval
+        finally:
+            slots.release()
+
+    def clear(self, process_definition_id=None):
+        '''
+        Drops the instances and class of a process definition, or of all of them, so they are loaded again. The
+        instances running a call are dropped when it returns.
+        '''
+        if process_definition_id is None:
+            self.classes.clear()
+            self.idle.clear()
+        else:
+            self.classes.pop(process_definition_id, None)
+            self.idle.pop(process_definition_id, None)
+
+    def _checkout(self, process_definition_id, load_class):
+        idle = self.idle.setdefault(process_definition_id, [])
+        if idle:
+            self.metrics['reused'] += 1
+            return idle.pop()
+
+        cls = self.classes.get(process_definition_id)
+        if cls is None:
+            cls = self.classes[process_definition_id] = load_class(process_definition_id)
+        self.metrics['created'] += 1
+        return cls()
+
+    def _recycle(self, process_definition_id):
+        log.debug('Dropping an instance of transform %s after a failed call', process_definition_id)
+        self.metrics['recycled'] += 1
@@ -0,0 +1,291 @@
+'''
+@file ion/services/dm/transformation/transform_scheduler.py
+@description Time based scheduler running transforms at fixed intervals or at the times of a cron expression
+'''
+import time
+import random
+import calendar
+from datetime import datetime, timedelta
+
+import gevent
+
+from pyon.public import log
+
+# what is done with the runs missed while the scheduler was not running or late
+CATCH_UP_NONE = 'none'  # dropped, only a run late by less than misfire_grace seconds happens
+CATCH_UP_ONCE = 'once'  # a single run for all of them
+CATCH_UP_ALL = 'all'    # one run for each, up to max_catch_up
+CATCH_UP_POLICIES = (CATCH_UP_NONE, CATCH_UP_ONCE, CATCH_UP_ALL)
+
+DEFAULT_MISFIRE_GRACE = 60
+DEFAULT_MAX_CATCH_UP = 10
+# longest time the scheduler sleeps before looking at the schedules again, so that new schedules are seen
+DEFAULT_POLL_INTERVAL = 1
+
+# minute, hour, day of month, month, day of week (0 or 7 is Sunday)
+CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+# a cron expression without a match within this many years never matches, like 0 0 30 2 *
+CRON_MAX_YEARS = 5
+
+
+class IntervalTrigger(object):
+    '''
+    Fires every interval seconds, at start + k * interval. next_after(t) is the first time it fires after t and
+    last_at(t) the last time it fires at or before t, None if it never did.
+    '''
+    def __init__(self, interval, start=0):
+        if interval <= 0:
+            raise ValueError('The interval must be positive: %s' % interval)
+        self.interval = interval
+        self.start = start
+
+    def next_after(self, t):
+        if t < self.start:
+            return self.start
+        return self.start + (int((t - self.start) // self.interval) + 1) * self.interval
+
+    def last_at(self, t):
+        if t < self.start:
+            return None
+        return self.start + int((t - self.start) // self.interval) * self.interval
+
+
+class CronTrigger(object):
+    '''
+    Fires at the minutes (UTC) matching a five field cron expression: minute, hour, day of month, month and day of
+    week. Each field is *, a value, a range a-b, a step */n or a-b/n, or a comma separated list of those. As in cron,
+    when both the day of month and the day of week are restricted a day matching either one matches.
+    '''
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError('A cron expression has five fields: %s' % expression)
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            self._parse(field, low, high) for field, (low, high) in zip(fields, CRON_FIELDS)]
+        if 7 in self.weekdays:
+            self.weekdays.add(0)
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def _parse(self, field, low, high):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = [int(v) for v in part.split('-')]
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError('Invalid cron field: %s' % field)
+            values.update(xrange(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt):
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day or weekday
+        return day and weekday
+
+    def next_after(self, t):
+        # the first whole minute after t
+        dt = datetime.utcfromtimestamp((int(t) // 60 + 1) * 60)
+        last_year = dt.year + CRON_MAX_YEARS
+        while dt.year <= last_year:
+            if dt.month not in self.months:
+                if dt.month == 12:
+                    dt = dt.replace(year=dt.year + 1, month=1, day=1, hour=0, minute=0)
+                else:
+                    dt = dt.replace(month=dt.month + 1, day=1, hour=0, minute=0)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return calendar.timegm(dt.timetuple())
+        raise ValueError('The cron expression %s never matches' % self.expression)
+
+    def last_at(self, t):
+        # the whole minute of t, searching back the same way next_after searches forward
+        dt = datetime.utcfromtimestamp(int(t) // 60 * 60)
+        first_year = dt.year - CRON_MAX_YEARS
+        minute = timedelta(minutes=1)
+        while dt.year >= first_year:
+            if dt.month not in self.months:
+                dt = dt.replace(day=1, hour=0, minute=0) - minute
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) - minute
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) - minute
+            elif dt.minute not in self.minutes:
+                dt -= minute
+            else:
+                return calendar.timegm(dt.timetuple())
+        return None
+
+
+class Schedule(object):
+    '''
+    When a transform runs. due_at is the next time given by the trigger and next_run the time it actually runs, up
+    to jitter seconds later so that transforms scheduled at the same time do not all start together.
+    '''
+    def __init__(self, transform_id, interval=0, cron='', start=0, catch_up=CATCH_UP_ONCE, jitter=0,
+                 misfire_grace=DEFAULT_MISFIRE_GRACE, max_catch_up=DEFAULT_MAX_CATCH_UP, data=None, last_run=None):
+        if bool(interval) == bool(cron):
+            raise ValueError('A schedule needs either an interval or a cron expression')
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError('Unknown catch up policy: %s' % catch_up)
+        if max_catch_up < 1:
+            raise ValueError('max_catch_up must be at least 1: %s' % max_catch_up)
+        self.transform_id = transform_id
+        self.interval = interval
+        self.cron = cron
+        self.start = start
+        self.catch_up = catch_up
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.max_catch_up = max_catch_up
+        self.data = data
+        # due time of the last run, kept in the resource registry to catch up after a restart
+        self.last_run = last_run
+        self.trigger = IntervalTrigger(interval, start) if interval else CronTrigger(cron)
+        self.due_at = None
+        self.next_run = None
+        self.running = False
+
+    def to_dict(self):
+        return dict(interval=self.interval, cron=self.cron, start=self.start, catch_up=self.catch_up,
+                    jitter=self.jitter, misfire_grace=self.misfire_grace, max_catch_up=self.max_catch_up,
+                    data=self.data, last_run=self.last_run)
+
+    @classmethod
+    def from_dict(cls, transform_id, d):
+        return cls(transform_id, **dict((str(k), v) for k, v in d.iteritems()))
+
+
+class TransformScheduler(object):
+    '''
+    Runs the scheduled transforms. Each run calls run(transform_id, data) in its own greenlet; a transform still
+    running when it is due again is not started a second time and that run is skipped. After each run is started
+    the schedule is passed to save so that its last run time is persisted; a failure to save is logged. The clock is
+    a parameter so that the scheduler can be driven by a simulated clock, calling tick() instead of start().
+    '''
+    def __init__(self, run, save=None, clock=time.time, random=random.random, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.run = run
+        self.save = save
+        self.clock = clock
+        self.random = random
+        self.poll_interval = poll_interval
+        # transform id -> Schedule
+        self.schedules = {}
+        self.metrics = {'runs': 0, 'failures': 0, 'overlaps': 0, 'missed': 0}
+        self._greenlet = None
+
+    def add(self, schedule):
+        now = self.clock()
+        if schedule.last_run is not None:
+            # runs missed since the last one are caught up on the next tick
+            schedule.due_at = schedule.trigger.next_after(schedule.last_run)
+        else:
+            schedule.due_at = schedule.trigger.next_after(now)
+        self._set_next_run(schedule)
+        self.schedules[schedule.transform_id] = schedule
+
+    def remove(self, transform_id):
+        return self.schedules.pop(transform_id, None)
+
+    def tick(self):
+        '''
+        Starts the transforms that are due and returns the number of runs started.
+        '''
+        now = self.clock()
+        started = 0
+        for schedule in self.schedules.values():
+            if schedule.next_run > now:
+                continue
+
+            # the due times missed up to now, at most max_catch_up of them, and the latest one, which is later than
+            # those when more were missed
+            due = []
+            t = schedule.due_at
+            while t <= now and len(due) < schedule.max_catch_up:
+                due.append(t)
+                t = schedule.trigger.next_after(t)
+            latest = due[-1]
+            if t <= now:
+                latest = schedule.trigger.last_at(now)
+                t = schedule.trigger.next_after(now)
+
+            if schedule.catch_up == CATCH_UP_ALL:
+                runs = len(due)
+            elif schedule.catch_up == CATCH_UP_ONCE:
+                runs = 1
+            else:
+                runs = 1 if now - latest <= schedule.misfire_grace else 0
+            self.metrics['missed'] += len(due) - runs
+
+            schedule.due_at = t
+            self._set_next_run(schedule)
+
+            if schedule.running:
+                log.info('Transform %s is still running, skipping its scheduled run', schedule.transform_id)
+                self.metrics['overlaps'] += 1
+                continue
+
+            schedule.last_run = latest
+            if runs:
+                self._start(schedule, runs)
+                started += runs
+            if self.save is not None:
+                # a schedule that cannot be saved, for instance on a conflicting update, is saved again after its next
+                # run; the other schedules are not held up
+                try:
+                    self.save(schedule)
+                except Exception:
+                    log.exception('Could not save the schedule of transform %s', schedule.transform_id)
+        return started
+
+    def start(self):
+        self._greenlet = gevent.spawn(self._loop)
+
+    def stop(self):
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _loop(self):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                log.exception('Error running the scheduled transforms')
+            next_runs = [schedule.next_run for schedule in self.schedules.itervalues()]
+            wait = min(next_runs) - self.clock() if next_runs else self.poll_interval
+            gevent.sleep(min(max(wait, 0), self.poll_interval))
+
+    def _set_next_run(self, schedule):
+        schedule.next_run = schedule.due_at + (schedule.jitter * self.random() if schedule.jitter else 0)
+
+    def _start(self, schedule, runs):
+        schedule.running = True
+        def run():
+            try:
+                for i in xrange(runs):
+                    self.metrics['runs'] += 1
+                    try:
+                        self.run(schedule.transform_id, schedule.data)
+                    except Exception:
+                        self.metrics['failures'] += 1
+                        log.exception('Scheduled run of transform %s failed', schedule.transform_id)
+            finally:
+                schedule.running = False
+        gevent.spawn(run)
@@ -0,0 +1,103 @@
+'''
+@file ion/services/dm/utility/event_history.py
+@description Cursor based paging and counting of event history queries against the event repository
+'''
+
+from pyon.core.exception import BadRequest, NotFound
+
+DEFAULT_EVENT_PAGE_SIZE = 100
+
+# Design document with _count reduce views over the events, so that counting returns a number instead of the events
+EVENT_COUNT_DESIGN = 'event_count'
+EVENT_COUNT_VIEWS = {
+    'by_origintype': "function(doc) { if (doc.origin && doc.type_) emit([doc.origin, doc.type_, doc.ts_created], null); }",
+    'by_origin': "function(doc) { if (doc.origin) emit([doc.origin, doc.ts_created], null); }",
+    'by_type': "function(doc) { if (doc.type_ && doc.origin !== undefined) emit([doc.type_, doc.ts_created], null); }",
+    'by_time': "function(doc) { if (doc.origin !== undefined) emit([doc.ts_created], null); }",
+}
+
+
+def encode_resume_token(ts, skip):
+    ''' The resume token holds the timestamp of the last event returned and the number of events
+    with that same timestamp that were already returned.
+    '''
+    return '%s_%d' % (ts, skip)
+
+def decode_resume_token(resume_token):
+    try:
+        ts, skip = resume_token.rsplit('_', 1)
+        return ts, int(skip)
+    except (AttributeError, ValueError):
+        raise BadRequest('Invalid resume token: %s' % resume_token)
+
+def find_events_page(event_repo, event_type=None, origin=None, min_datetime=None, max_datetime=None,
+                     page_size=DEFAULT_EVENT_PAGE_SIZE, resume_token=None, descending=False):
+    ''' Returns a page of at most page_size events and the resume token to retrieve the next page with, which is
+    None when there are no more events.
+
+    Instead of skipping over an offset, the next page query starts at the timestamp of the last event returned so
+    that the events datastore view is entered at that key. Only the events sharing that timestamp are skipped.
+    '''
+    if page_size < 1:
+        raise BadRequest('The page_size must be at least 1')
+
+    start_ts, end_ts = min_datetime, max_datetime
+    skip = 0
+    if resume_token:
+        last_ts, skip = decode_resume_token(resume_token)
+        if descending:
+            end_ts = last_ts
+        else:
+            start_ts = last_ts
+
+    # one extra event tells if there is a next page
+    events_list = event_repo.find_events(event_type=event_type, origin=origin, start_ts=start_ts, end_ts=end_ts,
+                                         descending=descending, limit=page_size + 1, skip=skip)
+
+    if len(events_list) <= page_size:
+        return events_list, None
+
+    events_list = events_list[:page_size]
+
+    last_ts = events_list[-1][2].ts_created
+    same_ts = 0
+    for event_id, event_key, event in reversed(events_list):
+        if event.ts_created != last_ts:
+            break
+        same_ts += 1
+    # the whole page shares the timestamp of the previous cursor, so keep skipping over those events too
+    if same_ts == len(events_list) and resume_token and last_ts == decode_resume_token(resume_token)[0]:
+        same_ts += skip
+
+    return events_list, encode_resume_token(last_ts, same_ts)
+
+def define_event_count_views(event_store):
+    ''' Creates the design document of the event count views in the events datastore if it does not exist yet.
+    '''
+    design_id = '_design/%s' % EVENT_COUNT_DESIGN
+    try:
+        event_store.read_doc(design_id)
+    except NotFound:
+        views = dict((name, {'map': map_function, 'reduce': '_count'}) for name, map_function in EVENT_COUNT_VIEWS.iteritems())
+        event_store.create_doc({'language': 'javascript', 'views': views}, object_id=design_id)
+
+def count_events(event_repo, event_type=None, origin=None, min_datetime=None, max_datetime=None):
+    ''' Counts the events matching the query with a reduce view of the events datastore, so only the count is
+    returned by the datastore. The views must have been defined with define_event_count_views.
+    '''
+    if origin and event_type:
+        view_name, prefix = 'by_origintype', [origin, event_type]
+    elif origin:
+        view_name, prefix = 'by_origin', [origin]
+    elif event_type:
+        view_name, prefix = 'by_type', [event_type]
+    else:
+        view_name, prefix = 'by_time', []
+
+    # an object sorts after any timestamp string in the view collation
+    opts = {
+        'start_key': prefix + [min_datetime] if min_datetime else prefix,
+        'end_key': prefix + [max_datetime or {}],
+    }
+    rows = event_repo.event_store.query_view('%s/%s' % (EVENT_COUNT_DESIGN, view_name), opts=opts)
+    return rows[0]['value'] if rows else 0
@@ -3,29 +3,90 @@
 @file ion/services/dm/utility/resource_tree.py
 @description Builds a D3 JSON Hierarchy Tree based on a resource
 '''
-from interface.services.coi.iresource_registry_service import ResourceRegistryServiceClient
+from pyon.public import Container
 from ion.services.dm.utility.jsonify import JSONtree as jt
 
-tree_depth_max = 5
+tree_depth_max = 10
 
-def build(resource_id, depth=0):
-    ''' Constructs a JSONtree for the specified resource.
 
-    The tree is built downward so all associations from this resource down are included.
+class ResourceTreeBuilder(object):
+    ''' Traverses the associations below a resource breadth first. Each level of the tree is expanded with one bulk
+    read of its resources and one bulk association lookup, and every resource is read and expanded only once, however
+    many times it is reached. The number of calls made to the resource registry is counted in round_trips.
     '''
-    rr_cli = ResourceRegistryServiceClient()
+    def __init__(self, resource_registry, max_depth=tree_depth_max):
+        self.rr = resource_registry
+        self.max_depth = max_depth
+        self.round_trips = 0
+        # resource id -> resource
+        self.resources = {}
+        # resource id -> list of (object id, predicate)
+        self.edges = {}
+
+    def build(self, resource_id):
+        ''' Constructs a JSONtree for the specified resource.
+
+        The tree is built downward so all associations from this resource down are included. A resource reached again
+        below itself is shown as a leaf, breaking the cycle.
+        '''
+        frontier = [resource_id]
+        for depth in xrange(self.max_depth + 1):
+            frontier = [rid for rid in frontier if rid not in self.resources]
+            if not frontier:
+                break
+            self._read_level(frontier)
+            if depth == self.max_depth:
+                break
+            self._expand_level(frontier)
+            frontier = list(set(obj for rid in frontier for obj, pred in self.edges[rid]))
+
+        return self._to_tree(resource_id, None, set())
+
+    def _read_level(self, resource_ids):
+        self.round_trips += 1
+        for resource in self.rr.read_mult(resource_ids):
+            self.resources[resource._id] = resource
 
-    resource = rr_cli.read(resource_id)
-    root = jt(resource.name or resource._id)
-    root.id = resource_id
-    obj_list, assoc_list = rr_cli.find_objects(subject=resource_id,id_only=True)
+    def _expand_level(self, resource_ids):
+        for rid in resource_ids:
+            self.edges[rid] = []
+        if hasattr(self.rr, 'find_objects_mult'):
+            self.round_trips += 1
+            obj_lists, assoc_lists = self.rr.find_objects_mult(subjects=resource_ids, id_only=True)
+            for rid, obj_list, assoc_list in zip(resource_ids, obj_lists, assoc_lists):
+                self.edges[rid] = [(obj, assoc.p) for obj, assoc in zip(obj_list, assoc_list) if obj]
+        else:
+            # no bulk association lookup in this registry
+            for rid in resource_ids:
+                self.round_trips += 1
+                obj_list, assoc_list = self.rr.find_objects(subject=rid, id_only=True)
+                self.edges[rid] = [(obj, assoc.p) for obj, assoc in zip(obj_list, assoc_list) if obj]
 
-    if not obj_list:
-        root.leaf = True
-        return root
+    def _to_tree(self, resource_id, association, ancestors):
+        resource = self.resources[resource_id]
+        node = jt(resource.name or resource._id)
+        node.id = resource_id
+        node.association = association
 
-    for obj,assoc in zip(obj_list,assoc_list):
-        if obj and not (depth > tree_depth_max):
-            root.add_child(build(obj,depth+1),assoc.p)
+        edges = self.edges.get(resource_id)
+        if edges is not None and not edges or resource_id in ancestors:
+            node.leaf = True
+            return node
+        if edges is None:
+            # below the maximum depth
+            return node
 
-    return root
+        ancestors.add(resource_id)
+        for obj, pred in edges:
+            node.add_child(self._to_tree(obj, pred, ancestors), pred)
+        ancestors.remove(resource_id)
+        return node
+
+
+def build(resource_id, max_depth=tree_depth_max, resource_registry=None):
+    ''' Constructs a JSONtree for the specified resource.
+
+    The tree is built downward so all associations from this resource down are included.
+    '''
+    builder = ResourceTreeBuilder(resource_registry or Container.instance.resource_registry, max_depth)
+    return builder.build(resource_id)
@@ -0,0 +1,82 @@
+'''
+@file ion/services/dm/utility/test/test_resource_tree.py
+@description Unit tests for the resource tree traversal
+'''
+from ion.services.dm.utility.resource_tree import ResourceTreeBuilder
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+
+
+class FakeResource(object):
+    def __init__(self, _id, name):
+        self._id = _id
+        self.name = name
+
+class FakeAssociation(object):
+    def __init__(self, p):
+        self.p = p
+
+class FakeResourceRegistry(object):
+    ''' Resource registry counting the calls made to it '''
+    def __init__(self, edges):
+        self.edges = edges
+        self.calls = 0
+
+    def read_mult(self, object_ids):
+        self.calls += 1
+        return [FakeResource(rid, 'name_%s' % rid) for rid in object_ids]
+
+    def find_objects(self, subject='', id_only=False):
+        self.calls += 1
+        edges = self.edges.get(subject, [])
+        return [obj for obj, pred in edges], [FakeAssociation(pred) for obj, pred in edges]
+
+class FakeBulkResourceRegistry(FakeResourceRegistry):
+    def find_objects_mult(self, subjects=None, id_only=False):
+        self.calls += 1
+        results = [self.find_objects(subject) for subject in subjects]
+        self.calls -= len(subjects)
+        return [objs for objs, assocs in results], [assocs for objs, assocs in results]
+
+
+@attr('UNIT', group='dm')
+class ResourceTreeUnitTest(PyonTestCase):
+    def setUp(self):
+        # a binary tree of depth 4 below 'r', with 'x' reachable from two parents and a cycle back to the root
+        self.edges = {}
+        for i in xrange(1, 16):
+            self.edges.setdefault('n%d' % (i // 2) if i > 1 else 'r', []).append(('n%d' % i if i > 1 else 'n1', 'hasChild'))
+        self.edges['n8'] = [('x', 'hasX')]
+        self.edges['n9'] = [('x', 'hasX')]
+        self.edges['x'] = [('r', 'hasRoot')]
+
+    def _names(self, tree):
+        d = tree.__dict__()
+        def walk(d):
+            return [d['name']] + sum([walk(child) for child in d.get('children', [])], [])
+        return walk(d)
+
+    def test_bulk_round_trips(self):
+        rr = FakeBulkResourceRegistry(self.edges)
+        builder = ResourceTreeBuilder(rr, max_depth=20)
+        tree = builder.build('r')
+
+        # one bulk read and one bulk association lookup per level: r, n1, n2-3, n4-7, n8-15 and x
+        self.assertEqual(builder.round_trips, rr.calls)
+        self.assertEqual(builder.round_trips, 12)
+
+        names = self._names(tree)
+        self.assertEqual(names.count('name_x'), 2)
+        # the cycle ends at the root shown as a leaf
+        self.assertEqual(names.count('name_r'), 3)
+        d = tree.__dict__()
+        self.assertEqual(d['children'][0]['association'], 'hasChild')
+
+    def test_max_depth(self):
+        rr = FakeResourceRegistry(self.edges)
+        builder = ResourceTreeBuilder(rr, max_depth=2)
+        tree = builder.build('r')
+        self.assertEqual(sorted(self._names(tree)), ['name_n1', 'name_n2', 'name_n3', 'name_r'])
+        # 3 reads and one association lookup per resource above the last level
+        self.assertEqual(builder.round_trips, 3 + 2)
+        self.assertEqual(rr.calls, builder.round_trips)
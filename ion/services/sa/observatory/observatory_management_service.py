@@ -12,6 +12,7 @@ and the relationships between them
 
 
 from pyon.core.exception import NotFound, BadRequest
+from pyon.event.event import EventSubscriber
 from pyon.public import CFG, IonObject, log, RT, PRED, LCS, LCE
 
 #from pyon.util.log import log
@@ -25,6 +26,8 @@ from ion.services.sa.resource_impl.instrument_site_impl import InstrumentSiteImp
 from ion.services.sa.resource_impl.instrument_device_impl import InstrumentDeviceImpl
 from ion.services.sa.resource_impl.platform_device_impl import PlatformDeviceImpl
 
+from ion.services.sa.observatory.site_hierarchy import SiteHierarchy, SITE_DEPTH, DEFAULT_SITE_HIERARCHY_MAX_AGE
+
 from interface.services.sa.iobservatory_management_service import BaseObservatoryManagementService
 from interface.objects import OrgTypeEnum
 
@@ -42,6 +45,26 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
         self.override_clients(self.clients)
 
+        self.event_subscriber = None
+
+
+    def on_start(self):
+        self.site_hierarchy.max_age = self.CFG.get('site_hierarchy_max_age', DEFAULT_SITE_HIERARCHY_MAX_AGE)
+
+        #Listen for changes made to sites - possibly by other services - and drop the cached site hierarchy
+        self.event_subscriber = EventSubscriber(
+            event_type="ResourceModifiedEvent",
+            callback=self._receive_resource_modified_event
+        )
+        self.event_subscriber.activate()
+
+    def on_quit(self):
+        if self.event_subscriber is not None:
+            self.event_subscriber.deactivate()
+
+    def _receive_resource_modified_event(self, event_msg, headers):
+        if event_msg.origin_type in SITE_DEPTH:
+            self.site_hierarchy.invalidate()
 
     def override_clients(self, new_clients):
         """
@@ -67,6 +90,9 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         self.instrument_device   = InstrumentDeviceImpl(self.clients)
         self.platform_device     = PlatformDeviceImpl(self.clients)
 
+        #frame of reference queries are answered from a cached copy of the site hierarchy
+        self.site_hierarchy = SiteHierarchy(self.clients.resource_registry)
+
 
 
     
@@ -203,6 +229,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
         if parent_id:
             self.subsite.link_parent(subsite_id, parent_id)
+        self.site_hierarchy.invalidate()
 
         return subsite_id
 
@@ -231,6 +258,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         """
 
         self.subsite.delete_one(subsite_id)
+        self.site_hierarchy.invalidate()
 
 
 
@@ -248,6 +276,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
         if parent_id:
             self.platform_site.link_parent(platform_site_id, parent_id)
+        self.site_hierarchy.invalidate()
 
         return platform_site_id
 
@@ -277,6 +306,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         @throws NotFound    object with specified id does not exist
         """
         self.platform_site.delete_one(platform_site_id)
+        self.site_hierarchy.invalidate()
 
 
 
@@ -294,6 +324,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
         if parent_id:
             self.instrument_site.link_parent(instrument_site_id, parent_id)
+        self.site_hierarchy.invalidate()
 
         return instrument_site_id
 
@@ -321,6 +352,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         @throws NotFound    object with specified id does not exist
         """
         self.instrument_site.delete_one(instrument_site_id)
+        self.site_hierarchy.invalidate()
 
 
 
@@ -342,6 +374,7 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         @throws NotFound    object with specified id does not exist
         """
         self.RR.create_association(parent_site_id, PRED.hasSite, child_site_id)
+        self.site_hierarchy.invalidate()
 
         #parent_site_obj = self.subsite.read_one(parent_site_id)
         #parent_site_type = parent_site_obj._get_type()
@@ -375,6 +408,8 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
         else:
             raise BadRequest("Tried to unassign a child site from a %s resource" % parent_site_type)
 
+        self.site_hierarchy.invalidate()
+
 
     def assign_instrument_device_to_instrument_site(self, instrument_device_id='', instrument_site_id=''):
         """Connects a instrument device to instrument site
@@ -422,10 +457,12 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
 
     def assign_site_to_observatory(self, site_id='', observatory_id=''):
         self.observatory.link_site(observatory_id, site_id)
+        self.site_hierarchy.invalidate()
 
 
     def unassign_site_from_observatory(self, site_id="", observatory_id=''):
         self.observatory.unlink_site(observatory_id, site_id)
+        self.site_hierarchy.invalidate()
 
 
     def assign_instrument_model_to_instrument_site(self, instrument_model_id='', instrument_site_id=''):
@@ -562,13 +599,14 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
     def find_related_frames_of_reference(self, input_resource_id='', output_resource_type_list=None):
 
         # the relative depth of each resource type in our tree
-        depth = {RT.InstrumentSite: 4,
-                 RT.PlatformSite: 3,
-                 RT.Subsite: 2,
-                 RT.Observatory: 1,
-                 }
-
-        input_obj  = self.RR.read(input_resource_id)
+        depth = SITE_DEPTH
+
+        input_obj = self.site_hierarchy.read_site(input_resource_id)
+        if input_obj is None:
+            # not a site, or a site created since the hierarchy was read
+            input_obj = self.RR.read(input_resource_id)
+            if input_obj._get_type() in depth:
+                self.site_hierarchy.refresh()
         input_type = input_obj._get_type()
 
         #input type checking
@@ -580,147 +618,13 @@ class ObservatoryManagementService(BaseObservatoryManagementService):
                 raise BadRequest("Output resource types (got %s) must be one of %s" %
                                  (str(output_resource_type_list), str(depth.keys())))
 
-                             
-
-        subordinates = [x for x in output_resource_type_list if depth[x] > depth[input_type]]
-        superiors    = [x for x in output_resource_type_list if depth[x] < depth[input_type]]
-
-        acc = {}
-        acc[input_type] = [input_obj]
-
-
-        if subordinates:
-            # figure out the actual depth we need to go
-            deepest_type = input_type #initial value
-            for output_type in output_resource_type_list:
-                if depth[deepest_type] < depth[output_type]:
-                    deepest_type = output_type
-
-            log.debug("Deepest level for search will be '%s'" % deepest_type)
-
-            acc = self._traverse_entity_tree(acc, input_type, deepest_type, True)
-
-
-        if superiors:
-            highest_type = input_type #initial value
-
-            for output_type in output_resource_type_list:
-                if depth[highest_type] > depth[output_type]:
-                    highest_type = output_type
-
-            log.debug("Highest level for search will be '%s'" % highest_type)
-
-            acc = self._traverse_entity_tree(acc, highest_type, input_type, False)
-
-        # Don't include input type in response            
-        #TODO: maybe just remove the input resource id 
-        if input_type in acc:
-            acc.pop(input_type)            
-        return acc
-                    
-
-    def _traverse_entity_tree(self, acc, top_type, bottom_type, downward):
-
-        call_list = self._build_call_list(top_type, bottom_type, downward)
-
-        # reverse the list and start calling functions
-        if downward:
-            call_list.reverse()
-            for (p, c) in call_list:
-                acc = self._find_subordinate(acc, p, c)
-        else:
-            for (p, c) in call_list:
-                acc = self._find_superior(acc, p, c)
-
-        return acc
-
-
-    def _build_call_list(self, top_type, bottom_type, downward):
-        # the possible parent types that a resource can have
-        hierarchy_dependencies =  {
-            RT.InstrumentSite: [RT.PlatformSite],
-            RT.PlatformSite:   [RT.PlatformSite, RT.Subsite],
-            RT.Subsite:        [RT.Subsite, RT.Observatory],
-            }
-
-        call_list = []
-        target_type = bottom_type
-        while True:
-            if downward and (target_type == top_type):
-                return call_list
-
-            if (not downward) and (target_type == top_type):
-                if not (target_type in hierarchy_dependencies and
-                        target_type in hierarchy_dependencies[target_type]):
-                    return call_list
-
-            for requisite_type in hierarchy_dependencies[target_type]:
-                #should cause errors if they stray from allowed inputs
-                call_list.append((requisite_type, target_type))
-
-                if not downward and top_type == requisite_type == target_type:
-                    return call_list
-            
-            #latest solved type is the latest result
-            target_type = requisite_type
-        
-                
-            
-
-
-    def _find_subordinate(self, acc, parent_type, child_type):
-        #acc is an accumulated dictionary
-
-        if not child_type in acc:
-            acc[child_type] = []
-            
-        find_fn = {
-            (RT.Observatory, RT.Subsite):         self.observatory.find_stemming_site,
-            (RT.Subsite, RT.Subsite):             self.subsite.find_stemming_subsite,
-            (RT.Subsite, RT.PlatformSite):        self.subsite.find_stemming_platform_site,
-            (RT.PlatformSite, RT.PlatformSite):   self.platform_site.find_stemming_platform_site,
-            (RT.PlatformSite, RT.InstrumentSite): self.platform_site.find_stemming_instrument_site,
-            }[(parent_type, child_type)]
-        
-        log.debug("Subordinates: '%s'x%d->'%s'" % (parent_type, len(acc[parent_type]), child_type))
-
-        #for all parents in the acc, add all their children
-        for parent_obj in acc[parent_type]:
-            parent_id = parent_obj._id
-            for child_obj in find_fn(parent_id):
-                acc[child_type].append(child_obj)
-
-        return acc
-
-
-
-    def _find_superior(self, acc, parent_type, child_type):
-        # acc is an accumualted dictionary
-
-        if not parent_type in acc:
-            acc[parent_type] = []
-
-        #log.debug("Superiors: '%s'->'%s'" % (parent_type, child_type))
-        #if True:
-        #    return acc
-            
-        find_fn = {
-            (RT.Observatory, RT.Subsite):         self.observatory.find_having_site,
-            (RT.Subsite, RT.Subsite):             self.subsite.find_having_site,
-            (RT.Subsite, RT.PlatformSite):        self.subsite.find_having_site,
-            (RT.PlatformSite, RT.PlatformSite):   self.platform_site.find_having_site,
-            (RT.PlatformSite, RT.InstrumentSite): self.platform_site.find_having_site,
-            }[(parent_type, child_type)]
-        
-        log.debug("Superiors: '%s'->'%s'x%d" % (parent_type, child_type, len(acc[child_type])))
-
-        #for all children in the acc, add all their parents
-        for child_obj in acc[child_type]:
-            child_id = child_obj._id
-            for parent_obj in find_fn(child_id):
-                acc[parent_obj._get_type()].append(parent_obj)
+        # the results include every type between the input type and the deepest and highest requested types
+        min_depth = min([depth[t] for t in output_resource_type_list] + [depth[input_type]])
+        max_depth = max([depth[t] for t in output_resource_type_list] + [depth[input_type]])
+        log.debug("Search for frames of reference of '%s' between depths %d and %d" % (input_type, min_depth, max_depth))
 
-        return acc
+        # Don't include input type in response
+        return self.site_hierarchy.find_related(input_resource_id, min_depth, max_depth)
 
 
 
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+'''
+@package ion.services.sa.observatory.site_hierarchy
+@file ion/services/sa/observatory/site_hierarchy.py
+@brief In memory graph of the observatory, subsite, platform site and instrument site hierarchy
+'''
+
+import time
+from collections import deque
+
+from pyon.public import RT, PRED
+
+
+# the relative depth of each resource type in the hierarchy
+SITE_DEPTH = {RT.InstrumentSite: 4,
+              RT.PlatformSite: 3,
+              RT.Subsite: 2,
+              RT.Observatory: 1,
+              }
+
+# seconds after which the hierarchy is read again even if it was not invalidated
+DEFAULT_SITE_HIERARCHY_MAX_AGE = 60
+
+
+class SiteHierarchy(object):
+    """
+    The site resources and the hasSite associations between them, read from the resource registry with one call per
+    site type and one association query. Frame of reference queries are then answered from memory, whatever the
+    depth of the hierarchy. The graph is read again when invalidated or when older than max_age seconds.
+    """
+
+    def __init__(self, resource_registry, max_age=DEFAULT_SITE_HIERARCHY_MAX_AGE):
+        self.RR = resource_registry
+        self.max_age = max_age
+        self.timestamp = None
+        # site id -> site resource
+        self.sites = {}
+        # site id -> list of child site ids / parent site ids
+        self.children = {}
+        self.parents = {}
+
+    def invalidate(self):
+        self.timestamp = None
+
+    def refresh(self):
+        sites = {}
+        for site_type in SITE_DEPTH:
+            site_objs, _ = self.RR.find_resources(restype=site_type, id_only=False)
+            for site_obj in site_objs:
+                sites[site_obj._id] = site_obj
+
+        children = {}
+        parents = {}
+        for assoc in self.RR.find_associations(predicate=PRED.hasSite, id_only=False):
+            # hasSite also links other resources, only keep the site to site associations
+            if assoc.s in sites and assoc.o in sites:
+                children.setdefault(assoc.s, []).append(assoc.o)
+                parents.setdefault(assoc.o, []).append(assoc.s)
+
+        self.sites, self.children, self.parents = sites, children, parents
+        self.timestamp = time.time()
+
+    def read_site(self, site_id):
+        """
+        Returns the site resource with the given id, or None if it is not a site known to the hierarchy.
+        """
+        if self.timestamp is None or time.time() - self.timestamp > self.max_age:
+            self.refresh()
+        return self.sites.get(site_id)
+
+    def find_related(self, site_id, min_depth, max_depth):
+        """
+        Returns the sites above and below site_id whose type depth is between min_depth and max_depth, as a dict of
+        type to list of site resources, with an entry for every type in that range. The traversal goes through
+        sites of the same type (subsites of subsites, platform sites of platform sites) at any depth.
+        """
+        if self.timestamp is None or time.time() - self.timestamp > self.max_age:
+            self.refresh()
+
+        site_depth = SITE_DEPTH[self.sites[site_id]._get_type()]
+        related = dict((site_type, []) for site_type, depth in SITE_DEPTH.iteritems()
+                       if min_depth <= depth <= max_depth and depth != site_depth)
+
+        if max_depth > site_depth:
+            self._collect(site_id, self.children, site_depth, max_depth, related)
+        if min_depth < site_depth:
+            self._collect(site_id, self.parents, min_depth, site_depth, related)
+        return related
+
+    def _collect(self, site_id, edges, min_depth, max_depth, related):
+        visited = set([site_id])
+        queue = deque([site_id])
+        while queue:
+            for next_id in edges.get(queue.popleft(), ()):
+                next_obj = self.sites[next_id]
+                depth = SITE_DEPTH[next_obj._get_type()]
+                if next_id in visited or not min_depth <= depth <= max_depth:
+                    continue
+                visited.add(next_id)
+                queue.append(next_id)
+                if next_obj._get_type() in related:
+                    related[next_obj._get_type()].append(next_obj)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+'''
+@file ion/services/sa/observatory/test/test_site_hierarchy.py
+@test ion.services.sa.observatory.site_hierarchy Unit tests for the cached site hierarchy
+'''
+
+from ion.services.sa.observatory.site_hierarchy import SiteHierarchy, SITE_DEPTH
+from nose.plugins.attrib import attr
+from pyon.util.unit_test import PyonTestCase
+from pyon.public import RT, PRED
+
+
+class FakeResource(object):
+    def __init__(self, _id, restype):
+        self._id = _id
+        self.restype = restype
+
+    def _get_type(self):
+        return self.restype
+
+class FakeAssociation(object):
+    def __init__(self, s, p, o):
+        self.s, self.p, self.o = s, p, o
+
+class FakeResourceRegistry(object):
+    def __init__(self):
+        self.resources = {}
+        self.assocs = []
+        self.calls = 0
+
+    def create(self, _id, restype):
+        self.resources[_id] = FakeResource(_id, restype)
+
+    def create_association(self, s, p, o):
+        self.assocs.append(FakeAssociation(s, p, o))
+
+    def find_resources(self, restype='', id_only=False):
+        self.calls += 1
+        return [res for res in self.resources.values() if res.restype == restype], []
+
+    def find_associations(self, predicate='', id_only=False):
+        self.calls += 1
+        return [assoc for assoc in self.assocs if assoc.p == predicate]
+
+
+@attr('UNIT', group='sa')
+class TestSiteHierarchy(PyonTestCase):
+
+    def setUp(self):
+        # same hierarchy as the observatory management integration tests, with a device also linked by hasSite
+        self.RR = FakeResourceRegistry()
+        self.RR.create('obs', RT.Observatory)
+        self.RR.create('sub1', RT.Subsite)
+        self.RR.create('sub2', RT.Subsite)
+        self.RR.create('ps1', RT.PlatformSite)
+        self.RR.create('ps2', RT.PlatformSite)
+        self.RR.create('is1', RT.InstrumentSite)
+        self.RR.create('dev', RT.InstrumentDevice)
+        self.RR.create_association('obs', PRED.hasSite, 'sub1')
+        self.RR.create_association('sub1', PRED.hasSite, 'sub2')
+        self.RR.create_association('sub2', PRED.hasSite, 'ps1')
+        self.RR.create_association('ps1', PRED.hasSite, 'ps2')
+        self.RR.create_association('ps1', PRED.hasSite, 'is1')
+        self.RR.create_association('dev', PRED.hasSite, 'is1')
+
+        self.hierarchy = SiteHierarchy(self.RR)
+
+    def _ids(self, related):
+        return dict((k, sorted(obj._id for obj in v)) for k, v in related.iteritems())
+
+    def test_subordinates(self):
+        ret = self._ids(self.hierarchy.find_related('obs', SITE_DEPTH[RT.Observatory], SITE_DEPTH[RT.InstrumentSite]))
+        self.assertEqual(ret, {RT.Subsite: ['sub1', 'sub2'], RT.PlatformSite: ['ps1', 'ps2'], RT.InstrumentSite: ['is1']})
+
+        ret = self._ids(self.hierarchy.find_related('obs', SITE_DEPTH[RT.Observatory], SITE_DEPTH[RT.PlatformSite]))
+        self.assertEqual(ret, {RT.Subsite: ['sub1', 'sub2'], RT.PlatformSite: ['ps1', 'ps2']})
+
+    def test_superiors(self):
+        ret = self._ids(self.hierarchy.find_related('is1', SITE_DEPTH[RT.Subsite], SITE_DEPTH[RT.InstrumentSite]))
+        self.assertEqual(ret, {RT.Subsite: ['sub1', 'sub2'], RT.PlatformSite: ['ps1']})
+
+        ret = self._ids(self.hierarchy.find_related('is1', SITE_DEPTH[RT.Observatory], SITE_DEPTH[RT.InstrumentSite]))
+        self.assertEqual(ret[RT.Observatory], ['obs'])
+
+    def test_cached_until_invalidated(self):
+        self.hierarchy.find_related('obs', 1, 4)
+        calls = self.RR.calls
+        # the number of registry calls does not depend on the depth of the hierarchy
+        self.assertEqual(calls, len(SITE_DEPTH) + 1)
+        self.hierarchy.find_related('is1', 1, 4)
+        self.assertEqual(self.RR.calls, calls)
+
+        self.RR.create('ps3', RT.PlatformSite)
+        self.RR.create_association('sub1', PRED.hasSite, 'ps3')
+        self.hierarchy.invalidate()
+        ret = self._ids(self.hierarchy.find_related('obs', 1, 3))
+        self.assertEqual(ret[RT.PlatformSite], ['ps1', 'ps2', 'ps3'])
@@ -7,12 +7,18 @@
 @brief    DRY = Don't Repeat Yourself; base class for CRUD, LCS, and association ops on any ION resource
 """
 
+from gevent.pool import Pool
+
 from pyon.core.exception import BadRequest, NotFound, Inconsistent
 #from pyon.core.bootstrap import IonObject
 from pyon.public import PRED, RT, LCE
 from pyon.util.log import log
 
 
+# number of registry calls the bulk operations have in flight at once
+BULK_CONCURRENCY = 10
+
+
 ######
 """
 now TODO
@@ -228,6 +234,75 @@ class ResourceImpl(object):
                            
 
 
+    def _check_names(self, resource_type, primary_objects, verb):
+        """
+        determine whether resources with the same type and any of the names already exist, with the
+        name queries made concurrently.  the registry has no bulk name lookup, so this is still one
+        registry call per resource
+        @param resource_type the IonObject type
+        @param primary_objects the resources to be checked
+        @param verb what will happen to these objects (like "to be created")
+        @raises BadRequest if a name exists already, appears twice in primary_objects or wasn't set
+        """
+        names = set()
+        for primary_object in primary_objects:
+            if not (hasattr(primary_object, "name") and "" != primary_object.name):
+                raise BadRequest("The name field was not set in the resource %s"
+                                 % verb)
+            if primary_object.name in names:
+                raise BadRequest("More than one %s resource %s is named '%s'"
+                                 % (resource_type, verb, primary_object.name))
+            names.add(primary_object.name)
+
+        found = self._call_many(self._find_ids_named,
+                                [(resource_type, primary_object.name) for primary_object in primary_objects])
+
+        for primary_object, found_res in zip(primary_objects, found):
+            name = primary_object.name
+
+            # should never be more than one with a given name
+            if 1 < len(found_res):
+                raise Inconsistent("Multiple %s resources with name '%s' exist" % (resource_type, name))
+
+            # if creating
+            if not hasattr(primary_object, "_id"):
+                # must not be any matching names
+                if 0 < len(found_res):
+                    raise BadRequest("%s resource named '%s' already exists with ID '%s'"
+                                     % (resource_type, name, found_res[0]))
+            else: #updating
+            # any existing name must match the id
+                if 1 == len(found_res) and primary_object._id != found_res[0]:
+                    raise BadRequest("%s resource named '%s' already exists with a different ID"
+                                     % (resource_type, name))
+
+
+    def _find_ids_named(self, resource_type, name):
+        """
+        find the ids of the resources of a type with a given name
+        """
+        try:
+            found_res, _ = self.RR.find_resources(resource_type, None, name, True)
+        except NotFound:
+            found_res = []
+        return found_res
+
+
+    def _call_many(self, fn, args_list):
+        """
+        make one registry call per set of arguments, BULK_CONCURRENCY of them at a time.  this only
+        overlaps the round trips of the calls, it does not save any of them
+        @param fn the registry function
+        @param args_list a list of argument tuples
+        @retval the list of results, in the order of args_list
+        @raises the first error raised by a call, after all the calls have completed
+        """
+        pool = Pool(size=BULK_CONCURRENCY)
+        calls = [pool.spawn(fn, *args) for args in args_list]
+        pool.join()
+        return [call.get() for call in calls]
+
+
     def _get_resource_type(self, resource):
         """
         get the type of a resource... simple wrapper
@@ -311,6 +386,31 @@ class ResourceImpl(object):
         return self._return_create(primary_object_id)
 
 
+    def create_many(self, primary_objects=None):
+        """
+        create many objects of the predefined type.  the names are checked all at once
+        and the objects are created concurrently
+        @param primary_objects a list of IonObject resources of the proper type
+        @retval the list of resource IDs, in the order of primary_objects
+        """
+        primary_objects = primary_objects or []
+
+        # Validate the input filter and augment context as required
+        self._check_names(self.iontype, primary_objects, "to be created")
+
+        for primary_object in primary_objects:
+            self.on_pre_create(primary_object)
+
+        #persist
+        results = self._call_many(self.RR.create, [(primary_object,) for primary_object in primary_objects])
+        primary_object_ids = [primary_object_id for primary_object_id, _ in results]
+
+        for primary_object_id, primary_object in zip(primary_object_ids, primary_objects):
+            self.on_post_create(primary_object_id, primary_object)
+
+        return [self._return_create(primary_object_id) for primary_object_id in primary_object_ids]
+
+
     def update_one(self, primary_object={}):
         """
         update a single object of the predefined type
@@ -399,6 +499,50 @@ class ResourceImpl(object):
         return ret
 
 
+    def _find_having_many(self, association_predicate, some_objects):
+        """
+        find resources having ____, for many objects at once:
+          find resources of the predefined type that have the given
+          association attached to each of the objects, with the queries
+          for the objects made concurrently.  the registry has no bulk
+          find_subjects, so this is still one registry call per object
+        @param association_predicate one of the association types
+        @param some_objects the ids of the objects "owned" by the association type
+        @retval dict of object id to the list of resources having it
+        """
+        some_objects = list(set(some_objects))
+        found = self._call_many(self._find_having, [(association_predicate, some_object)
+                                                    for some_object in some_objects])
+        return dict(zip(some_objects, found))
+
+    def _find_stemming_many(self, primary_object_ids, association_predicate, some_object_type):
+        """
+        find resources stemming from _____, for many primary objects at once:
+          find resources of the given object type that are associated
+          with each of the primary objects, in a single find_objects_mult
+          call if the registry has it and with the queries for the primary
+          objects made concurrently otherwise
+        @param primary_object_ids the ids of the primary objects
+        @param association_prediate the association type
+        @param some_object_type the type of associated object
+        @retval dict of primary object id to the list of resources stemming from it
+        """
+        primary_object_ids = list(set(primary_object_ids))
+        if not primary_object_ids:
+            return {}
+
+        if hasattr(self.RR, 'find_objects_mult'):
+            # the bulk lookup returns the objects of every association of the primary objects
+            obj_lists, assoc_lists = self.RR.find_objects_mult(subjects=primary_object_ids, id_only=False)
+            found = [[obj for obj, assoc in zip(obj_list, assoc_list)
+                      if obj and assoc.p == association_predicate and assoc.ot == some_object_type]
+                     for obj_list, assoc_list in zip(obj_lists, assoc_lists)]
+        else:
+            found = self._call_many(self._find_stemming, [(primary_object_id, association_predicate, some_object_type)
+                                                          for primary_object_id in primary_object_ids])
+        return dict(zip(primary_object_ids, found))
+
+
     def _find_having_single(self, association_predicate, some_object):
         """
         enforces exclusivity: 0 or 1 association allowed
@@ -478,6 +622,27 @@ class ResourceImpl(object):
         return associate_success
 
 
+    def _link_resources_many(self, association_type='', subject_object_ids=None):
+        """
+        create many associations of one type, concurrently.  the registry has no bulk
+        create_association, so this is still one registry call per association
+        @param association_type the predicate
+        @param subject_object_ids list of (subject_id, object_id) tuples
+        @retval the list of create_association results, in the order of subject_object_ids
+        """
+        subject_object_ids = subject_object_ids or []
+        for subject_id, object_id in subject_object_ids:
+            assert(type("") == type(subject_id) == type(object_id))
+
+        associate_success = self._call_many(self.RR.create_association,
+                                            [(subject_id, association_type, object_id)
+                                             for subject_id, object_id in subject_object_ids])
+
+        log.debug("Created %d %s Associations"
+                  % (len(associate_success), self._assn_name(association_type)))
+        return associate_success
+
+
     def _link_resources_single_object(self, subject_id='', association_type='', object_id='', raise_exn=True):
         """
         create an association where only one object at a time can exist
@@ -8,9 +8,11 @@
 import hashlib
 
 # from mock import Mock, sentinel, patch
+from mock import Mock
 from pyon.core.bootstrap import IonObject
+from pyon.util.containers import DotDict
 from pyon.core.exception import BadRequest, NotFound
-from pyon.public import LCS
+from pyon.public import LCS, PRED, RT
 from unittest import SkipTest
 
 class ResourceImplMetatest(object):
@@ -346,6 +348,175 @@ class ResourceImplMetatest(object):
 
 
 
+        def gen_test_create_many():
+            """
+            generate the function to test the bulk create
+            """
+            def fun(self):
+                """
+                self is an instance of the tester class
+                """
+                # get objects
+                svc = self._rim_getservice()
+                myimpl = getattr(svc, impl_attr)
+                good_sample_resources = [sample_resource(), sample_resource()]
+                good_sample_resources[1].name = "other %s" % good_sample_resources[1].name
+
+                #configure Mock
+                svc.clients.resource_registry.create.return_value = ('111', 'bla')
+                svc.clients.resource_registry.find_resources.return_value = ([], [])
+
+                sample_resource_ids = myimpl.create_many(good_sample_resources)
+
+                #one name check per resource, by name and for ids only
+                self.assertEqual(svc.clients.resource_registry.find_resources.call_count, 2)
+                names = sorted(args[2] for args, _ in svc.clients.resource_registry.find_resources.call_args_list)
+                self.assertEqual(names, sorted(r.name for r in good_sample_resources))
+                for args, _ in svc.clients.resource_registry.find_resources.call_args_list:
+                    self.assertEqual(args[3], True)
+                self.assertEqual(svc.clients.resource_registry.create.call_count, 2)
+                self.assertEqual(sample_resource_ids, ['111', '111'])
+
+            name = make_name("resource_impl_create_many")
+            doc  = make_doc("Creation of many new %s resources" % impl_instance.iontype)
+            add_test_method(name, doc, fun)
+
+
+        def gen_test_create_many_bad_dupname():
+            """
+            generate the function to test the bulk create in bad cases where a name is duplicated
+            """
+            def fun(self):
+                """
+                self is an instance of the tester class
+                """
+                # get objects
+                svc = self._rim_getservice()
+                myimpl = getattr(svc, impl_attr)
+
+                #configure Mock
+                svc.clients.resource_registry.create.return_value = ('111', 'bla')
+                svc.clients.resource_registry.find_resources.return_value = (['222'], [])
+
+                #name already in the registry
+                self.assertRaises(BadRequest, myimpl.create_many, [sample_resource()])
+
+                #name used twice in the request
+                svc.clients.resource_registry.find_resources.return_value = ([], [])
+                self.assertRaises(BadRequest, myimpl.create_many, [sample_resource(), sample_resource()])
+
+                self.assertEqual(svc.clients.resource_registry.create.call_count, 0)
+
+            name = make_name("resource_impl_create_many_bad_dupname")
+            doc  = make_doc("Creation of (bad) new %s resources (duplicate names)" % impl_instance.iontype)
+            add_test_method(name, doc, fun)
+
+
+        def gen_test_find_having_many():
+            """
+            generate the function to test the bulk find of resources having an association
+            """
+            def fun(self):
+                svc = self._rim_getservice()
+                myimpl = getattr(svc, impl_attr)
+
+                #set up Mock: each object is owned by a resource of its own
+                def find_subjects(subject_type, predicate, object_id, id_only):
+                    return (['owner of %s' % object_id], ['444'])
+                svc.clients.resource_registry.find_subjects.side_effect = find_subjects
+
+                #call the impl, a repeated id is looked up once
+                response = myimpl._find_having_many(PRED.hasModel, ['111', '222', '111'])
+                self.assertEqual(response, {'111': ['owner of 111'], '222': ['owner of 222']})
+                self.assertEqual(svc.clients.resource_registry.find_subjects.call_count, 2)
+                for args, _ in svc.clients.resource_registry.find_subjects.call_args_list:
+                    self.assertEqual(args[0], impl_instance.iontype)
+                    self.assertEqual(args[1], PRED.hasModel)
+                self.assertEqual(svc.clients.resource_registry.find_resources.call_count, 0)
+
+            name = make_name("resource_impl_find_having_many")
+            doc  = make_doc("Checking the bulk find of %s resources having an association" % impl_instance.iontype)
+            add_test_method(name, doc, fun)
+
+
+        def gen_test_find_stemming_many():
+            """
+            generate the function to test the bulk find of resources stemming from an association
+            """
+            def fun(self):
+                svc = self._rim_getservice()
+                myimpl = getattr(svc, impl_attr)
+
+                #set up Mock: the bulk lookup returns the objects of every association of each subject
+                def find_objects_mult(subjects, id_only):
+                    return ([['%s of %s' % (RT.InstrumentModel, subject_id), 'other of %s' % subject_id,
+                              'agent of %s' % subject_id] for subject_id in subjects],
+                            [[DotDict(p=PRED.hasModel, ot=RT.InstrumentModel), DotDict(p=PRED.hasModel, ot=RT.Stream),
+                              DotDict(p=PRED.hasAgentInstance, ot=RT.InstrumentModel)] for subject_id in subjects])
+                svc.clients.resource_registry.find_objects_mult = Mock(side_effect=find_objects_mult)
+
+                #call the impl, a repeated id is looked up once
+                response = myimpl._find_stemming_many(['111', '222', '111'], PRED.hasModel, RT.InstrumentModel)
+                self.assertEqual(response, {'111': ['%s of 111' % RT.InstrumentModel],
+                                            '222': ['%s of 222' % RT.InstrumentModel]})
+                self.assertEqual(svc.clients.resource_registry.find_objects_mult.call_count, 1)
+                self.assertEqual(svc.clients.resource_registry.find_objects.call_count, 0)
+                self.assertEqual(svc.clients.resource_registry.find_resources.call_count, 0)
+
+                #without the bulk lookup, one query per id
+                del svc.clients.resource_registry.find_objects_mult
+                def find_objects(subject_id, predicate, object_type, id_only):
+                    return (['%s of %s' % (object_type, subject_id)], ['444'])
+                svc.clients.resource_registry.find_objects.side_effect = find_objects
+
+                response = myimpl._find_stemming_many(['111', '222'], PRED.hasModel, RT.InstrumentModel)
+                self.assertEqual(response, {'111': ['%s of 111' % RT.InstrumentModel],
+                                            '222': ['%s of 222' % RT.InstrumentModel]})
+                self.assertEqual(svc.clients.resource_registry.find_objects.call_count, 2)
+
+                #nothing to look up
+                self.assertEqual(myimpl._find_stemming_many([], PRED.hasModel, RT.InstrumentModel), {})
+
+            name = make_name("resource_impl_find_stemming_many")
+            doc  = make_doc("Checking the bulk find of resources stemming from %s resources" % impl_instance.iontype)
+            add_test_method(name, doc, fun)
+
+
+        def gen_test_link_resources_many():
+            """
+            generate the function to test the bulk create_association
+            """
+            def fun(self):
+                svc = self._rim_getservice()
+                myimpl = getattr(svc, impl_attr)
+
+                #set up Mock
+                def create_association(subject_id, predicate, object_id):
+                    return ('%s-%s' % (subject_id, object_id), 'bla')
+                svc.clients.resource_registry.create_association.side_effect = create_association
+
+                #call the impl, the results come back in order
+                response = myimpl._link_resources_many(PRED.hasModel, [("111", "222"), ("333", "444")])
+                self.assertEqual(response, [('111-222', 'bla'), ('333-444', 'bla')])
+                for args, _ in svc.clients.resource_registry.create_association.call_args_list:
+                    self.assertEqual(args[1], PRED.hasModel)
+
+                #all the associations are attempted before the error is raised
+                def create_association(subject_id, predicate, object_id):
+                    if "111" == subject_id:
+                        raise BadRequest("bad association")
+                    return ('%s-%s' % (subject_id, object_id), 'bla')
+                svc.clients.resource_registry.create_association.side_effect = create_association
+                svc.clients.resource_registry.create_association.reset_mock()
+                self.assertRaises(BadRequest, myimpl._link_resources_many, PRED.hasModel,
+                                  [("111", "222"), ("333", "444")])
+                self.assertEqual(svc.clients.resource_registry.create_association.call_count, 2)
+
+            name = make_name("resource_impl_link_resources_many")
+            doc  = make_doc("Checking the bulk create_association of %s resources" % impl_instance.iontype)
+            add_test_method(name, doc, fun)
+
+
         def gen_test_read():
             """
             generate the function to test the read
@@ -715,6 +886,11 @@ class ResourceImplMetatest(object):
         gen_test_create()
         gen_test_create_bad_noname()
         gen_test_create_bad_dupname()
+        gen_test_create_many()
+        gen_test_create_many_bad_dupname()
+        gen_test_find_having_many()
+        gen_test_find_stemming_many()
+        gen_test_link_resources_many()
         gen_test_read()
         gen_test_update()
         gen_test_update_bad_dupname()